@@ -0,0 +1,131 @@
+# backend/app/admission.py
+import os
+from collections import Counter
+from typing import Optional, Set, Tuple
+
+import anyio.to_thread
+from dotenv import load_dotenv
+from starlette.responses import JSONResponse
+
+from .database import pool_waits
+from .loop_monitor import loop_monitor
+
+load_dotenv()
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# どれか1つでも超えたら過負荷とみなす
+ADMISSION_LOOP_LAG_MS = float(os.getenv("ADMISSION_LOOP_LAG_MS", "100"))
+# ループ遅延は直近の心拍のこの分位点で見る（0.5 なら窓の半分以上が遅れているときだけ）
+ADMISSION_LOOP_LAG_QUANTILE = float(os.getenv("ADMISSION_LOOP_LAG_QUANTILE", "0.5"))
+ADMISSION_THREADPOOL_QUEUE = int(os.getenv("ADMISSION_THREADPOOL_QUEUE", "20"))
+ADMISSION_DB_WAIT_MS = float(os.getenv("ADMISSION_DB_WAIT_MS", "100"))
+# 断ったときに返す Retry-After（秒）
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+# 過負荷のときに 503 で断るルート（"METHOD パス" のカンマ区切り）。
+# 対戦 (/ws/...) と出題 (/api/problem) はここに入れず、空いた分をそちらに回す
+ADMISSION_LOW_PRIORITY = os.getenv(
+    "ADMISSION_LOW_PRIORITY", "POST /api/register,POST /api/rooms,GET /api/sets"
+)
+
+
+def _parse_routes(spec: str) -> Set[Tuple[str, str]]:
+    routes = set()
+    for item in spec.split(","):
+        parts = item.split()
+        if len(parts) == 2:
+            routes.add((parts[0].upper(), parts[1].rstrip("/") or "/"))
+    return routes
+
+
+def threadpool_waiting() -> int:
+    """同期ハンドラ用のスレッドプール（anyio の既定の枠）が空くのを待っているリクエスト数"""
+    return anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+
+
+class AdmissionController:
+    """
+    イベントループの遅延・スレッドプールの待ち行列・DB 接続プールの待ち時間を見て、
+    過負荷の間は優先度の低いルートを受け付けずに 503 を返す。
+    判定はリクエストごとに数値を読むだけなので、平常時のコストはほぼ無い。
+    """
+
+    def __init__(self, low_priority: str = ADMISSION_LOW_PRIORITY):
+        self.low_priority = _parse_routes(low_priority)
+        self.admitted = 0
+        self.shed: Counter = Counter()
+        self.shed_routes: Counter = Counter()
+
+    def is_low_priority(self, method: str, path: str) -> bool:
+        return (method, path.rstrip("/") or "/") in self.low_priority
+
+    def signals(self) -> dict:
+        return {
+            "loopLagMs": loop_monitor.sustained_lag_ms(ADMISSION_LOOP_LAG_QUANTILE),
+            "threadpoolWaiting": threadpool_waiting(),
+            "dbWaitMs": pool_waits.recent_ms(),
+        }
+
+    def overload_reason(self) -> Optional[str]:
+        """過負荷なら理由（どの指標が閾値を超えたか）、平常なら None"""
+        if loop_monitor.sustained_lag_ms(ADMISSION_LOOP_LAG_QUANTILE) > ADMISSION_LOOP_LAG_MS:
+            return "loop_lag"
+        if threadpool_waiting() > ADMISSION_THREADPOOL_QUEUE:
+            return "threadpool"
+        if pool_waits.recent_ms() > ADMISSION_DB_WAIT_MS:
+            return "db_pool"
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "signals": {k: round(v, 2) for k, v in self.signals().items()},
+            "thresholds": {
+                "loopLagMs": ADMISSION_LOOP_LAG_MS,
+                "threadpoolWaiting": ADMISSION_THREADPOOL_QUEUE,
+                "dbWaitMs": ADMISSION_DB_WAIT_MS,
+            },
+            "overloaded": self.overload_reason(),
+            "lowPriority": sorted(f"{m} {p}" for m, p in self.low_priority),
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "shedRoutes": dict(self.shed_routes),
+            "dbPool": pool_waits.stats(),
+        }
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """
+    優先度の低いルートだけを過負荷時に断る。WebSocket やその他のルートは素通しする。
+    ハンドラ（スレッドプール・DB）に届く前に返すので、断ったリクエストは負荷を増やさない。
+    """
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if (
+            not ADMISSION_ENABLED
+            or scope["type"] != "http"
+            or not self.controller.is_low_priority(scope["method"], scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        reason = self.controller.overload_reason()
+        if reason is None:
+            self.controller.admitted += 1
+            await self.app(scope, receive, send)
+            return
+
+        self.controller.shed[reason] += 1
+        self.controller.shed_routes[f"{scope['method']} {scope['path'].rstrip('/') or '/'}"] += 1
+        response = JSONResponse(
+            {"detail": "サーバーが混み合っています。しばらくしてからもう一度お試しください"},
+            status_code=503,
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+        )
+        await response(scope, receive, send)
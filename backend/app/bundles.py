@@ -0,0 +1,124 @@
+# backend/app/bundles.py
+import gzip
+import hashlib
+import json
+import os
+import random
+import threading
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from . import models
+from .serializers import InvalidWords, load_words
+
+load_dotenv()
+
+BUNDLE_DIR = os.getenv("BUNDLE_DIR", "./bundles")
+# バンドルに含めるシード表の長さ（クライアントは出題番号 % この長さ で使う）
+BUNDLE_SEED_COUNT = 64
+BUNDLE_FORMAT = 1
+
+CACHE_IMMUTABLE_PUBLIC = "public, max-age=31536000, immutable"
+CACHE_IMMUTABLE_PRIVATE = "private, max-age=31536000, immutable"
+
+
+def build_bundle(memory_set: models.MemorySet) -> Tuple[str, bytes]:
+    """
+    セットの内容から (ハッシュ, バンドル本体) を作る。
+    同じ内容なら同じバイト列になるよう、キーを並べて区切りを固定した JSON にする。
+    """
+    try:
+        words = load_words(memory_set)
+    except InvalidWords:
+        words = []
+    content = {
+        "format": BUNDLE_FORMAT,
+        "setId": str(memory_set.id),
+        "title": memory_set.title,
+        "words": words,
+        "settings": {
+            "memorizeTime": memory_set.memorize_time,
+            "answerTime": memory_set.answer_time,
+            "questionsPerRound": memory_set.questions_per_round,
+            "winScore": memory_set.win_score,
+            "conditionType": memory_set.condition_type,
+            "orderType": memory_set.order_type,
+        },
+    }
+    canonical = json.dumps(content, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+    # 出題とシャッフル用のシード表も内容から決まる（同じバンドルなら誰が作っても同じ）
+    rng = random.Random(digest)
+    content["seeds"] = [rng.getrandbits(32) for _ in range(BUNDLE_SEED_COUNT)]
+    content["hash"] = digest
+    body = json.dumps(content, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return digest, body
+
+
+def source_key(memory_set: models.MemorySet) -> str:
+    """
+    バンドルの元になる列だけから作るキー。単語の解析や整形をせずに、
+    前回バンドルを作った時から内容が変わったかどうかを判定できる。
+    """
+    source = json.dumps([
+        memory_set.title, memory_set.words_json, memory_set.memorize_time, memory_set.answer_time,
+        memory_set.questions_per_round, memory_set.win_score, memory_set.condition_type, memory_set.order_type,
+    ], ensure_ascii=False)
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+class BundleStore:
+    """
+    バンドルは初回の要求時に作ってディスクに置き、以後はファイルを返すだけにする。
+    セットごとの「現在のハッシュ」は元の列のキー（source_key）と一緒にメモリに持ち、
+    キーが変わっていれば作り直す（他のワーカーで更新されたセットも古いハッシュを返さない）。
+    """
+
+    def __init__(self, directory: str = BUNDLE_DIR):
+        self.directory = directory
+        # set_id -> (source_key, ハッシュ, 公開か)
+        self.current: Dict[int, Tuple[str, str, bool]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, digest: str, public: bool) -> str:
+        return os.path.join(self.directory, "public" if public else "private", f"{digest}.json")
+
+    def current_hash(self, memory_set: models.MemorySet) -> str:
+        public = bool(memory_set.is_public or memory_set.is_official)
+        key = source_key(memory_set)
+        cached = self.current.get(memory_set.id)
+        if cached is not None and cached[0] == key and cached[2] == public \
+                and os.path.exists(self._path(cached[1], public)):
+            return cached[1]
+
+        digest, body = build_bundle(memory_set)
+        path = self._path(digest, public)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._lock:
+                # 一時ファイルに書いてから置き換え、読みかけのファイルを返さないようにする
+                for out_path, data in ((path + ".gz", gzip.compress(body, mtime=0)), (path, body)):
+                    tmp_path = out_path + ".tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp_path, out_path)
+        self.current[memory_set.id] = (key, digest, public)
+        return digest
+
+    def find(self, digest: str) -> Optional[Tuple[str, bool]]:
+        """(ファイルパス, 公開か) を返す。無ければ None"""
+        if len(digest) != 32 or any(c not in "0123456789abcdef" for c in digest):
+            return None
+        for public in (True, False):
+            path = self._path(digest, public)
+            if os.path.exists(path):
+                return path, public
+        return None
+
+    def invalidate(self, set_id: int):
+        """このワーカーでの更新・削除時に呼ぶ（呼ばれなくても次の current_hash でキーの違いから作り直す）"""
+        self.current.pop(set_id, None)
+
+
+bundle_store = BundleStore()
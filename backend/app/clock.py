@@ -0,0 +1,58 @@
+# backend/app/clock.py
+import asyncio
+import selectors
+import time
+
+
+def now() -> float:
+    """
+    単調増加の現在時刻（秒）。実行中のイベントループの時計を使うので、
+    VirtualTimeLoop の上では仮想時刻になる（通常のループでは time.monotonic と同じ）。
+    """
+    try:
+        return asyncio.get_running_loop().time()
+    except RuntimeError:
+        return time.monotonic()
+
+
+class _VirtualSelector:
+    """
+    I/O を待つ代わりに、次のタイマーの時刻まで仮想時刻を進める selector。
+    準備のできた I/O (スレッドからの call_soon_threadsafe など) があればそれを優先する。
+    """
+
+    def __init__(self, loop: "VirtualTimeLoop"):
+        self._loop = loop
+        self._selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        if timeout is None:
+            # 待つべきタイマーが無いので、スレッドなどからの起床を実際に待つ
+            return self._selector.select(None)
+        if timeout == 0:
+            # 実行待ちの処理があるうちは I/O を見に行かない（どうせすぐ次の周回が来る）
+            return []
+        events = self._selector.select(0)
+        if not events:
+            self._loop.advance(timeout)
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """
+    asyncio.sleep や call_later を実時間で待たずに進めるイベントループ（シミュレーション用）。
+    実行できる処理が無くなった時点で、最も早いタイマーの時刻まで時計を飛ばす。
+    """
+
+    def __init__(self):
+        self._virtual_now = 0.0
+        super().__init__(selector=_VirtualSelector(self))
+
+    def time(self) -> float:
+        return self._virtual_now
+
+    def advance(self, seconds: float):
+        self._virtual_now += seconds
@@ -0,0 +1,256 @@
+# backend/app/compression.py
+import asyncio
+import gzip
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import unquote
+
+from dotenv import load_dotenv
+from starlette.datastructures import Headers, MutableHeaders
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES
+
+try:
+    import brotli
+except ImportError:  # brotli が無い環境では gzip のみで返す
+    brotli = None
+
+load_dotenv()
+
+# --- REST レスポンス ---
+# これより小さいレスポンスは圧縮しない（ヘッダーと CPU のほうが高くつく）
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+# これより大きいレスポンスはスレッドで圧縮し、イベントループを塞がない
+COMPRESS_THREAD_BYTES = int(os.getenv("COMPRESS_THREAD_BYTES", str(64 * 1024)))
+# 動的なレスポンス向けの圧縮レベル（事前圧縮の静的ファイルより速さ優先）
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/javascript", "image/svg+xml")
+
+# --- WebSocket (permessage-deflate) ---
+# 短く似たフレームが続くので、文脈は引き継ぎ (context takeover)、窓は小さくして接続ごとのメモリを抑える
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "11"))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "4"))
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+
+
+class CompressionStats:
+    """圧縮前後のバイト数と、圧縮にかかった CPU 時間を数える（エンコーディングごと）"""
+
+    def __init__(self):
+        self.counters: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, encoding: str, raw: int, compressed: int, cpu_seconds: float):
+        with self._lock:
+            c = self.counters.get(encoding)
+            if c is None:
+                c = self.counters[encoding] = {"count": 0, "bytesIn": 0, "bytesOut": 0, "cpuSeconds": 0.0}
+            c["count"] += 1
+            c["bytesIn"] += raw
+            c["bytesOut"] += compressed
+            c["cpuSeconds"] += cpu_seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for encoding, c in self.counters.items():
+                result[encoding] = {
+                    "count": c["count"],
+                    "bytesIn": c["bytesIn"],
+                    "bytesOut": c["bytesOut"],
+                    "bytesSaved": c["bytesIn"] - c["bytesOut"],
+                    "ratio": round(c["bytesOut"] / c["bytesIn"], 3) if c["bytesIn"] else None,
+                    "cpuMs": round(c["cpuSeconds"] * 1000, 2),
+                    "cpuUsPerKb": round(c["cpuSeconds"] * 1e6 / (c["bytesIn"] / 1024), 1) if c["bytesIn"] else None,
+                }
+            return result
+
+
+http_stats = CompressionStats()
+frame_stats = CompressionStats()
+
+
+def skip_compression(endpoint: Callable) -> Callable:
+    """レスポンスを圧縮しないルートに付ける（@app.get の下に置く）"""
+    endpoint._skip_compression = True
+    return endpoint
+
+
+def parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """Accept-Encoding を {エンコーディング: q 値} にする（q が無ければ 1、読めない q は 0 とみなす）"""
+    prefs: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        # 範囲外や NaN も拒否として扱う
+        prefs[name] = q if 0.0 <= q <= 1.0 else 0.0
+    return prefs
+
+
+def negotiate(accept_encoding: str, available: Optional[Iterable[str]] = None) -> Optional[str]:
+    """
+    使えるエンコーディングのうち q 値が最も高いものを選ぶ（同じなら available の順）。
+    q=0 は拒否、明示されていないものは * の q 値に従う。identity のほうが好まれていれば圧縮しない。
+    """
+    if available is None:
+        available = ("br", "gzip") if brotli is not None else ("gzip",)
+    prefs = parse_accept_encoding(accept_encoding)
+    best, best_q = None, 0.0
+    for name in available:
+        q = prefs.get(name, prefs.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    if best is not None and prefs.get("identity", 0.0) > best_q:
+        return None
+    return best
+
+
+def _compress(encoding: str, body: bytes) -> bytes:
+    started = time.thread_time()
+    if encoding == "br":
+        data = brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    else:
+        data = gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+    http_stats.add(encoding, len(body), len(data), time.thread_time() - started)
+    return data
+
+
+class CompressionMiddleware:
+    """
+    JSON などのレスポンスを Accept-Encoding に応じて br / gzip で圧縮する。
+    本文を1回で送るレスポンスだけを対象にし、ストリーミングや
+    既に圧縮済みのもの（事前圧縮の静的ファイル・バンドル）はそのまま流す。
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            if message.get("more_body", False) or not self._eligible(scope, start, body):
+                await send(start)
+                await send(message)
+                return
+
+            headers = MutableHeaders(scope=start)
+            headers.add_vary_header("Accept-Encoding")
+            if encoding is not None:
+                if len(body) >= COMPRESS_THREAD_BYTES:
+                    body = await asyncio.to_thread(_compress, encoding, body)
+                else:
+                    body = _compress(encoding, body)
+                headers["content-encoding"] = encoding
+                headers["content-length"] = str(len(body))
+                # 圧縮後は別の表現なので、強い ETag は弱い ETag に変える
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["etag"] = f"W/{etag}"
+                message = {"type": "http.response.body", "body": body}
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _eligible(self, scope, start, body: bytes) -> bool:
+        if start["status"] < 200 or start["status"] in (204, 206, 304):
+            return False
+        if len(body) < self.minimum_size:
+            return False
+        if getattr(scope.get("endpoint"), "_skip_compression", False):
+            return False
+        headers = Headers(raw=start["headers"])
+        if "content-encoding" in headers:
+            return False
+        return headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+
+
+# --- WebSocket ---
+
+class _MeteredDeflate(PerMessageDeflate):
+    """送信フレームの圧縮前後のサイズと CPU 時間を frame_stats に記録する"""
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        started = time.thread_time()
+        encoded = super().encode(frame)
+        frame_stats.add("permessage-deflate", len(frame.data), len(encoded.data), time.thread_time() - started)
+        return encoded
+
+
+class _MeteredDeflateFactory(ServerPerMessageDeflateFactory):
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, _MeteredDeflate(
+            extension.remote_no_context_takeover,
+            extension.local_no_context_takeover,
+            extension.remote_max_window_bits,
+            extension.local_max_window_bits,
+            self.compress_settings,
+        )
+
+
+class FrameCompression:
+    """
+    ルーム単位で permessage-deflate を有効にするかを決める。
+    ハンドシェイクはアプリより前に終わるので、パスからルームを取り出して
+    room_enabled（main.py が設定する）に問い合わせる。
+    """
+
+    def __init__(self):
+        self.room_enabled: Callable[[str], bool] = lambda room_id: False
+
+    @staticmethod
+    def room_from_path(path: str) -> Optional[str]:
+        # /ws/spectate/{room}, /ws/battle/{room}/{player}, /ws/{room}/{player}（main.py のルートと同じ優先順）
+        parts = unquote(path.partition("?")[0]).strip("/").split("/")
+        if len(parts) < 3 or parts[0] != "ws":
+            return None
+        if parts[1] == "spectate" and len(parts) == 3:
+            return parts[2]
+        if parts[1] == "battle" and len(parts) == 4:
+            return parts[2]
+        return parts[1] if len(parts) == 3 else None
+
+    def extensions_for(self, path: str) -> List[ServerPerMessageDeflateFactory]:
+        room_id = self.room_from_path(path)
+        if room_id is None or not self.room_enabled(room_id):
+            return []
+        return [_MeteredDeflateFactory(
+            server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+            client_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+            compress_settings={"memLevel": WS_DEFLATE_MEM_LEVEL, "level": WS_DEFLATE_LEVEL},
+        )]
+
+
+frame_compression = FrameCompression()
@@ -1,30 +1,133 @@
 # --- database.py の 全体を以下に書き換え ---
 
+import math
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # 環境変数からURLを取得
 database_url = os.getenv("DATABASE_URL", "sqlite:///./sql_app.db")
+# 読み取り専用のレプリカ（未設定ならすべてプライマリで読む）
+replica_url = os.getenv("REPLICA_DATABASE_URL", "")
+# SQLite 本番向けプロファイル（"production" で WAL と書き込みキューを使う）
+SQLITE_MODE = os.getenv("SQLITE_MODE", "")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", str(64 * 1024)))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+# 接続プールの待ち時間の移動平均を、借りる人がいなくなってから半減させる時間（秒）
+POOL_WAIT_HALF_LIFE = float(os.getenv("POOL_WAIT_HALF_LIFE", "2"))
 
-# RenderのPostgreSQL(postgres://)をSQLAlchemyが解釈できる形式(postgresql://)に変換
-if database_url.startswith("postgres://"):
-    database_url = database_url.replace("postgres://", "postgresql://", 1)
+class PoolWaitTracker:
+    """接続プールから接続を借りるまでの待ち時間（直近の移動平均と累計）"""
 
-SQLALCHEMY_DATABASE_URL = database_url
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._recent = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self._recent = self._decayed(time.monotonic()) * 0.8 + seconds * 0.2
+            self._last = time.monotonic()
+
+    def _decayed(self, now: float) -> float:
+        return self._recent * math.pow(0.5, (now - self._last) / POOL_WAIT_HALF_LIFE)
+
+    def recent_ms(self) -> float:
+        with self._lock:
+            return self._decayed(time.monotonic()) * 1000
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.count,
+                "avgWaitMs": round(self.total_seconds * 1000 / self.count, 3) if self.count else None,
+                "maxWaitMs": round(self.max_seconds * 1000, 3),
+                "recentWaitMs": round(self._decayed(time.monotonic()) * 1000, 3),
+            }
+
+pool_waits = PoolWaitTracker()
+
+class TimedQueuePool(QueuePool):
+    """接続を借りるまでに待った時間を pool_waits に記録する QueuePool"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_waits.add(time.perf_counter() - started)
+
+def _normalize_url(url: str) -> str:
+    # RenderのPostgreSQL(postgres://)をSQLAlchemyが解釈できる形式(postgresql://)に変換
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    return url
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL なら読み取りは書き込みを待たない。synchronous=NORMAL は WAL では電源断でも壊れない
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+def _create_engine(url: str, **kwargs):
+    if url.startswith("postgresql"):
+        return create_engine(url, poolclass=TimedQueuePool, **kwargs)
+    # SQLiteの場合の設定（ファイルなら既定と同じ QueuePool、:memory: は既定のまま）
+    if ":memory:" not in url:
+        kwargs.setdefault("poolclass", TimedQueuePool)
+    new_engine = create_engine(url, connect_args={"check_same_thread": False}, **kwargs)
+    if SQLITE_PRODUCTION:
+        event.listen(new_engine, "connect", _sqlite_pragmas)
+    return new_engine
+
+def _create_writer_engine(url: str):
+    """
+    書き込みキュー専用の接続（1本だけ）。トランザクションは BEGIN IMMEDIATE で始め、
+    途中で書き込みロックへ昇格できずに失敗することが無いようにする。
+    pysqlite 任せだと SAVEPOINT がうまく動かないので、BEGIN は自分で出す。
+    """
+    writer = _create_engine(url, pool_size=1, max_overflow=0)
+
+    @event.listens_for(writer, "connect")
+    def _disable_implicit_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(writer, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return writer
+
+SQLALCHEMY_DATABASE_URL = _normalize_url(database_url)
+REPLICA_DATABASE_URL = _normalize_url(replica_url)
+SQLITE_PRODUCTION = SQLITE_MODE == "production" and SQLALCHEMY_DATABASE_URL.startswith("sqlite")
 
 # エンジンの作成
-if SQLALCHEMY_DATABASE_URL.startswith("postgresql"):
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
-else:
-    # SQLiteの場合の設定
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-    )
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
+replica_engine = _create_engine(REPLICA_DATABASE_URL) if REPLICA_DATABASE_URL else None
+writer_engine = _create_writer_engine(SQLALCHEMY_DATABASE_URL) if SQLITE_PRODUCTION else None
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine else None
+# 書き込みキューのセッション。結果のオブジェクトを commit 後もそのまま返せるよう期限切れにしない
+WriterSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=writer_engine) if writer_engine else None
+Base = declarative_base()
@@ -0,0 +1,170 @@
+# backend/app/db_routing.py
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal, ReplicaSessionLocal
+
+load_dotenv()
+
+# レプリカの遅れがこれを超えたら、読み取りもプライマリに回す（秒）
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+# プライマリに時刻を書き、レプリカで読み返す間隔（秒）
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", "1"))
+HEARTBEAT_ID = 1
+
+
+class ReplicaRouter:
+    """
+    読み取り専用のリクエストをレプリカに振り分ける。
+
+    遅延はハートビートで測る: プライマリに時刻を書き、レプリカに届いた値を読む。
+    レプリカにはその時刻までに commit された書き込みがすべて入っているので、
+    書き込んだ利用者は「自分の最後の書き込み時刻」がレプリカに届くまでプライマリで読む
+    （自分の書いた内容が直後の一覧に出ない、ということが起きない）。
+    """
+
+    def __init__(self):
+        self.enabled = ReplicaSessionLocal is not None
+        self.healthy = False
+        # レプリカに届いているプライマリの時刻と、測った時点の遅れ
+        self.replica_seen: Optional[float] = None
+        self.lag: Optional[float] = None
+        self.last_error: Optional[str] = None
+        # 利用者ごとの最後の書き込み時刻（レプリカが追いついたら消す）
+        self.last_writes: Dict[str, float] = {}
+        self.reads = {"replica": 0, "primary": 0, "sticky": 0, "lagging": 0, "unhealthy": 0}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._write: Optional[Callable[[Optional[Session], Callable[[Session], Any]], Any]] = None
+
+    # --- 振り分け ---
+
+    def read_session(self, key: Optional[str]) -> Session:
+        """key の利用者がレプリカで読んでよければレプリカ、だめならプライマリのセッション"""
+        reason = self._primary_reason(key)
+        with self._lock:
+            self.reads[reason or "replica"] += 1
+        if reason is None:
+            return ReplicaSessionLocal()
+        db = SessionLocal()
+        db.info["writer"] = key
+        return db
+
+    def _primary_reason(self, key: Optional[str]) -> Optional[str]:
+        if not self.enabled:
+            return "primary"
+        if not self.healthy:
+            return "unhealthy"
+        if self.lag is None or self.lag > REPLICA_MAX_LAG_SECONDS:
+            return "lagging"
+        written = self.last_writes.get(key) if key else None
+        if written is not None and (self.replica_seen is None or written > self.replica_seen):
+            return "sticky"
+        return None
+
+    def note_write(self, key: Optional[str]):
+        if key and self.enabled:
+            with self._lock:
+                self.last_writes[key] = time.time()
+
+    # --- 遅延の測定 ---
+
+    def check(self):
+        """ハートビートを1回書いて読み返す"""
+        def beat(db: Session):
+            # 時刻は書く直前に取る（キューで待った分を遅れに数えない）
+            row = db.get(models.ReplicaHeartbeat, HEARTBEAT_ID)
+            if row is None:
+                db.add(models.ReplicaHeartbeat(id=HEARTBEAT_ID, at=time.time()))
+            else:
+                row.at = time.time()
+
+        try:
+            self._write(None, beat)
+
+            replica = ReplicaSessionLocal()
+            try:
+                row = replica.get(models.ReplicaHeartbeat, HEARTBEAT_ID)
+                seen = row.at if row is not None else None
+            finally:
+                replica.close()
+        except Exception as e:
+            if self.healthy or self.last_error is None:
+                print(f"⚠️ Replica check failed, reading from primary: {e}")
+            self.healthy = False
+            self.last_error = str(e)
+            return
+
+        if not self.healthy:
+            print("Replica is reachable, routing reads to it.")
+        self.healthy = True
+        self.last_error = None
+        self.replica_seen = seen
+        # 届いている最新の時刻から今までが遅れ（何も届いていなければ無限大扱い）
+        self.lag = max(0.0, time.time() - seen) if seen is not None else None
+        if seen is not None:
+            with self._lock:
+                self.last_writes = {k: t for k, t in self.last_writes.items() if t > seen}
+
+    def start(self, write: Callable[[Optional[Session], Callable[[Session], Any]], Any]):
+        """write はハートビートの書き込みに使う（write_queue.run。db_routing からは import できない）"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._write = write
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread = None
+
+    def _run(self):
+        self.check()
+        while not self._stopping.wait(REPLICA_CHECK_INTERVAL):
+            self.check()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "healthy": self.healthy,
+            "lagSeconds": round(self.lag, 3) if self.lag is not None else None,
+            "maxLagSeconds": REPLICA_MAX_LAG_SECONDS,
+            "stickyUsers": len(self.last_writes),
+            "reads": dict(self.reads),
+            "lastError": self.last_error,
+        }
+
+
+replica_router = ReplicaRouter()
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _mark_flushed(session, flush_context):
+    session.info["flushed"] = True
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _clear_flushed(session):
+    session.info.pop("flushed", None)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _note_commit(session):
+    # 書き込みのあったリクエストの利用者は、レプリカが追いつくまでプライマリで読む
+    if session.info.pop("flushed", False):
+        replica_router.note_write(session.info.get("writer"))
+
+
+if ReplicaSessionLocal is not None:
+    @event.listens_for(ReplicaSessionLocal, "before_flush")
+    def _reject_replica_writes(session, flush_context, instances):
+        raise RuntimeError("Read-only (replica) session cannot write")
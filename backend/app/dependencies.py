@@ -1,7 +1,8 @@
 # backend/app/dependencies.py
 import os
-from typing import Generator
-from fastapi import Depends, HTTPException, status
+import secrets
+from typing import Generator, Optional
+from fastapi import Depends, Header, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
@@ -11,24 +12,51 @@ from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
 from . import database, models
+from .db_routing import replica_router
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "YOUR_SECRET_KEY_HERE")
+# 運用向けエンドポイント（プロファイラなど）用のトークン。未設定なら無効
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# 未ログインでも使えるエンドポイント用（トークンが無くてもエラーにしない）
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # DBセッション取得
-def get_db() -> Generator:
+def get_db(request: Request) -> Generator:
     db = database.SessionLocal()
+    # 書き込んだ利用者を覚え、直後の読み取りをプライマリに向ける（db_routing.py）
+    db.info["writer"] = session_key(request)
     try:
         yield db
     finally:
         db.close()
 
+# 読み取りだけのエンドポイント用。レプリカが使えればレプリカのセッションを返す
+def get_read_db(request: Request) -> Generator:
+    db = replica_router.read_session(session_key(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+def session_key(request: Request) -> Optional[str]:
+    """読み書きの追跡に使う利用者のキー（ログイン中はユーザー名、それ以外は接続元）"""
+    auth = request.headers.get("authorization", "")
+    if auth[:7].lower() == "bearer ":
+        try:
+            username = jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+            if username:
+                return f"user:{username}"
+        except JWTError:
+            pass
+    return f"ip:{request.client.host}" if request.client else None
+
 # パスワードハッシュ化・検証
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -62,4 +90,32 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     user = db.query(models.User).filter(models.User.username == username).first()
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    return user
+
+# WebSocket 接続など、リクエスト外でトークンからユーザーIDを引く（ブロッキングなのでスレッドで呼ぶこと）
+def user_id_from_token(token: str) -> Optional[int]:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    db = database.SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.username == username).first()
+        return user.id if user else None
+    finally:
+        db.close()
+
+
+# 運用向けエンドポイントの認可（X-Admin-Token ヘッダー）
+def is_admin(x_admin_token: Optional[str]) -> bool:
+    """管理用トークンが設定されていて、渡されたものと一致するか"""
+    return bool(ADMIN_TOKEN) and bool(x_admin_token) and secrets.compare_digest(x_admin_token, ADMIN_TOKEN)
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="権限がありません")
@@ -0,0 +1,197 @@
+# backend/app/distractors.py
+import hashlib
+import heapq
+import json
+import os
+import queue
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SessionLocal
+from .set_search import normalize
+from .write_queue import write_queue
+
+load_dotenv()
+
+# 単語ごとに保存する近傍の数（出題時はこの中から3つ選ぶ）
+DISTRACTOR_NEIGHBOURS = int(os.getenv("DISTRACTOR_NEIGHBOURS", "8"))
+# メモリに載せておくセット数の上限
+DISTRACTOR_CACHE_SETS = int(os.getenv("DISTRACTOR_CACHE_SETS", "256"))
+# 綴りと読みの類似度の重み
+SPELLING_WEIGHT = 0.6
+KANA_WEIGHT = 0.4
+
+
+def words_hash(words_json: str) -> str:
+    return hashlib.sha1((words_json or "").encode("utf-8")).hexdigest()
+
+
+def _bigrams(value: str) -> set:
+    value = f" {value} "
+    return {value[i:i + 2] for i in range(len(value) - 1)}
+
+
+def build_neighbours(words: List[dict], k: int = DISTRACTOR_NEIGHBOURS) -> List[List[int]]:
+    """
+    綴り・読みそれぞれの bigram の Dice 係数を重み付けして近い単語を K 件ずつ選ぶ。
+    bigram の転置索引を使い、1つも bigram を共有しない組は比較しない。
+    """
+    fields = []
+    for key, weight in (("text", SPELLING_WEIGHT), ("kana", KANA_WEIGHT)):
+        grams = [_bigrams(normalize(w.get(key, "") or "")) for w in words]
+        postings: Dict[str, List[int]] = {}
+        for i, gs in enumerate(grams):
+            for g in gs:
+                postings.setdefault(g, []).append(i)
+        fields.append((grams, postings, weight))
+
+    texts = [w.get("text", "") for w in words]
+    neighbours = []
+    for i in range(len(words)):
+        scores: Dict[int, float] = {}
+        for grams, postings, weight in fields:
+            shared = Counter()
+            for g in grams[i]:
+                shared.update(postings[g])
+            size = len(grams[i])
+            for j, count in shared.items():
+                if texts[j] == texts[i]:
+                    continue
+                scores[j] = scores.get(j, 0.0) + weight * 2 * count / (size + len(grams[j]))
+        neighbours.append([j for j, _ in heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))])
+    return neighbours
+
+
+class DistractorEntry:
+    __slots__ = ("neighbours", "positions")
+
+    def __init__(self, neighbours: List[List[int]], words: List[dict]):
+        self.neighbours = neighbours
+        self.positions = {w.get("text"): i for i, w in enumerate(words)}
+
+
+class DistractorIndexer:
+    """
+    セットの作成・更新時に近傍索引をバックグラウンドで作り直す。
+    出題時は lookup でメモリ上の索引を引くだけなので、セットの大きさに関係なく O(1)。
+    """
+
+    def __init__(self):
+        self.cache: "OrderedDict[int, DistractorEntry]" = OrderedDict()
+        self.pending: set = set()
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    # --- リクエスト側から呼ばれる ---
+
+    def schedule(self, set_id: int):
+        """作り直しを依頼する（古い索引はすぐに使わなくなる）"""
+        with self._lock:
+            self.cache.pop(set_id, None)
+            if set_id in self.pending:
+                return
+            self.pending.add(set_id)
+        self._queue.put(set_id)
+
+    def lookup(self, db: Session, memory_set: models.MemorySet, words: List[dict]) -> Optional[DistractorEntry]:
+        """索引が無い・古い場合は作成を依頼して None を返す（呼び出し側はランダムに選ぶ）"""
+        with self._lock:
+            entry = self.cache.get(memory_set.id)
+            if entry is not None:
+                self.cache.move_to_end(memory_set.id)
+                return entry
+            if memory_set.id in self.pending:
+                return None
+        row = db.get(models.SetDistractorIndex, memory_set.id)
+        if row is None or row.words_hash != words_hash(memory_set.words_json):
+            self.schedule(memory_set.id)
+            return None
+        entry = DistractorEntry(json.loads(row.neighbours_json), words)
+        self._remember(memory_set.id, entry)
+        return entry
+
+    def _remember(self, set_id: int, entry: DistractorEntry):
+        with self._lock:
+            self.cache[set_id] = entry
+            self.cache.move_to_end(set_id)
+            while len(self.cache) > DISTRACTOR_CACHE_SETS:
+                self.cache.popitem(last=False)
+
+    # --- ワーカー ---
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="distractor-indexer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            set_id = self._queue.get()
+            if set_id is None:
+                break
+            with self._lock:
+                self.pending.discard(set_id)
+            try:
+                self.rebuild(set_id)
+            except Exception as e:
+                print(f"Distractor index failed for set {set_id}: {e}")
+
+    def rebuild(self, set_id: int):
+        db = SessionLocal()
+        try:
+            memory_set = db.get(models.MemorySet, set_id)
+            if memory_set is None:
+                return
+            words_json = memory_set.words_json
+        finally:
+            db.close()
+        try:
+            words = json.loads(words_json or "[]")
+        except ValueError:
+            return
+        # 近傍の計算は書き込みの外で済ませ、書き込みキューでは保存だけを行う
+        neighbours = build_neighbours(words)
+
+        def write(db: Session):
+            # 計算中にセットが消えていたら何もしない
+            if db.get(models.MemorySet, set_id) is None:
+                return
+            row = db.get(models.SetDistractorIndex, set_id)
+            if row is None:
+                row = models.SetDistractorIndex(set_id=set_id)
+                db.add(row)
+            row.words_hash = words_hash(words_json)
+            row.neighbours_json = json.dumps(neighbours, separators=(",", ":"))
+
+        write_queue.run(None, write)
+        with self._lock:
+            stale = set_id in self.pending
+        # 作成中にまた更新された場合は次の作り直しに任せる
+        if not stale:
+            self._remember(set_id, DistractorEntry(neighbours, words))
+
+
+distractor_indexer = DistractorIndexer()
+
+
+def remove_index(db: Session, set_id: int):
+    """セット削除時に呼ぶ（commit は呼び出し側）"""
+    distractor_indexer.cache.pop(set_id, None)
+    db.query(models.SetDistractorIndex).filter(
+        models.SetDistractorIndex.set_id == set_id
+    ).delete(synchronize_session=False)
@@ -0,0 +1,87 @@
+# backend/app/job_tasks.py
+from . import models
+from .database import engine, SessionLocal
+from .distractors import distractor_indexer
+from .jobs import job_runner, JobContext
+from .leaderboard import rebuild_bests, compact_rankings, RANKING_RETENTION_DAYS
+from .migrations import run_migrations
+from .official_sets import seed_official_sets
+from .player_stats import rebuild_all
+from .set_search import rebuild_index
+
+# ジョブの種類。どれも途中で失敗しても最初からやり直せる（再試行しても結果は同じ）
+# 長いループでは ctx.progress を呼び続けること（リースの延長を兼ねる。間隔は JobContext 側で間引く）
+
+
+@job_runner.task("seed_official_sets", max_attempts=5)
+def seed_official_sets_job(ctx: JobContext, payload: dict):
+    db = SessionLocal()
+    try:
+        return {"created": seed_official_sets(db)}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@job_runner.task("migrate", max_attempts=1)
+def migrate_job(ctx: JobContext, payload: dict):
+    return {"applied": run_migrations(engine, payload.get("target"))}
+
+
+@job_runner.task("rebuild_stats")
+def rebuild_stats_job(ctx: JobContext, payload: dict):
+    db = SessionLocal()
+    try:
+        ctx.progress(0, message="Rebuilding player stats rollups")
+        users = rebuild_all(db, on_progress=lambda rows: ctx.progress(rows, message=f"Rebuilding player stats: {rows} rows"))
+        return {"users": users}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@job_runner.task("compact_rankings")
+def compact_rankings_job(ctx: JobContext, payload: dict):
+    retention_days = int(payload.get("retention_days", RANKING_RETENTION_DAYS))
+    db = SessionLocal()
+    try:
+        # 先に自己ベストを作り直し、ベストとして参照されている行は必ず残す
+        ctx.progress(0, message="Rebuilding personal bests")
+        players = rebuild_bests(db, on_progress=lambda rows: ctx.progress(rows, message=f"Rebuilding personal bests: {rows} rows"))
+        deleted = compact_rankings(
+            db, retention_days,
+            on_batch=lambda count: ctx.progress(count, message=f"Deleted {count} rows")
+        )
+        return {"players": players, "deleted": deleted, "retentionDays": retention_days}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@job_runner.task("reindex_sets")
+def reindex_sets_job(ctx: JobContext, payload: dict):
+    """検索索引と、指定したセット（省略時は全セット）の近傍索引を作り直す"""
+    db = SessionLocal()
+    try:
+        set_ids = payload.get("set_ids")
+        if set_ids is None:
+            set_ids = [row[0] for row in db.query(models.MemorySet.id).order_by(models.MemorySet.id).all()]
+        indexed = rebuild_index(
+            db, on_progress=lambda count: ctx.progress(count, message=f"Indexed {count} sets for search")
+        )
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    for i, set_id in enumerate(set_ids, start=1):
+        distractor_indexer.rebuild(int(set_id))
+        ctx.progress(i, len(set_ids), message=f"Rebuilt distractors for {i}/{len(set_ids)} sets")
+    return {"searchDocs": indexed, "distractorSets": len(set_ids)}
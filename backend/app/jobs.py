@@ -0,0 +1,374 @@
+# backend/app/jobs.py
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import Column, Float, Integer, String, Text, create_engine, event, func
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+load_dotenv()
+
+# ジョブ表はアプリの DB とは別の、ローカルの SQLite ファイルに置く
+JOBS_DATABASE_URL = os.getenv("JOBS_DATABASE_URL", "sqlite:///./jobs.db")
+# アプリのプロセス内でワーカーを動かすか（0 にして run_jobs.py を別プロセスで動かす）
+JOBS_IN_PROCESS = os.getenv("JOBS_IN_PROCESS", "1") == "1"
+# 1プロセスあたりのワーカースレッド数
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+# 実行できるジョブが無いときに表を見に行く間隔（秒）
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# この秒数だけ進捗の報告が無い実行中ジョブは、ワーカーが落ちたとみなして取り直す
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+# 再試行の待ち時間は JOB_BACKOFF_SECONDS * 2^(試行回数-1)、上限 JOB_BACKOFF_MAX
+JOB_BACKOFF_SECONDS = float(os.getenv("JOB_BACKOFF_SECONDS", "10"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "600"))
+# 進捗を表に書く最短間隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JobBase = declarative_base()
+
+
+class Job(JobBase):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    # 同じキーのジョブは1行だけ（待ち・実行中なら二重に積まない）
+    key = Column(String, unique=True, nullable=True)
+    kind = Column(String, index=True)
+    payload_json = Column(Text, default="{}")
+    status = Column(String, index=True, default=QUEUED)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(Float, default=0.0)
+    progress = Column(Float, default=0.0)
+    message = Column(String, nullable=True)
+    result_json = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(Float, nullable=True)
+    created_at = Column(Float)
+    started_at = Column(Float, nullable=True)
+    finished_at = Column(Float, nullable=True)
+
+
+def _create_jobs_engine(url: str):
+    """
+    複数のプロセスが同じ表からジョブを取るので、取り出しは BEGIN IMMEDIATE で直列化する。
+    WAL にして、状態の読み取りは取り出しを待たないようにする。
+    """
+    jobs_engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+
+    @event.listens_for(jobs_engine, "connect")
+    def _configure(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+    @event.listens_for(jobs_engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return jobs_engine
+
+
+jobs_engine = _create_jobs_engine(JOBS_DATABASE_URL)
+JobSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=jobs_engine)
+
+
+class TaskSpec:
+    __slots__ = ("name", "fn", "concurrency", "max_attempts")
+
+    def __init__(self, name: str, fn: Callable, concurrency: int, max_attempts: int):
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+
+class LeaseLost(Exception):
+    """リースが切れて、ジョブが別のワーカーに取られた（二重に実行しないよう中断する）"""
+
+
+class JobContext:
+    """実行中のジョブから進捗を報告する。報告はリースの延長も兼ねる"""
+
+    def __init__(self, runner: "JobRunner", job_id: int, worker_id: str):
+        self.runner = runner
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self._reported = 0.0
+
+    def progress(self, done: float, total: Optional[float] = None, message: Optional[str] = None):
+        """
+        total が分からない作業は message だけを更新する。
+        リースが既に他のワーカーに移っていたら LeaseLost を投げて作業を止める。
+        """
+        now = time.time()
+        if now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        fields = {"locked_at": now, "message": message}
+        if total:
+            fields["progress"] = min(1.0, done / total)
+        if not self.runner._update(self.job_id, self.worker_id, **fields):
+            raise LeaseLost(f"Job {self.job_id} is no longer held by {self.worker_id}")
+
+
+class JobRunner:
+    """
+    重いメンテナンス作業（集計のやり直し・古いランキングの削除・索引の作り直しなど）を
+    リクエストやイベントループの外で実行する。
+
+    ジョブはローカルの SQLite の表に積み、アプリ内のワーカースレッドか、
+    別プロセスのワーカー（run_jobs.py）が取り出して実行する。
+    - 種類ごとの同時実行数の上限（全プロセス合計）
+    - 失敗時は指数バックオフで再試行し、max_attempts 回で諦める
+    - 同じキーのジョブは待ち・実行中のあいだ二重に積まれない
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, TaskSpec] = {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+        self._ready = False
+
+    # --- 登録と投入 ---
+
+    def task(self, name: str, concurrency: int = 1, max_attempts: int = 3):
+        """ジョブの種類を登録するデコレーター。関数は fn(ctx, payload) で、戻り値は結果として保存される"""
+        def register(fn: Callable[[JobContext, dict], Any]):
+            self.tasks[name] = TaskSpec(name, fn, concurrency, max_attempts)
+            return fn
+        return register
+
+    def ensure_table(self):
+        if not self._ready:
+            JobBase.metadata.create_all(bind=jobs_engine)
+            self._ready = True
+
+    def enqueue(self, kind: str, payload: Optional[dict] = None, key: Optional[str] = None, delay: float = 0) -> int:
+        """
+        ジョブを積んで ID を返す。key が同じジョブが待ち・実行中ならそれの ID を返し、
+        終わっている（成功・失敗）なら同じ行を積み直す。
+        """
+        if kind not in self.tasks:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.ensure_table()
+        now = time.time()
+        db = JobSessionLocal()
+        try:
+            job = db.query(Job).filter(Job.key == key).first() if key else None
+            if job is not None and job.status in (QUEUED, RUNNING):
+                db.rollback()
+                return job.id
+            if job is None:
+                job = Job(key=key)
+                db.add(job)
+            job.kind = kind
+            job.payload_json = json.dumps(payload or {}, ensure_ascii=False)
+            job.status = QUEUED
+            job.attempts = 0
+            job.max_attempts = self.tasks[kind].max_attempts
+            job.run_after = now + delay
+            job.progress = 0.0
+            job.message = None
+            job.result_json = None
+            job.error = None
+            job.locked_by = None
+            job.locked_at = None
+            job.created_at = now
+            job.started_at = None
+            job.finished_at = None
+            db.commit()
+            job_id = job.id
+        finally:
+            db.close()
+        self._wake.set()
+        return job_id
+
+    # --- 状態 ---
+
+    def get(self, job_id: int) -> Optional[dict]:
+        self.ensure_table()
+        db = JobSessionLocal()
+        try:
+            job = db.get(Job, job_id)
+            return _job_json(job) if job else None
+        finally:
+            db.close()
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+        self.ensure_table()
+        db = JobSessionLocal()
+        try:
+            query = db.query(Job)
+            if status:
+                query = query.filter(Job.status == status)
+            return [_job_json(job) for job in query.order_by(Job.id.desc()).limit(limit).all()]
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        self.ensure_table()
+        db = JobSessionLocal()
+        try:
+            counts = dict(db.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+        finally:
+            db.close()
+        return {
+            "workers": len(self._threads),
+            "workerId": self.worker_id,
+            "kinds": sorted(self.tasks),
+            "counts": {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)},
+        }
+
+    # --- ワーカー ---
+
+    def start(self, workers: int = JOB_WORKERS):
+        if self._threads:
+            return
+        self.ensure_table()
+        self._stopping.clear()
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, args=(f"{self.worker_id}/{i}",), name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5):
+        """新しいジョブを取らなくする。実行中のジョブは終わるまで待つ（timeout まで）"""
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+
+    def _run(self, worker_id: str):
+        while not self._stopping.is_set():
+            try:
+                claimed = self._claim(worker_id)
+            except Exception as e:
+                print(f"⚠️ Job claim failed: {e}")
+                claimed = None
+            if claimed is None:
+                self._wake.wait(JOB_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            self._execute(claimed, worker_id)
+
+    def _claim(self, worker_id: str) -> Optional[Job]:
+        """実行できるジョブを1つ取り、実行中にする（全プロセスで直列）"""
+        now = time.time()
+        db = JobSessionLocal()
+        try:
+            # リースが切れた実行中ジョブは、1回失敗したものとして待ちに戻す
+            for job in db.query(Job).filter(Job.status == RUNNING, Job.locked_at < now - JOB_LEASE_SECONDS).all():
+                self._fail(job, f"Lease expired (worker {job.locked_by})", now)
+            db.flush()
+
+            running = dict(db.query(Job.kind, func.count(Job.id)).filter(Job.status == RUNNING).group_by(Job.kind).all())
+            candidates = db.query(Job).filter(
+                Job.status == QUEUED,
+                Job.run_after <= now,
+                Job.kind.in_(list(self.tasks))
+            ).order_by(Job.run_after, Job.id).limit(50).all()
+            for job in candidates:
+                if running.get(job.kind, 0) >= self.tasks[job.kind].concurrency:
+                    continue
+                job.status = RUNNING
+                job.attempts += 1
+                job.locked_by = worker_id
+                job.locked_at = now
+                job.started_at = now
+                db.commit()
+                return job
+            db.commit()
+            return None
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _execute(self, job: Job, worker_id: str):
+        spec = self.tasks[job.kind]
+        ctx = JobContext(self, job.id, worker_id)
+        started = time.perf_counter()
+        try:
+            result = spec.fn(ctx, json.loads(job.payload_json or "{}"))
+        except LeaseLost as e:
+            # 既に別のワーカーが引き継いでいるので、状態は書き換えない
+            print(f"⚠️ Job {job.id} ({job.kind}) stopped: {e}")
+            return
+        except Exception as e:
+            print(f"⚠️ Job {job.id} ({job.kind}) failed on attempt {job.attempts}/{job.max_attempts}: {e}")
+            db = JobSessionLocal()
+            try:
+                row = db.get(Job, job.id)
+                if row is not None and row.locked_by == worker_id:
+                    self._fail(row, "".join(traceback.format_exception_only(type(e), e)).strip(), time.time())
+                db.commit()
+            finally:
+                db.close()
+            return
+        print(f"Job {job.id} ({job.kind}) finished in {time.perf_counter() - started:.1f}s")
+        self._update(
+            job.id, worker_id, status=DONE, progress=1.0, finished_at=time.time(), locked_by=None, locked_at=None, error=None, message=None,
+            result_json=json.dumps(result, ensure_ascii=False, default=str) if result is not None else None
+        )
+
+    def _fail(self, job: Job, error: str, now: float):
+        job.error = error
+        job.locked_by = None
+        job.locked_at = None
+        if job.attempts < job.max_attempts:
+            job.status = QUEUED
+            job.run_after = now + min(JOB_BACKOFF_MAX, JOB_BACKOFF_SECONDS * 2 ** (job.attempts - 1))
+        else:
+            job.status = FAILED
+            job.finished_at = now
+
+    def _update(self, job_id: int, worker_id: str, **fields) -> bool:
+        """自分が持っているジョブだけを更新する（リースが切れて他に取られていたら何もせず False）"""
+        db = JobSessionLocal()
+        try:
+            updated = db.query(Job).filter(Job.id == job_id, Job.locked_by == worker_id).update(fields, synchronize_session=False)
+            db.commit()
+            return updated > 0
+        finally:
+            db.close()
+
+
+def _job_json(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "key": job.key,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "maxAttempts": job.max_attempts,
+        "progress": round(job.progress or 0.0, 3),
+        "message": job.message,
+        "error": job.error,
+        "result": json.loads(job.result_json) if job.result_json else None,
+        "runAfter": job.run_after,
+        "createdAt": job.created_at,
+        "startedAt": job.started_at,
+        "finishedAt": job.finished_at,
+    }
+
+
+job_runner = JobRunner()
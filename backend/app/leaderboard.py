@@ -0,0 +1,358 @@
+# backend/app/leaderboard.py
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sortedcontainers import SortedList
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .player_stats import merge_best
+from .write_queue import write_queue
+
+load_dotenv()
+
+# 順位の前後に何人ずつ表示するか
+NEIGHBOUR_RADIUS = 5
+# コンパクション: この日数より古い「自己ベストでない」記録を削除する
+RANKING_RETENTION_DAYS = 90
+COMPACTION_BATCH_SIZE = 1000
+# メモリ上のボードを DB から読み直す間隔（秒）。他のワーカーでの更新はこの時間内に反映される
+LEADERBOARD_REFRESH_SECONDS = float(os.getenv("LEADERBOARD_REFRESH_SECONDS", "30"))
+
+BoardKey = Tuple[str, int, str]
+
+
+def sort_key(accuracy: Optional[float], avg_speed: Optional[float], created_at: Optional[datetime], name: str) -> tuple:
+    """get_ranking と同じ並び (正答率↓, 平均速度↑, 新しい順) を昇順で比較できるキーにする"""
+    return (
+        -(accuracy or 0.0),
+        avg_speed if avg_speed is not None else math.inf,
+        -(created_at.timestamp() if created_at else 0.0),
+        name,
+    )
+
+
+def _entry(row) -> dict:
+    return {
+        "name": row.name, "time": row.time, "set_id": row.set_id,
+        "win_score": row.win_score, "condition_type": row.condition_type,
+        "accuracy": row.accuracy, "avg_speed": row.avg_speed,
+    }
+
+
+class Board:
+    """
+    1つのボードの自己ベストをソート済みで保持する。
+    更新・順位は SortedList で O(log n)、前後の人は位置を指定して取り出せる。
+    ランキング登録（apply）はリクエストのスレッドから来るので、読み書きはボードのロックの中で行う。
+    """
+
+    def __init__(self):
+        self.keys = SortedList()
+        self.entries: Dict[str, Tuple[tuple, dict]] = {}
+        self.loaded_at = time.monotonic()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.keys)
+
+    def put(self, row):
+        key = sort_key(row.accuracy, row.avg_speed, row.created_at, row.name)
+        with self._lock:
+            old = self.entries.get(row.name)
+            if old is not None:
+                self.keys.remove(old[0])
+            self.keys.add(key)
+            self.entries[row.name] = (key, _entry(row))
+
+    def rank(self, name: str) -> Optional[int]:
+        with self._lock:
+            found = self.entries.get(name)
+            if found is None:
+                return None
+            return self.keys.bisect_left(found[0]) + 1
+
+    def slice(self, start: int, stop: int) -> List[dict]:
+        with self._lock:
+            return [
+                {"rank": i + 1, **self.entries[key[3]][1]}
+                for i, key in enumerate(self.keys.islice(start, stop), start=start)
+            ]
+
+    def window(self, name: str, radius: int = NEIGHBOUR_RADIUS) -> List[dict]:
+        with self._lock:
+            rank = self.rank(name)
+            if rank is None:
+                return []
+            return self.slice(max(0, rank - 1 - radius), rank + radius)
+
+    def around(self, name: str, radius: int = NEIGHBOUR_RADIUS) -> dict:
+        """順位・人数・前後の人を、同じ時点の状態からまとめて返す"""
+        with self._lock:
+            return {"rank": self.rank(name), "total": len(self.keys), "entries": self.window(name, radius)}
+
+
+class Leaderboards:
+    """
+    ボードごとの Board を必要になった時点で DB から読み込み、以後は差分で更新する。
+    差分はこのプロセスでの更新しか届かないので、LEADERBOARD_REFRESH_SECONDS ごとに読み直す。
+    """
+
+    def __init__(self):
+        self.boards: Dict[BoardKey, Board] = {}
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, board_key: BoardKey) -> Board:
+        board = self.boards.get(board_key)
+        if board is not None and time.monotonic() - board.loaded_at < LEADERBOARD_REFRESH_SECONDS:
+            return board
+        set_id, win_score, condition_type = board_key
+        rows = db.query(models.RankingBest).filter(
+            models.RankingBest.set_id == set_id,
+            models.RankingBest.win_score == win_score,
+            models.RankingBest.condition_type == condition_type
+        ).all()
+        if not rows:
+            rows = _backfill_board(db, board_key)
+        board = Board()
+        for row in rows:
+            board.put(row)
+        with self._lock:
+            current = self.boards.get(board_key)
+            # 別のスレッドが先に読み直していればそちらを使う
+            if current is not None and current.loaded_at > board.loaded_at:
+                return current
+            self.boards[board_key] = board
+            return board
+
+    def apply(self, best: models.RankingBest):
+        """自己ベスト更新をメモリ上のボードに反映する（未読み込みのボードは次回読み込み時に反映される）"""
+        board = self.boards.get((best.set_id, best.win_score, best.condition_type))
+        if board is not None:
+            board.put(best)
+
+
+leaderboards = Leaderboards()
+
+
+def upsert_best(db: Session, ranking: models.Ranking) -> Optional[models.RankingBest]:
+    """
+    新しい記録が自己ベストなら ranking_bests を更新して返す（commit は呼び出し側）。
+    ranking は flush 済み（id と created_at が入っている）であること。
+    """
+    best = db.query(models.RankingBest).filter(
+        models.RankingBest.set_id == ranking.set_id,
+        models.RankingBest.win_score == ranking.win_score,
+        models.RankingBest.condition_type == ranking.condition_type,
+        models.RankingBest.name == ranking.name
+    ).first()
+
+    new_key = sort_key(ranking.accuracy, ranking.avg_speed, ranking.created_at, ranking.name)
+    if best is not None and sort_key(best.accuracy, best.avg_speed, best.created_at, best.name) <= new_key:
+        return None
+
+    if best is None:
+        best = models.RankingBest(
+            name=ranking.name, set_id=ranking.set_id,
+            win_score=ranking.win_score, condition_type=ranking.condition_type
+        )
+        db.add(best)
+    _copy_ranking(best, ranking)
+    return best
+
+
+def _copy_ranking(best: models.RankingBest, ranking: models.Ranking):
+    best.ranking_id = ranking.id
+    best.time = ranking.time
+    best.accuracy = ranking.accuracy
+    best.avg_speed = ranking.avg_speed
+    best.created_at = ranking.created_at
+    best.user_id = ranking.user_id
+
+
+def _pick_bests(rows) -> Dict[tuple, models.Ranking]:
+    bests: Dict[tuple, models.Ranking] = {}
+    for row in rows:
+        player = (row.set_id, row.win_score, row.condition_type, row.name)
+        current = bests.get(player)
+        if current is None or sort_key(row.accuracy, row.avg_speed, row.created_at, row.name) < \
+                sort_key(current.accuracy, current.avg_speed, current.created_at, current.name):
+            bests[player] = row
+    return bests
+
+
+def _best_from(row: models.Ranking) -> models.RankingBest:
+    return models.RankingBest(
+        ranking_id=row.id, name=row.name, set_id=row.set_id,
+        win_score=row.win_score, condition_type=row.condition_type,
+        time=row.time, accuracy=row.accuracy, avg_speed=row.avg_speed,
+        created_at=row.created_at, user_id=row.user_id
+    )
+
+
+def _backfill_board(db: Session, board_key: BoardKey) -> List[models.RankingBest]:
+    """自己ベスト導入前の記録しかないボードは、初回参照時にそのボードの分だけ作る"""
+    rows = db.query(models.Ranking).filter(
+        *_board_filter(models.Ranking, board_key)
+    ).yield_per(COMPACTION_BATCH_SIZE)
+    bests = [_best_from(row) for row in _pick_bests(rows).values()]
+    if bests:
+        try:
+            write_queue.run(None, lambda writer: writer.add_all(bests))
+        except IntegrityError:
+            # 同時に別のリクエストが作った（またはランキング登録で自己ベストが入った）なら、そちらを読む
+            return db.query(models.RankingBest).filter(*_board_filter(models.RankingBest, board_key)).all()
+    return bests
+
+
+def _board_filter(model, board_key: BoardKey):
+    set_id, win_score, condition_type = board_key
+    return (model.set_id == set_id, model.win_score == win_score, model.condition_type == condition_type)
+
+
+def rebuild_bests(db: Session, batch_size: int = COMPACTION_BATCH_SIZE,
+                  on_progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    rankings から自己ベストを作り直す。ボードごとに、そのボードの記録だけを索引から読んで
+    正しいベストを求め、既存の ranking_bests との差分だけを書き込みキューで batch_size 件ずつ書く。
+    全体を消して入れ直さないので、書き込みロックを長く握らず、作り直し中もボードは空にならない。
+    on_progress には batch_size 行ごとに、それまでに処理した行数が渡る。
+    """
+    # 読み始めた時点より後の記録で更新されたベストは、作り直しの結果で上書きしない
+    snapshot_id = db.query(func.max(models.Ranking.id)).scalar() or 0
+    board_keys = db.query(
+        models.Ranking.set_id, models.Ranking.win_score, models.Ranking.condition_type
+    ).distinct().all()
+
+    processed = 0
+    reported = 0
+    players = 0
+    for board_key in board_keys:
+        board_key = tuple(board_key)
+        rows = db.query(models.Ranking).filter(
+            *_board_filter(models.Ranking, board_key), models.Ranking.id <= snapshot_id
+        ).yield_per(batch_size)
+        bests = list(_pick_bests(rows).values())
+        current = {
+            name: ranking_id
+            for name, ranking_id in db.query(models.RankingBest.name, models.RankingBest.ranking_id).filter(
+                *_board_filter(models.RankingBest, board_key)
+            )
+        }
+        players += len(bests)
+
+        changed = [row for row in bests if current.pop(row.name, None) != row.id]
+        # 記録が残っていないベスト
+        stale = list(current)
+        for start in range(0, max(len(changed), len(stale)), batch_size):
+            chunk = changed[start:start + batch_size]
+            stale_chunk = stale[start:start + batch_size]
+            write_queue.run(None, lambda writer: _apply_bests(writer, board_key, chunk, stale_chunk, snapshot_id))
+        leaderboards.boards.pop(board_key, None)
+
+        processed += len(bests) + 1
+        if on_progress is not None and processed - reported >= batch_size:
+            reported = processed
+            on_progress(processed)
+    return players
+
+
+def _apply_bests(db: Session, board_key: BoardKey, rows: List[models.Ranking], stale_names: List[str],
+                 snapshot_id: int):
+    """
+    rebuild_bests の1バッチ分を書く。読み始めた後の記録（snapshot_id より新しい行）で
+    更新・作成されたベストは、その間に自己ベストが更新されたものとしてそのまま残す。
+    """
+    def is_older(best: models.RankingBest) -> bool:
+        return best.ranking_id is None or best.ranking_id <= snapshot_id
+
+    names = [row.name for row in rows] + stale_names
+    bests = {
+        best.name: best
+        for best in db.query(models.RankingBest).filter(
+            *_board_filter(models.RankingBest, board_key), models.RankingBest.name.in_(names)
+        )
+    }
+    for row in rows:
+        best = bests.get(row.name)
+        if best is None:
+            db.add(_best_from(row))
+        elif is_older(best):
+            _copy_ranking(best, row)
+    for name in stale_names:
+        best = bests.get(name)
+        if best is not None and is_older(best):
+            db.delete(best)
+
+
+def compact_rankings(db: Session, retention_days: int = RANKING_RETENTION_DAYS,
+                     batch_size: int = COMPACTION_BATCH_SIZE,
+                     on_batch: Optional[Callable[[int], None]] = None) -> int:
+    """
+    自己ベストとして参照されていない古い記録を少しずつ削除する。
+    1バッチごとに書き込みキューで commit するので、長時間テーブルをロックしない。
+    ログインユーザーの記録は、削除と同じトランザクションでユーザー・日ごとの集計に足しておく
+    （戦績の再集計で使う）。on_batch にはバッチごとにそれまでの削除件数が渡る。
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    best_ids = db.query(models.RankingBest.ranking_id).filter(models.RankingBest.ranking_id.isnot(None))
+    deleted = 0
+    while True:
+        ids = [row[0] for row in db.query(models.Ranking.id).filter(
+            models.Ranking.created_at < cutoff,
+            models.Ranking.id.notin_(best_ids)
+        ).limit(batch_size)]
+        if not ids:
+            break
+        deleted += write_queue.run(None, lambda writer: _delete_compacted(writer, ids))
+        if on_batch is not None:
+            on_batch(deleted)
+    return deleted
+
+
+def _delete_compacted(db: Session, ids: List[int]) -> int:
+    """
+    compact_rankings の1バッチ分を消す。探してから書くまでの間に自己ベストになった行や、
+    既に消えた行（同じジョブが重なって走った場合）は集計にも足さない。
+    """
+    rows = db.query(
+        models.Ranking.id, models.Ranking.user_id, models.Ranking.created_at,
+        models.Ranking.accuracy, models.Ranking.avg_speed, models.Ranking.time
+    ).filter(
+        models.Ranking.id.in_(ids),
+        models.Ranking.id.notin_(
+            db.query(models.RankingBest.ranking_id).filter(models.RankingBest.ranking_id.isnot(None))
+        )
+    ).all()
+    if rows:
+        _tally_compacted(db, rows)
+        db.query(models.Ranking).filter(
+            models.Ranking.id.in_([row.id for row in rows])
+        ).delete(synchronize_session=False)
+    return len(rows)
+
+
+def _tally_compacted(db: Session, rows) -> None:
+    """削除するランキング行を compacted_ranking_tallies に足し込む（commit は呼び出し側）"""
+    tallies: Dict[tuple, models.CompactedRankingTally] = {}
+    for row in rows:
+        if row.user_id is None or row.created_at is None:
+            continue
+        key = (row.user_id, row.created_at.date())
+        tally = tallies.get(key)
+        if tally is None:
+            tally = db.get(models.CompactedRankingTally, key)
+            if tally is None:
+                tally = models.CompactedRankingTally(user_id=key[0], day=key[1], games=0)
+                db.add(tally)
+            tallies[key] = tally
+        tally.games += 1
+        merge_best(tally, row.accuracy, row.avg_speed, row.time)
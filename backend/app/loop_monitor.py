@@ -0,0 +1,212 @@
+# backend/app/loop_monitor.py
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "1") == "1"
+# 遅延を測る間隔（秒）
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+# この時間（秒）以上ループが止まったら、止めている処理のスタックを出力する
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.2"))
+# 過負荷の判定に使う直近の心拍の数（LOOP_LAG_INTERVAL ごとに1つ。既定で約2秒分）
+LOOP_LAG_WINDOW = int(os.getenv("LOOP_LAG_WINDOW", "20"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MAX_SECONDS = 60
+PROFILE_HZ = int(os.getenv("PROFILE_HZ", "100"))
+
+# 遅延ヒストグラムの区切り（ミリ秒）。最後のバケツはそれより大きいもの全部
+LAG_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+def _folded(frame) -> str:
+    """スタックを flamegraph.pl / speedscope が読める折りたたみ形式 (根;...;葉) にする"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _idle(frame) -> bool:
+    """
+    ループが select で待機中なら、何かに塞がれているわけではない
+    （別スレッドが GIL を握っていて心拍の更新が遅れただけ）ので報告しない
+    """
+    return os.path.basename(frame.f_code.co_filename) == "selectors.py"
+
+
+class LoopLagMonitor:
+    """
+    イベントループのスケジューリング遅延を測る。
+    ループ側のタスクは一定間隔で起きて遅れを記録し、監視スレッドは
+    その心拍が途絶えたら（＝何かがループを塞いでいる）その瞬間のループのスタックを出力する。
+    """
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.max_lag_ms = 0.0
+        # 直近の遅延（過負荷の判定用）。select で待っていただけの遅れは 0 として入れる
+        self.window: deque = deque(maxlen=LOOP_LAG_WINDOW)
+        self.idle_samples = 0
+        self.stalls = 0
+        self.last_stall: Optional[dict] = None
+        self._heartbeat = time.monotonic()
+        # 監視スレッドが、どの心拍の遅れの最中にループを「待機中」「処理中」と見たか
+        self._idle_gap: Optional[float] = None
+        self._busy_gap: Optional[float] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def record(self, lag: float, idle: bool = False):
+        lag_ms = lag * 1000
+        self.samples += 1
+        self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+        if idle:
+            self.idle_samples += 1
+        self.window.append(0.0 if idle else lag_ms)
+        for i, bound in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def sustained_lag_ms(self, quantile: float = 0.5) -> float:
+        """
+        直近 LOOP_LAG_WINDOW 回の心拍の遅延の分位点。
+        1回だけの大きな遅れでは上がらず、遅れが続いているときだけ上がる。
+        起動直後など窓が埋まるまでは、数回の遅れで判定しないよう 0 を返す。
+        """
+        if self._task is None or len(self.window) < self.window.maxlen:
+            return 0.0
+        ordered = sorted(self.window)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * quantile))]
+
+    async def _tick(self):
+        while True:
+            previous = self._heartbeat
+            expected = time.monotonic() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            now = time.monotonic()
+            self._heartbeat = now
+            # 遅れの間ずっと select で待っていた（別スレッドが GIL を握っていた）なら負荷ではない
+            idle = self._idle_gap == previous and self._busy_gap != previous
+            self.record(max(0.0, now - expected), idle)
+
+    def _watch(self):
+        reported = False
+        while not self._stopping.wait(min(LOOP_STALL_THRESHOLD, LOOP_LAG_INTERVAL) / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - LOOP_LAG_INTERVAL
+            if blocked < LOOP_STALL_THRESHOLD:
+                reported = False
+            if blocked <= 0:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            if _idle(frame):
+                self._idle_gap = heartbeat
+                continue
+            self._busy_gap = heartbeat
+            # 1回の停止につき1度だけ出力する
+            if blocked < LOOP_STALL_THRESHOLD or reported:
+                continue
+            reported = True
+            stack = "".join(traceback.format_stack(frame))
+            self.stalls += 1
+            self.last_stall = {"blockedMs": round(blocked * 1000), "at": time.time(), "stack": stack}
+            print(f"⚠️ Event loop blocked for over {blocked * 1000:.0f}ms:\n{stack}")
+
+    def start(self):
+        if not LOOP_MONITOR_ENABLED or self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self.window.clear()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._watchdog = None
+
+    def stats(self) -> dict:
+        labels = [f"<={b}ms" for b in LAG_BUCKETS_MS] + [f">{LAG_BUCKETS_MS[-1]}ms"]
+        return {
+            "samples": self.samples,
+            "maxLagMs": round(self.max_lag_ms, 2),
+            "sustainedLagMs": round(self.sustained_lag_ms(), 2),
+            "idleSamples": self.idle_samples,
+            "histogram": dict(zip(labels, self.buckets)),
+            "stalls": self.stalls,
+            "lastStall": self.last_stall,
+        }
+
+
+loop_monitor = LoopLagMonitor()
+
+
+class SamplingProfiler:
+    """
+    指定した秒数だけ全スレッドのスタックを一定間隔で採取し、折りたたみ形式で保存する。
+    採取していない間はスレッドも作らないので、待機中のオーバーヘッドは無い。
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def capture(self, seconds: float, hz: int = PROFILE_HZ) -> Optional[str]:
+        """採取して保存したファイルのパスを返す（既に採取中なら None）"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+            interval = 1.0 / max(1, hz)
+            me = threading.get_ident()
+            names: Dict[int, str] = {}
+            counts: Counter = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                frames = sys._current_frames()
+                if len(names) != len(frames):
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                for thread_id, frame in frames.items():
+                    if thread_id == me:
+                        continue
+                    counts[f"{names.get(thread_id, thread_id)};{_folded(frame)}"] += 1
+                time.sleep(interval)
+
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            return path
+        finally:
+            self._lock.release()
+
+
+profiler = SamplingProfiler()
@@ -7,13 +7,13 @@ import uuid
 from typing import List, Dict, Optional, Set
 from datetime import timedelta, datetime
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, status
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Header, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
+from sqlalchemy import or_, func, inspect
 from sqlalchemy import desc, asc
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
@@ -21,86 +21,65 @@ from dotenv import load_dotenv
 # 自作モジュール
 from . import models, schemas, database
 from .database import engine, SessionLocal
-from .manager import manager
+from .manager import manager, WS_BATCH_WINDOW_MS
+from .match_log import match_recorder, ROUND_START, SCORE_UP, MISS
+from .rate_limit import ws_guard
+from .rounds import RoundTracker, Standings, CORRECT, WRONG
+from .spaced_repetition import update_schedule, due_words
+from . import player_stats
+from .leaderboard import leaderboards, upsert_best, NEIGHBOUR_RADIUS
+from .serializers import FastJSONResponse, InvalidWords, load_words, user_json
+from .static_files import PrecompressedStaticFiles
+from .compression import CompressionMiddleware, skip_compression, negotiate, http_stats, frame_stats, frame_compression
 from .dependencies import (
-    get_db, get_current_user, create_access_token,
-    get_password_hash, verify_password, ACCESS_TOKEN_EXPIRE_MINUTES
+    get_db, get_read_db, get_current_user, create_access_token,
+    get_password_hash, verify_password, ACCESS_TOKEN_EXPIRE_MINUTES,
+    oauth2_scheme_optional, user_id_from_token, require_admin, is_admin
 )
 from .routers import memory_sets
+from .set_search import ensure_index as ensure_search_index
+from .distractors import distractor_indexer
+from .loop_monitor import loop_monitor, profiler
+from .admission import AdmissionMiddleware, admission
+from .db_routing import replica_router
+from .write_queue import write_queue
+from .solo_sessions import solo_sessions, SOLO_SESSION_TTL
+from .migrations import pending_migrations, run_migrations, stamp_all
+from .official_sets import DEFAULT_MEMORY_SETS, OFFICIAL_TITLE_MAP
+from .jobs import job_runner, JOBS_IN_PROCESS
+from . import job_tasks  # ジョブの種類を登録する
+from .bundles import bundle_store, CACHE_IMMUTABLE_PUBLIC, CACHE_IMMUTABLE_PRIVATE
+from .room_snapshot import drain_state, save_snapshot, load_snapshot, ROOM_RESTORE_GRACE
 
 load_dotenv()
 
 # --- DB初期化 ---
-models.Base.metadata.create_all(bind=engine)
-
-# --- 公式データの定義 ---
-DEFAULT_MEMORY_SETS = {
-    "default": [
-        {"text": "apple", "kana": "アップル"},
-        {"text": "banana", "kana": "バナナ"},
-        {"text": "cherry", "kana": "チェリー"},
-        {"text": "grape", "kana": "ブドウ"},
-        {"text": "orange", "kana": "オレンジ"},
-        {"text": "peach", "kana": "モモ"},
-        {"text": "watermelon", "kana": "スイカ"},
-        {"text": "kiwifruit", "kana": "キウイ"},
-        {"text": "lemon", "kana": "レモン"},
-        {"text": "strawberry", "kana": "イチゴ"},
-        {"text": "mango", "kana": "マンゴー"},
-    ],
-    "programming": [
-        {"text": "Python", "kana": "パイソン"},
-        {"text": "React", "kana": "リアクト"},
-        {"text": "Docker", "kana": "ドッカー"},
-        {"text": "Algorithm", "kana": "アルゴリズム"},
-        {"text": "Database", "kana": "データベース"},
-        {"text": "Frontend", "kana": "フロントエンド"},
-    ],
-    "animals": [
-        {"text": "Lion", "kana": "ライオン"},
-        {"text": "Elephant", "kana": "ゾウ"},
-        {"text": "Giraffe", "kana": "キリン"},
-        {"text": "Penguin", "kana": "ペンギン"},
-        {"text": "Dolphin", "kana": "イルカ"},
-    ],
-    "english_hard": [
-        {"text": "procrastinate", "kana": "先延ばしにする"},
-        {"text": "ambiguous", "kana": "曖昧な"},
-        {"text": "resilient", "kana": "回復力のある"},
-    ],
-}
-
-OFFICIAL_TITLE_MAP = {
-    "default": "基本セット (フルーツ)",
-    "programming": "プログラミング用語",
-    "animals": "動物の名前",
-    "english_hard": "超難問英単語"
-}
-
-
-def seed_official_sets():
-    db = SessionLocal()
-    try:
-        for set_key, words in DEFAULT_MEMORY_SETS.items():
-            title = OFFICIAL_TITLE_MAP.get(set_key, set_key)
-            exists = db.query(models.MemorySet).filter(
-                models.MemorySet.title == title,
-                models.MemorySet.is_official == True
-            ).first()
-            if not exists:
-                new_set = models.MemorySet(
-                    title=title,
-                    words_json=json.dumps(words, ensure_ascii=False),
-                    is_official=True,
-                    owner_id=None
-                )
-                db.add(new_set)
-        db.commit()
-    except Exception as e:
-        print(f"Seeding error: {e}")
-        db.rollback()
-    finally:
-        db.close()
+# 未適用のマイグレーションを起動時に適用するか（大きな DB では 0 にして migrate.py を別に実行する）
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+
+def ensure_schema():
+    """
+    足りないテーブルだけを作る（起動時に呼ぶ）。
+    全テーブルが揃っていれば、テーブル一覧を取る1クエリで終わる。
+    """
+    existing = set(inspect(engine).get_table_names())
+    missing = [t for t in models.Base.metadata.sorted_tables if t.name not in existing]
+    if missing:
+        models.Base.metadata.create_all(bind=engine, tables=missing)
+        print(f"Created tables: {', '.join(t.name for t in missing)}")
+    if len(missing) == len(models.Base.metadata.sorted_tables) and "schema_migrations" not in existing:
+        # 新しい DB はモデルどおりに作ったので、マイグレーションは適用済みとして記録する
+        stamp_all(engine)
+        return
+    if not pending_migrations(engine):
+        return
+    if MIGRATE_ON_STARTUP:
+        run_migrations(engine)
+    else:
+        print("⚠️ Schema migrations are pending. Run `python migrate.py`.")
+
+# 苦手優先モードで一度に取り出す「期限切れ」単語の件数
+REVIEW_DUE_BATCH = 10
 
 
 # --- FastAPIアプリ定義 ---
@@ -109,18 +88,54 @@ app = FastAPI()
 
 @app.on_event("startup")
 async def startup_event():
-    seed_official_sets()
+    ensure_schema()
+    # 検索索引を先に用意しておき、公式セットの投入時にそのまま索引に載せる
+    db = SessionLocal()
+    try:
+        ensure_search_index(engine, db)
+    finally:
+        db.close()
+    # 公式セットの投入はジョブで行う（同じキーなので、再起動を繰り返しても1件しか積まれない）
+    job_runner.enqueue("seed_official_sets", key="seed_official_sets")
+    if JOBS_IN_PROCESS:
+        job_runner.start()
+    match_recorder.start()
+    distractor_indexer.start()
+    restore_rooms()
+    drain_state.install(begin_drain)
+    loop_monitor.start()
+    replica_router.start(write_queue.run)
+    write_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # シグナル以外で止まった場合もここで書き出す
+    begin_drain()
+    loop_monitor.stop()
+    replica_router.stop()
+    # 受け付け済みの書き込みを書き終えてから止める
+    write_queue.stop()
+    job_runner.stop()
+    match_recorder.stop()
+    distractor_indexer.stop()
 
 
 app.include_router(memory_sets.router)
 
 
-def get_current_user_optional(db: Session = Depends(get_db), token: Optional[str] = None):
+async def get_current_user_optional(
+    db: Session = Depends(get_db),
+    token: Optional[str] = None,
+    bearer: Optional[str] = Depends(oauth2_scheme_optional)
+):
+    # Authorization ヘッダー、または従来どおり ?token= で渡されたトークンを使う
+    token = bearer or token
     if not token:
         return None
     try:
-        return get_current_user(token, db)
-    except:
+        return await get_current_user(token, db)
+    except HTTPException:
         return None
 
 
@@ -132,6 +147,8 @@ origins = [
 ]
 origin_regex = r"^http://(localhost|127\.0\.0\.1):517\d$"
 
+# 過負荷のときは優先度の低いルートを 503 で断る（CORS の内側に置き、ブラウザが 503 を読めるようにする）
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -140,6 +157,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# JSON などのレスポンス圧縮（小さいもの・圧縮済みのもの・@skip_compression のルートは除く）
+app.add_middleware(CompressionMiddleware)
 
 
 # @app.get("/")
@@ -160,7 +179,12 @@ class RoomInfo(BaseModel):
     conditionType: str = "score"
     status: str = "waiting"
     playerCount: int = 0
+    capacity: int = 2
+    spectatorCount: int = 0
     memorySetId: str = "default"
+    compressFrames: bool = False
+    # ブロードキャストをまとめて送る時間窓（ミリ秒、0 ならまとめない）
+    batchWindowMs: float = 0
     memorizeTime: int = 3
     answerTime: int = 10
     questionsPerRound: int = 1
@@ -177,6 +201,11 @@ class CreateRoomRequest(BaseModel):
     winScore: int
     memorySetId: str
     conditionType: str = "score"
+    capacity: int = Field(default=2, ge=2, le=30)
+    # WebSocket フレームの圧縮 (permessage-deflate) を使うか（回線の細いモバイル向け）
+    compressFrames: bool = False
+    # 短い時間窓で重なったブロードキャストを1フレームにまとめて送るか（窓の長さは WS_BATCH_WINDOW_MS）
+    batchFrames: bool = False
 
 
 class VerifyPasswordRequest(BaseModel):
@@ -184,69 +213,108 @@ class VerifyPasswordRequest(BaseModel):
     password: str
 
 
+class EnqueueJobRequest(BaseModel):
+    kind: str
+    payload: dict = Field(default_factory=dict)
+    key: Optional[str] = None
+
+
 # メモリ内データ
 active_rooms: Dict[str, RoomInfo] = {}
 room_passwords: Dict[str, str] = {}
 room_owner_tokens: Dict[str, str] = {}
 room_clients: Dict[str, Set[str]] = {}
-room_player_states: Dict[str, Dict[str, str]] = {}
+room_rounds: Dict[str, RoundTracker] = {}
 room_retry_players: Dict[str, Set[str]] = {}
 room_player_names: Dict[str, Dict[str, str]] = {}
-room_player_scores: Dict[str, Dict[str, int]] = {}
+room_standings: Dict[str, Standings] = {}
+# ログインして対戦しているプレイヤーの player_id -> user_id（戦績の集計用）
+room_player_users: Dict[str, Dict[str, int]] = {}
 
 # player_id ごとの現在の接続(WebSocket)を保持するためのマップ
 # 高速な再接続時に古い接続を確実にクローズするために使用
 player_websockets: Dict[str, tuple[WebSocket, str]] = {}
 
+# WebSocket のハンドシェイク時に、ルームが圧縮を希望しているかを答える
+frame_compression.room_enabled = lambda room_id: room_id in active_rooms and active_rooms[room_id].compressFrames
+
 # ==========================
 #  API エンドポイント
 # ==========================
 
 @app.get("/api/ranking", response_model=List[schemas.RankEntry])
 def get_ranking(set_id: str, win_score: int, condition_type: str, db: Session = Depends(get_db)):
-    query = db.query(models.Ranking).filter(
-        models.Ranking.set_id == set_id,
-        models.Ranking.win_score == win_score,
-        models.Ranking.condition_type == condition_type
-    )
-
-    query = query.order_by(
-        desc(models.Ranking.accuracy),
-        asc(models.Ranking.avg_speed),
-        desc(models.Ranking.created_at)
-    )
-
-    return query.limit(10).all()
+    # 1人1行の自己ベストから上位10件（同じ人が何度遊んでも埋め尽くされない）
+    board = leaderboards.get(db, (set_id, win_score, condition_type))
+    return board.slice(0, 10)
+
+
+@app.get("/api/ranking/me")
+def get_my_rank(
+    set_id: str,
+    win_score: int,
+    condition_type: str,
+    name: str,
+    radius: int = NEIGHBOUR_RADIUS,
+    db: Session = Depends(get_db)
+):
+    """指定したプレイヤーの順位と前後 radius 人"""
+    board = leaderboards.get(db, (set_id, win_score, condition_type))
+    radius = max(0, min(radius, 50))
+    return board.around(name, radius)
 
 
 @app.post("/api/ranking")
-def post_ranking(entry: schemas.RankEntry, db: Session = Depends(get_db)):
-    new_rank = models.Ranking(
-        name=entry.name,
-        time=entry.time,
-        set_id=entry.set_id,
-        win_score=entry.win_score,
-        condition_type=entry.condition_type,
-        accuracy=entry.accuracy,
-        avg_speed=entry.avg_speed
-    )
-    db.add(new_rank)
-    db.commit()
-    db.refresh(new_rank)
+def post_ranking(
+    entry: schemas.RankEntry,
+    db: Session = Depends(get_db),
+    current_user: Optional[models.User] = Depends(get_current_user_optional)
+):
+    user_id = current_user.id if current_user else None
+
+    def write(db: Session):
+        new_rank = models.Ranking(
+            name=entry.name,
+            time=entry.time,
+            set_id=entry.set_id,
+            win_score=entry.win_score,
+            condition_type=entry.condition_type,
+            accuracy=entry.accuracy,
+            avg_speed=entry.avg_speed,
+            user_id=user_id
+        )
+        db.add(new_rank)
+        if user_id:
+            player_stats.on_ranking(db, user_id, new_rank)
+        db.flush()
+        return upsert_best(db, new_rank)
+
+    best = write_queue.run(db, write)
+    if best is not None:
+        leaderboards.apply(best)
     return {"message": "Ranking updated"}
 
 
 @app.post("/api/register", response_model=schemas.UserResponse)
 def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
-    if db_user:
+    if db.query(models.User).filter(models.User.username == user.username).first():
         raise HTTPException(status_code=400, detail="Username already registered")
+    # ハッシュ化は重いので書き込みの外で済ませておく
     hashed_password = get_password_hash(user.password)
-    new_user = models.User(username=user.username, hashed_password=hashed_password)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+
+    def write(db: Session):
+        # 確認してから書くまでの間に同じ名前で登録されていないか、書き込みの中でもう一度見る
+        if db.query(models.User).filter(models.User.username == user.username).first():
+            raise HTTPException(status_code=400, detail="Username already registered")
+        new_user = models.User(username=user.username, hashed_password=hashed_password)
+        db.add(new_user)
+        db.flush()
+        db.refresh(new_user)
+        # 応答に含めるので、書き込みのセッションが閉じる前に読み込んでおく
+        new_user.memory_sets
+        return new_user
+
+    return write_queue.run(db, write)
 
 
 @app.post("/token")
@@ -260,123 +328,267 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
 
 @app.get("/api/users/me", response_model=schemas.UserResponse)
 def read_users_me(current_user: models.User = Depends(get_current_user)):
-    formatted_sets = []
-    for s in current_user.memory_sets:
-        formatted_sets.append(schemas.MemorySetResponse(
-            id=s.id, title=s.title,
-            words=json.loads(s.words_json) if s.words_json else [],
-            owner_id=s.owner_id, memorize_time=s.memorize_time,
-            answer_time=s.answer_time, questions_per_round=s.questions_per_round,
-            win_score=s.win_score, condition_type=s.condition_type,
-            order_type=s.order_type, is_official=s.is_official
-        ))
-    return schemas.UserResponse(id=current_user.id, username=current_user.username, memory_sets=formatted_sets)
+    return FastJSONResponse(user_json(current_user))
 
 
-@app.get("/api/problem")
-def get_problem(
-    room_id: Optional[str] = None,
-    set_id: Optional[str] = None,
-    seed: Optional[str] = None,
-    wrong_history: Optional[str] = None,
-    current_index: int = 0,
+@app.get("/api/users/me/stats")
+def read_my_stats(days: int = 30, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """戦績画面用の集計（集計テーブルを読むだけ）"""
+    return player_stats.read_stats(db, current_user.id, max(1, min(days, 365)))
+
+
+def find_memory_set(db: Session, set_id: str) -> Optional[models.MemorySet]:
+    """数字ならセットID、それ以外は公式セットのキー ("default" など) として探す"""
+    if str(set_id).isdigit():
+        return db.query(models.MemorySet).filter(models.MemorySet.id == int(set_id)).first()
+    if set_id in OFFICIAL_TITLE_MAP:
+        return db.query(models.MemorySet).filter(
+            models.MemorySet.title == OFFICIAL_TITLE_MAP[set_id],
+            models.MemorySet.is_official == True
+        ).first()
+    return None
+
+
+@app.get("/api/sets/{set_id}/bundle")
+def get_set_bundle_hash(
+    set_id: str,
     db: Session = Depends(get_db),
     current_user: Optional[models.User] = Depends(get_current_user_optional)
 ):
-    target_id = None
-    if room_id and room_id in active_rooms:
-        target_id = active_rooms[room_id].memorySetId
-    else:
-        target_id = set_id or "default"
+    """
+    セットの現在のバンドルのハッシュを返す。中身は /api/bundles/{hash} から取り、
+    ハッシュが変わらない限りブラウザのキャッシュをそのまま使える。
+    """
+    db_set = find_memory_set(db, set_id)
+    if db_set is None:
+        raise HTTPException(status_code=404, detail="Set not found")
+    if not (db_set.is_official or db_set.is_public or (current_user and db_set.owner_id == current_user.id)):
+        raise HTTPException(status_code=404, detail="Set not found")
+    digest = bundle_store.current_hash(db_set)
+    return FastJSONResponse(
+        {"hash": digest, "url": f"/api/bundles/{digest}"},
+        headers={"cache-control": "no-cache", "etag": f'"{digest}"'}
+    )
 
+
+@app.get("/api/bundles/{bundle_hash}")
+@skip_compression
+def get_bundle(bundle_hash: str, request: Request):
+    """内容ハッシュで引くので中身は変わらない。永続キャッシュ可能なヘッダーで返す"""
+    found = bundle_store.find(bundle_hash)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Bundle not found")
+    path, public = found
+    headers = {
+        "cache-control": CACHE_IMMUTABLE_PUBLIC if public else CACHE_IMMUTABLE_PRIVATE,
+        "etag": f'"{bundle_hash}"',
+        "vary": "Accept-Encoding",
+    }
+    if request.headers.get("if-none-match") == f'"{bundle_hash}"':
+        return Response(status_code=304, headers=headers)
+    if negotiate(request.headers.get("accept-encoding", ""), ("gzip",)) and os.path.exists(path + ".gz"):
+        headers["content-encoding"] = "gzip"
+        path = path + ".gz"
+    return FileResponse(path, media_type="application/json", headers=headers)
+
+
+def load_problem_set(db: Session, target_id: str):
+    """出題元の (単語リスト, 出題順, DB のセット) を返す。見つからなければ公式の default"""
     target_problems = None
     order_type = "random"
+    source_set = None
 
-    if str(target_id).isdigit():
-        db_set = db.query(models.MemorySet).filter(models.MemorySet.id == int(target_id)).first()
-        if db_set:
-            try:
-                target_problems = json.loads(db_set.words_json)
-                order_type = db_set.order_type
-            except:
-                pass
-
-    if not target_problems and target_id in OFFICIAL_TITLE_MAP:
-        title = OFFICIAL_TITLE_MAP[target_id]
-        db_set = db.query(models.MemorySet).filter(
-            models.MemorySet.title == title,
-            models.MemorySet.is_official == True
-        ).first()
-        if db_set:
-            try:
-                target_problems = json.loads(db_set.words_json)
-                order_type = db_set.order_type
-            except:
-                pass
+    db_set = find_memory_set(db, target_id)
+    if db_set:
+        try:
+            target_problems = load_words(db_set)
+            order_type = db_set.order_type
+            source_set = db_set
+        except InvalidWords:
+            # 壊れたセットは出題せず、下の公式セットで代用する（エラーはログに出力済み）
+            pass
 
     if not target_problems and target_id in DEFAULT_MEMORY_SETS:
         target_problems = DEFAULT_MEMORY_SETS[target_id]
 
     if not target_problems:
         target_problems = DEFAULT_MEMORY_SETS["default"]
+    return target_problems, order_type, source_set
 
-    effective_seed = seed
-    if effective_seed is None and room_id and room_id in active_rooms:
-        effective_seed = active_rooms[room_id].seed
-    rng = random.Random(effective_seed) if effective_seed is not None else random
 
-    if order_type == "sequential":
-        idx = current_index % len(target_problems)
-        correct = target_problems[idx]
-    elif order_type == "review":
-        if current_user:
-            stats = db.query(models.UserWordStat).filter(models.UserWordStat.user_id == current_user.id).all()
-            miss_map = {s.word_text: s.miss_count for s in stats}
-            weights = []
-            for p in target_problems:
-                weight = 1 + (miss_map.get(p["text"], 0) * 5)
-                weights.append(weight)
-            correct = rng.choices(target_problems, weights=weights, k=1)[0]
+@app.post("/api/solo/sessions")
+def create_solo_session(
+    set_id: Optional[str] = None,
+    seed: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    ソロプレイ1回分の出題状態をサーバーに作る。以後は /api/problem に session_id だけを渡せばよく、
+    出題番号や間違えた単語の一覧をクライアントが毎回送らなくて済む。
+    """
+    target_id = set_id or "default"
+    problems, order_type, source_set = load_problem_set(db, target_id)
+    solo_set = solo_sessions.set_for(
+        str(target_id),
+        source_set.id if source_set is not None else None,
+        source_set.words_json if source_set is not None else None,
+        problems, order_type
+    )
+    return {"sessionId": solo_sessions.create(solo_set, seed), "ttlSeconds": SOLO_SESSION_TTL}
+
+
+@app.post("/api/solo/sessions/{session_id}/misses")
+def record_solo_miss(session_id: str, word_text: str):
+    """間違えた単語を記録する（苦手優先モードで出やすくなる）"""
+    session = solo_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Solo session not found")
+    solo_sessions.record_miss(session, word_text)
+    return {"status": "ok"}
+
+
+@app.get("/api/problem")
+def get_problem(
+    room_id: Optional[str] = None,
+    set_id: Optional[str] = None,
+    seed: Optional[str] = None,
+    wrong_history: Optional[str] = None,
+    current_index: int = 0,
+    distractors: Optional[str] = None,
+    session_id: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+    current_user: Optional[models.User] = Depends(get_current_user_optional)
+):
+    session = None
+    if session_id:
+        session = solo_sessions.get(session_id)
+        if session is None:
+            # 期限切れ。クライアントはセッションを作り直すか、従来のパラメータで問い合わせる
+            raise HTTPException(status_code=404, detail="Solo session not found")
+        target_id = session.set.key
+        target_problems = session.set.problems
+        order_type = session.set.order_type
+        source_set = None
+        if distractors == "hard" and session.set.set_id is not None:
+            source_set = db.get(models.MemorySet, session.set.set_id)
+        rng = session.rng
+    else:
+        if room_id and room_id in active_rooms:
+            target_id = active_rooms[room_id].memorySetId
         else:
-            wrong_list = wrong_history.split(",") if wrong_history else []
-            weighted_pool = []
-            for p in target_problems:
-                weight = 5 if p["text"] in wrong_list else 1
-                weighted_pool.extend([p] * weight)
-            correct = rng.choice(weighted_pool)
+            target_id = set_id or "default"
+
+        target_problems, order_type, source_set = load_problem_set(db, target_id)
+
+        effective_seed = seed
+        if effective_seed is None and room_id and room_id in active_rooms:
+            effective_seed = active_rooms[room_id].seed
+        rng = random.Random(effective_seed) if effective_seed is not None else random
+
+    correct_idx = None
+    if order_type == "review" and current_user:
+        # 間隔反復: 期限が来ている単語と、まだ答えたことのない単語から出題する（どちらも無ければランダム）
+        by_text = {p["text"]: p for p in target_problems}
+        due = [
+            by_text[w] for w in due_words(db, current_user.id, str(target_id), list(by_text), REVIEW_DUE_BATCH)
+            if w in by_text
+        ]
+        correct = rng.choice(due) if due else rng.choice(target_problems)
+    elif session is not None:
+        correct_idx = solo_sessions.next_index(session)
+        correct = target_problems[correct_idx]
+    elif order_type == "sequential":
+        correct_idx = current_index % len(target_problems)
+        correct = target_problems[correct_idx]
+    elif order_type == "review":
+        wrong_list = wrong_history.split(",") if wrong_history else []
+        weighted_pool = []
+        for p in target_problems:
+            weight = 5 if p["text"] in wrong_list else 1
+            weighted_pool.extend([p] * weight)
+        correct = rng.choice(weighted_pool)
     else:
-        correct = rng.choice(target_problems)
+        correct_idx = rng.randrange(len(target_problems))
+        correct = target_problems[correct_idx]
 
-    others = [p for p in target_problems if p["text"] != correct["text"]]
-    sample_size = min(3, len(others))
-    wrong_options = rng.sample(others, sample_size)
+    entry = None
+    if distractors == "hard" and source_set is not None:
+        entry = distractor_indexer.lookup(db, source_set, target_problems)
+    wrong_options = pick_wrong_options(rng, target_problems, correct, correct_idx, entry)
     options = [correct] + wrong_options
     rng.shuffle(options)
 
     return {"correct": correct, "options": options}
 
 
+def pick_wrong_options(rng, problems: list, correct: dict, correct_idx: Optional[int], entry=None) -> list:
+    """
+    不正解の選択肢を3つ選ぶ。毎回セット全体をなめないよう、位置をいくつか引いてから
+    正解と同じ単語を除く。hard のときは近傍索引の中から選び、足りない分はランダムで補う。
+    """
+    picked: List[dict] = []
+    seen = {correct["text"]}
+    if entry is not None:
+        if correct_idx is None:
+            correct_idx = entry.positions.get(correct["text"])
+        if correct_idx is not None and correct_idx < len(entry.neighbours):
+            near = entry.neighbours[correct_idx]
+            for j in rng.sample(near, min(3, len(near))):
+                if j < len(problems) and problems[j]["text"] not in seen:
+                    picked.append(problems[j])
+                    seen.add(problems[j]["text"])
+
+    need = 3 - len(picked)
+    if need > 0:
+        for j in rng.sample(range(len(problems)), min(len(problems), need + len(seen))):
+            if len(picked) == 3:
+                break
+            if problems[j]["text"] not in seen:
+                picked.append(problems[j])
+                seen.add(problems[j]["text"])
+    if len(picked) < 3 and len(problems) > len(picked) + 1:
+        # 同じ単語が重複しているセットでは引き直しが足りないことがあるので、そのときだけ全体から選ぶ
+        others = [p for p in problems if p["text"] not in seen]
+        picked.extend(rng.sample(others, min(3 - len(picked), len(others))))
+    return picked
+
+
 @app.post("/api/word_stats")
-def record_word_stat(word_text: str, is_correct: bool, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    stat = db.query(models.UserWordStat).filter(
-        models.UserWordStat.user_id == current_user.id,
-        models.UserWordStat.word_text == word_text
-    ).first()
-
-    if not stat:
-        stat = models.UserWordStat(
-            user_id=current_user.id,
-            word_text=word_text,
-            correct_count=0,
-            miss_count=0
-        )
-        db.add(stat)
+def record_word_stat(
+    word_text: str,
+    is_correct: bool,
+    set_id: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    user_id = current_user.id
 
-    if is_correct:
-        stat.correct_count += 1
-    else:
-        stat.miss_count += 1
-    db.commit()
+    def write(db: Session):
+        stat = db.query(models.UserWordStat).filter(
+            models.UserWordStat.user_id == user_id,
+            models.UserWordStat.word_text == word_text
+        ).first()
+
+        if not stat:
+            stat = models.UserWordStat(
+                user_id=user_id,
+                word_text=word_text,
+                correct_count=0,
+                miss_count=0
+            )
+            db.add(stat)
+
+        if is_correct:
+            stat.correct_count += 1
+        else:
+            stat.miss_count += 1
+
+        # セットが分かる場合は間隔反復のスケジュールも更新する
+        if set_id:
+            update_schedule(db, user_id, set_id, word_text, is_correct)
+        player_stats.on_word_stat(db, user_id, word_text, is_correct, stat.miss_count)
+
+    write_queue.run(db, write)
     return {"status": "ok"}
 
 
@@ -391,6 +603,8 @@ def get_rooms():
 
 @app.post("/api/rooms")
 def create_room(req: CreateRoomRequest, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    if drain_state.draining:
+        raise HTTPException(status_code=503, detail="サーバー再起動中のため、しばらくしてから作成してください")
     if req.name in active_rooms:
         raise HTTPException(status_code=400, detail="そのルーム名は既に使用されています")
 
@@ -416,6 +630,9 @@ def create_room(req: CreateRoomRequest, current_user: models.User = Depends(get_
         memorySetId=req.memorySetId, memorizeTime=mem_time,
         answerTime=ans_time, questionsPerRound=q_per_round,
         conditionType=req.conditionType,
+        capacity=req.capacity,
+        compressFrames=req.compressFrames,
+        batchWindowMs=WS_BATCH_WINDOW_MS if req.batchFrames else 0,
         currentRound=0,
         resolvedRound=0
     )
@@ -426,53 +643,164 @@ def create_room(req: CreateRoomRequest, current_user: models.User = Depends(get_
     owner_token = str(uuid.uuid4())
     room_owner_tokens[req.name] = owner_token
 
-    room_player_scores[req.name] = {}
+    room_standings[req.name] = Standings()
     room_player_names[req.name] = {}
-    room_player_states[req.name] = {}
+    room_player_users[req.name] = {}
+    room_rounds[req.name] = RoundTracker()
 
     return {"message": "Room created", "room": new_room, "ownerToken": owner_token}
 
 
 @app.delete("/api/rooms/{room_id}")
-def delete_room(room_id: str, token: Optional[str] = None, current_user: models.User = Depends(get_current_user)):
+async def delete_room(room_id: str, token: Optional[str] = None, current_user: models.User = Depends(get_current_user)):
     if room_id not in active_rooms:
         raise HTTPException(status_code=404, detail="ルームが見つかりません")
     is_owner = room_owner_tokens.get(room_id) == token
     is_empty = active_rooms[room_id].playerCount <= 0
     if not (is_owner or is_empty):
         raise HTTPException(status_code=403, detail="権限がありません")
-    for d in [active_rooms, room_passwords, room_owner_tokens, room_clients, room_player_states, room_retry_players, room_player_names, room_player_scores]:
+    record_match_end(room_id, aborted=True)
+    for d in [active_rooms, room_passwords, room_owner_tokens, room_clients, room_rounds, room_retry_players, room_player_names, room_player_users, room_standings]:
         d.pop(room_id, None)
+    ws_guard.release_room(room_id)
+    manager.event_logs.pop(room_id, None)
+    await manager.close_spectators(room_id)
     return {"message": "Room deleted"}
 
 
+@app.get("/api/metrics/websocket")
+def get_websocket_metrics():
+    return {**ws_guard.stats(), "batching": manager.batch_stats()}
+
+
+@app.get("/api/metrics/compression")
+def get_compression_metrics():
+    return {"http": http_stats.stats(), "websocket": frame_stats.stats()}
+
+
+@app.get("/api/metrics/db")
+def get_db_metrics():
+    return {**replica_router.stats(), "writeQueue": write_queue.stats()}
+
+
+@app.get("/api/metrics/solo")
+def get_solo_metrics():
+    return solo_sessions.stats()
+
+
+@app.get("/api/metrics/matches")
+def get_match_log_metrics():
+    return match_recorder.stats()
+
+
+@app.get("/api/metrics/loop")
+def get_loop_metrics():
+    return loop_monitor.stats()
+
+
+@app.get("/api/metrics/admission")
+async def get_admission_metrics():
+    # スレッドプールの待ち行列はイベントループ上でしか読めないので async で定義する
+    return admission.stats()
+
+
+@app.post("/api/admin/profile", dependencies=[Depends(require_admin)])
+@skip_compression
+def capture_profile(seconds: float = 10):
+    """指定秒数ぶん全スレッドのスタックを採取し、折りたたみ形式（flamegraph 用）で返す"""
+    path = profiler.capture(seconds)
+    if path is None:
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    return FileResponse(path, media_type="text/plain", filename=os.path.basename(path))
+
+
+@app.post("/api/admin/jobs", dependencies=[Depends(require_admin)])
+def enqueue_job(req: EnqueueJobRequest):
+    """メンテナンス作業をジョブとして積む（実行はワーカーが行い、ここではすぐ返る）"""
+    try:
+        job_id = job_runner.enqueue(req.kind, req.payload, req.key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job_runner.get(job_id)
+
+
+@app.get("/api/admin/jobs", dependencies=[Depends(require_admin)])
+def list_jobs(status: Optional[str] = None, limit: int = 50):
+    return {"stats": job_runner.stats(), "jobs": job_runner.list(status, max(1, min(limit, 500)))}
+
+
+@app.get("/api/admin/jobs/{job_id}", dependencies=[Depends(require_admin)])
+def get_job(job_id: int):
+    job = job_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.get("/api/matches/{match_id}/replay")
+def replay_match(
+    match_id: str,
+    current_user: Optional[models.User] = Depends(get_current_user_optional),
+    x_admin_token: Optional[str] = Header(default=None)
+):
+    """記録済みの対戦を1レコード1行の JSON (NDJSON) で順に返す（参加者と管理者のみ）"""
+    admin = is_admin(x_admin_token)
+    if current_user is None and not admin:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        found = match_recorder.exists(match_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid match id")
+    if not found:
+        raise HTTPException(status_code=404, detail="Match not found")
+    if not admin and current_user.id not in match_recorder.participants(match_id):
+        raise HTTPException(status_code=403, detail="権限がありません")
+
+    def stream():
+        for event in match_recorder.replay(match_id):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def room_password_ok(room_id: str, password: Optional[str]) -> bool:
+    """鍵の無いルームは誰でも、鍵付きのルームは合言葉が一致したときだけ入れる"""
+    expected = room_passwords.get(room_id)
+    if expected is None:
+        return False
+    return expected == "" or password == expected
+
+
 @app.post("/api/rooms/verify")
 def verify_room_password(req: VerifyPasswordRequest):
-    if room_passwords.get(req.roomId) == req.password:
+    if room_password_ok(req.roomId, req.password):
         return {"message": "OK"}
     raise HTTPException(status_code=401, detail="パスワードが違います")
 
 
 # ★ 最後の修正：delayed_room_cleanup を安全化（接続掃除→pop）
-async def delayed_room_cleanup(room_id: str):
+async def delayed_room_cleanup(room_id: str, delay: float = 1):
     try:
-        await asyncio.sleep(1)
+        await asyncio.sleep(delay)
         if room_id in active_rooms and active_rooms[room_id].playerCount <= 0:
+            record_match_end(room_id, aborted=True)
             # ルーム関連データの削除
             for d in [
                 active_rooms,
                 room_passwords,
                 room_owner_tokens,
                 room_clients,
-                room_player_states,
+                room_rounds,
                 room_retry_players,
                 room_player_names,
-                room_player_scores,
+                room_player_users,
+                room_standings,
             ]:
                 try:
                     d.pop(room_id, None)
                 except:
                     pass
+            ws_guard.release_room(room_id)
 
             # ★ manager 側の接続を「掃除してから」pop する（競合しにくい）
             try:
@@ -483,6 +811,12 @@ async def delayed_room_cleanup(room_id: str):
                     except:
                         pass
                 manager.active_connections.pop(room_id, None)
+                manager.event_logs.pop(room_id, None)
+            except:
+                pass
+
+            try:
+                await manager.close_spectators(room_id)
             except:
                 pass
 
@@ -495,6 +829,77 @@ async def delayed_room_cleanup(room_id: str):
             pass
 
 
+# ==========================
+#  再起動時のルーム引き継ぎ
+# ==========================
+
+def snapshot_rooms() -> List[dict]:
+    rooms = []
+    for room_id, room in active_rooms.items():
+        rounds = room_rounds.get(room_id)
+        standings = room_standings.get(room_id)
+        rooms.append({
+            "room": room.model_dump(),
+            "password": room_passwords.get(room_id, ""),
+            "ownerToken": room_owner_tokens.get(room_id),
+            "names": room_player_names.get(room_id, {}),
+            "users": room_player_users.get(room_id, {}),
+            "rounds": rounds.to_dict() if rounds else None,
+            "standings": standings.to_dict() if standings else None,
+            "seq": manager.event_log(room_id).seq,
+        })
+    return rooms
+
+
+def begin_drain():
+    """新規ルームの受付を止め、進行中のルームを書き出す（一度だけ）"""
+    drain_state.draining = True
+    if drain_state.saved:
+        return
+    drain_state.saved = True
+    if not active_rooms:
+        return
+    try:
+        save_snapshot(snapshot_rooms())
+        print(f"Saved {len(active_rooms)} rooms for restart.")
+    except Exception as e:
+        print(f"Room snapshot failed: {e}")
+
+
+def restore_rooms():
+    """
+    前回のプロセスが書き出したルームを読み込む。
+    クライアントは切断後に自動で再接続し、通常の SYNC / 連番の再送で追いつく。
+    """
+    rooms = load_snapshot()
+    if not rooms:
+        return
+    for item in rooms:
+        room = RoomInfo(**item["room"])
+        room_id = room.id
+        room.playerCount = 0
+        room.spectatorCount = 0
+        active_rooms[room_id] = room
+        room_passwords[room_id] = item.get("password", "")
+        room_owner_tokens[room_id] = item.get("ownerToken") or str(uuid.uuid4())
+        room_clients[room_id] = set()
+        room_player_names[room_id] = item.get("names", {})
+        room_player_users[room_id] = {pid: int(uid) for pid, uid in item.get("users", {}).items()}
+        room_rounds[room_id] = RoundTracker.from_dict(item["rounds"]) if item.get("rounds") else RoundTracker()
+        room_standings[room_id] = Standings.from_dict(item["standings"]) if item.get("standings") else Standings()
+        # 連番を引き継ぎ、取りこぼしの無いクライアントは SYNC なしで再開できるようにする
+        manager.event_log(room_id).seq = item.get("seq", 0)
+        if room.status == "playing":
+            match_recorder.open_matches.add(room.gameSessionId)
+            # 決着済みで次のラウンドへ進む前に止まったルームは、失われた切り替えをここで予約し直す。
+            # 未決着のラウンドは、戻ってきたプレイヤーの回答か、接続時の resolve_if_all_wrong で決着する
+            if room.currentRound > 0 and room.resolvedRound >= room.currentRound:
+                asyncio.create_task(proceed_to_next_round(room_id, room.currentRound, room.gameSessionId))
+        # 誰も戻ってこなければ片付ける（戻ってきた時点で playerCount が増えるので消えない）
+        manager.cleanup_tasks[room_id] = asyncio.create_task(delayed_room_cleanup(room_id, ROOM_RESTORE_GRACE))
+    print(f"Restored {len(rooms)} rooms from snapshot.")
+
+
 # ==========================
 #  WebSocket 審判ロジック
 # ==========================
@@ -512,21 +917,131 @@ async def proceed_to_next_round(room_id: str, round_to_finish: int, session_id:
     room.currentRound += 1
     room.seed = str(uuid.uuid4())
 
-    if room_id in room_player_states:
-        for pid in room_player_states[room_id]:
-            room_player_states[room_id][pid] = "pending"
+    if room_id in room_rounds:
+        room_rounds[room_id].next_round()
+
+    # 出題数で終わるルールでは、規定ラウンドを超えた時点で試合終了
+    if room.conditionType == "total" and room.currentRound > room.winScore:
+        record_match_end(room_id)
+    else:
+        match_recorder.record(ROUND_START, session_id, room.currentRound, room.seed)
 
-    next_info = json.dumps({"round": room.currentRound, "seed": room.seed})
+    next_info = json.dumps(build_round_payload(room_id))
     await manager.broadcast(f"SERVER:NEXT_ROUND:{next_info}", room_id)
 
 
+def resolve_if_all_wrong(room_id: str):
+    """接続中の全員が今のラウンドを間違えていれば、ラウンドを締めて次へ進める"""
+    room = active_rooms.get(room_id)
+    tracker = room_rounds.get(room_id)
+    if room is None or tracker is None or room.currentRound <= room.resolvedRound:
+        return
+    if not tracker.all_wrong():
+        return
+    room.resolvedRound = room.currentRound
+    asyncio.create_task(proceed_to_next_round(room_id, room.currentRound, room.gameSessionId))
+
+
+def build_sync_payload(room_id: str) -> dict:
+    room = active_rooms[room_id]
+    standings = room_standings.get(room_id)
+    return {
+        "status": room.status,
+        "currentRound": room.currentRound,
+        "seed": room.seed,
+        "scores": standings.scores if standings else {},
+        "standings": standings.top() if standings else [],
+        "names": room_player_names.get(room_id, {}),
+        "winScore": room.winScore,
+        "conditionType": room.conditionType,
+        "capacity": room.capacity,
+        "seq": manager.event_log(room_id).seq
+    }
+
+
+def record_match_start(room_id: str):
+    room = active_rooms[room_id]
+    players = sorted(room_clients.get(room_id, set()))
+    # リプレイを見られるのは参加したログインユーザー（と管理者）だけなので、ユーザー ID も残す
+    user_ids = [uid for pid, uid in room_player_users.get(room_id, {}).items() if pid in players]
+    match_recorder.start_match(room.gameSessionId, room_id, room.memorySetId, players, user_ids)
+    match_recorder.record(ROUND_START, room.gameSessionId, room.currentRound, room.seed)
+
+
+def record_match_end(room_id: str, aborted: bool = False):
+    """試合結果を記録する（記録済み・未開始の試合なら何もしない）"""
+    room = active_rooms.get(room_id)
+    if room is None:
+        return
+    standings = room_standings.get(room_id)
+    top = standings.top() if standings else []
+    finished = match_recorder.finish_match(room.gameSessionId, top, aborted)
+
+    # 正常に終わった試合はログイン中のプレイヤーの戦績に反映する（単独トップのみ勝ち）
+    users = room_player_users.get(room_id)
+    if finished and not aborted and users and top:
+        winner = top[0][0] if len(top) == 1 or top[0][1] > top[1][1] else None
+        results = {user_id: pid == winner for pid, user_id in users.items()}
+        asyncio.get_running_loop().run_in_executor(None, player_stats.record_battle_result, results)
+
+
+def build_round_payload(room_id: str) -> dict:
+    room = active_rooms[room_id]
+    payload = {"round": room.currentRound, "seed": room.seed}
+    standings = room_standings.get(room_id)
+    if standings is not None:
+        # スコア順の並びは常に保たれているので、そのまま載せるだけでよい
+        payload["standings"] = standings.top()
+    return payload
+
+
+# ※ /ws/{room_id}/{player_id} より先に登録すること（パスが衝突するため）
+@app.websocket("/ws/spectate/{room_id}")
+async def spectator_endpoint(websocket: WebSocket, room_id: str, password: Optional[str] = None):
+    """観戦専用の接続。プレイヤーとして数えず、送信されたメッセージは無視する"""
+    await websocket.accept()
+    if room_id not in active_rooms:
+        await websocket.close(code=4000)
+        return
+    # 鍵付きのルームは、入室と同じく合言葉を知っている人だけが観戦できる
+    if not room_password_ok(room_id, password):
+        await websocket.close(code=4002)
+        return
+
+    channel = manager.connect_spectator(websocket, room_id)
+    if channel is None:
+        await websocket.close(code=4003)
+        return
+    active_rooms[room_id].spectatorCount = manager.spectator_count(room_id)
+
+    # 登録してからスナップショットを作り、同じ送信キューの先頭に積む（間に await を挟まない）。
+    # 以降のブロードキャストは必ずスナップショットの後ろに並ぶので、取りこぼしも重複も無い
+    sync_payload = build_sync_payload(room_id)
+    sync_payload["spectator"] = True
+    channel.offer({"type": "websocket.send", "text": f"SERVER:SYNC:{json.dumps(sync_payload)}"})
+
+    try:
+        while True:
+            # 観戦者からの入力は読み捨てる（切断検知のためだけに受信する）
+            await websocket.receive_text()
+    except:
+        pass
+    finally:
+        manager.disconnect_spectator(websocket, room_id)
+        if room_id in active_rooms:
+            active_rooms[room_id].spectatorCount = manager.spectator_count(room_id)
+
+
 @app.websocket("/ws/battle/{room_id}/{player_id}")
 @app.websocket("/ws/{room_id}/{player_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     room_id: str,
     player_id: str,
-    setName: Optional[str] = None
+    setName: Optional[str] = None,
+    resume: Optional[int] = None,
+    token: Optional[str] = None,
+    batch: Optional[int] = None
 ):
     # 【強化】既存の同じプレイヤーの接続があれば強制終了させる（ゾンビ排除）
     if player_id in player_websockets:
@@ -538,62 +1053,88 @@ async def websocket_endpoint(
             pass
 
     await websocket.accept()
-    player_websockets[player_id] = (websocket, room_id)
 
     if room_id not in active_rooms:
         await websocket.close(code=4000)
         return
 
-    await manager.connect(websocket, room_id)
     room = active_rooms[room_id]
+    # 満員のルームには新しいプレイヤーを入れない（再接続は許可）
+    if room.playerCount >= room.capacity and player_id not in room_clients.get(room_id, set()):
+        await websocket.close(code=4001)
+        return
+
+    # 入室を断った接続は finally を通らないので、登録は入室が決まってから行う
+    player_websockets[player_id] = (websocket, room_id)
+
+    # resume を付けて接続したクライアントには連番付きフレームを送る（値は最後に受信した連番、初回は 0）
+    # まとめ送りはルームが有効にしていて、クライアントも batch=1 で BATCH フレームを読めると言ったときだけ
+    batch_window = room.batchWindowMs / 1000 if batch and room.batchWindowMs > 0 else 0
+    await manager.connect(websocket, room_id, sequenced=resume is not None, batch_window=batch_window)
 
     # データ構造の初期化
     if room_id not in room_clients:
         room_clients[room_id] = set()
-    if room_id not in room_player_states:
-        room_player_states[room_id] = {}
+    if room_id not in room_rounds:
+        room_rounds[room_id] = RoundTracker()
     if room_id not in room_player_names:
         room_player_names[room_id] = {}
-    if room_id not in room_player_scores:
-        room_player_scores[room_id] = {}
+    if room_id not in room_standings:
+        room_standings[room_id] = Standings()
 
     room_clients[room_id].add(player_id)
     room.playerCount = len(room_clients[room_id])
 
-    if player_id not in room_player_states[room_id]:
-        room_player_states[room_id][player_id] = "pending"
-    if player_id not in room_player_scores[room_id]:
-        room_player_scores[room_id][player_id] = 0
-
-    # 初期同期
+    room_rounds[room_id].add_player(player_id)
+    room_standings[room_id].add_player(player_id)
+    # 再起動で復元したルームでは、戻ってこないプレイヤーは切断扱いにならない。
+    # 戻ってきた全員が既に間違えていれば、誰の回答も待たずにここで決着させる
+    if room.status == "playing":
+        resolve_if_all_wrong(room_id)
+
+    # ログイン中なら戦績集計のためにユーザーを紐づける（DB参照はスレッドで）
+    user_id = None
+    if token:
+        user_id = await asyncio.to_thread(user_id_from_token, token)
+        if user_id is not None:
+            room_player_users.setdefault(room_id, {})[player_id] = user_id
+    # レート制限は接続ではなくユーザー（ゲストは player_id）単位。繋ぎ直しても制限は解けない
+    client_key = ws_guard.client_key(player_id, user_id)
+
+    # 初期同期（取りこぼしが履歴に残っていれば差分だけ、無ければ全体スナップショット）
     try:
-        sync_payload = {
-            "status": room.status,
-            "currentRound": room.currentRound,
-            "seed": room.seed,
-            "scores": room_player_scores[room_id],
-            "names": room_player_names[room_id],
-            "winScore": room.winScore,
-            "conditionType": room.conditionType
-        }
-        await websocket.send_text(f"SERVER:SYNC:{json.dumps(sync_payload)}")
+        if resume is None or resume <= 0 or not await manager.catch_up(websocket, room_id, resume):
+            sync_payload = build_sync_payload(room_id)
+            await websocket.send_text(f"SERVER:SYNC:{json.dumps(sync_payload)}")
+            if resume is not None:
+                await manager.catch_up(websocket, room_id, sync_payload["seq"], release=True)
     except:
         return
 
     try:
-        if room.playerCount == 2 and room.status == "waiting" and room.currentRound == 0:
+        if room.playerCount >= room.capacity and room.status == "waiting" and room.currentRound == 0:
             room.status = "playing"
             room.currentRound = 1
             room.resolvedRound = 0
             room.seed = str(uuid.uuid4())
             room.gameSessionId = str(uuid.uuid4())
+            room_rounds[room_id].next_round()
+            record_match_start(room_id)
             await asyncio.sleep(0.3)
             await manager.broadcast("SERVER:MATCHED", room_id)
-            init_payload = json.dumps({"round": room.currentRound, "seed": room.seed})
+            init_payload = json.dumps(build_round_payload(room_id))
             await manager.broadcast(f"SERVER:NEXT_ROUND:{init_payload}", room_id)
 
         while True:
             data = await websocket.receive_text()
+
+            # サイズ・レート制限（超過分は黙って破棄し、悪質なら切断）
+            if ws_guard.check(room_id, client_key, data) is not None:
+                if ws_guard.should_disconnect(client_key):
+                    await websocket.close(code=1008)
+                    break
+                continue
+
             parts = data.split(":", 1)
             sender_id = parts[0]
             command = parts[1] if len(parts) > 1 else ""
@@ -609,9 +1150,12 @@ async def websocket_endpoint(
                     reported_round = int(command.replace("SCORE_UP:round", ""))
                     if reported_round == room.currentRound and reported_round > room.resolvedRound:
                         room.resolvedRound = reported_round
-                        room_player_scores[room_id][player_id] = room_player_scores[room_id].get(player_id, 0) + 1
+                        new_score = room_standings[room_id].increment(player_id)
+                        match_recorder.record(SCORE_UP, room.gameSessionId, reported_round, player_id)
                         await manager.broadcast(data, room_id)
-                        room_player_states[room_id][player_id] = "correct"
+                        room_rounds[room_id].mark(player_id, CORRECT)
+                        if room.conditionType == "score" and new_score >= room.winScore:
+                            record_match_end(room_id)
                         asyncio.create_task(proceed_to_next_round(room_id, reported_round, room.gameSessionId))
                 except:
                     pass
@@ -621,12 +1165,10 @@ async def websocket_endpoint(
                 try:
                     reported_round = int(command.replace("MISS:round", ""))
                     if reported_round == room.currentRound and reported_round > room.resolvedRound:
+                        match_recorder.record(MISS, room.gameSessionId, reported_round, player_id)
                         await manager.broadcast(data, room_id)
-                        room_player_states[room_id][player_id] = "wrong"
-                        states = room_player_states[room_id].values()
-                        if all(s == "wrong" for s in states):
-                            room.resolvedRound = reported_round
-                            asyncio.create_task(proceed_to_next_round(room_id, reported_round, room.gameSessionId))
+                        room_rounds[room_id].mark(player_id, WRONG)
+                        resolve_if_all_wrong(room_id)
                 except:
                     pass
                 continue
@@ -637,7 +1179,9 @@ async def websocket_endpoint(
                 room_retry_players[room_id].add(player_id)
                 await manager.broadcast(data, room_id)
 
-                if len(room_retry_players[room_id]) >= 2:
+                # 接続中の全員（最低2人）が再戦を希望したら開始
+                if len(room_retry_players[room_id]) >= max(2, room.playerCount):
+                    record_match_end(room_id, aborted=True)
                     room.status = "playing"
                     room.currentRound = 1
                     room.resolvedRound = 0
@@ -645,20 +1189,19 @@ async def websocket_endpoint(
                     room.gameSessionId = str(uuid.uuid4())
                     room_retry_players[room_id].clear()
 
-                    if room_id in room_player_scores:
-                        for pid in room_player_scores[room_id]:
-                            room_player_scores[room_id][pid] = 0
-                    if room_id in room_player_states:
-                        for pid in room_player_states[room_id]:
-                            room_player_states[room_id][pid] = "pending"
+                    room_standings[room_id].reset()
+                    room_rounds[room_id].next_round()
+                    record_match_start(room_id)
 
                     await asyncio.sleep(0.5)
                     await manager.broadcast("SERVER:MATCHED", room_id)
-                    init_payload = json.dumps({"round": room.currentRound, "seed": room.seed})
+                    init_payload = json.dumps(build_round_payload(room_id))
                     await manager.broadcast(f"SERVER:NEXT_ROUND:{init_payload}", room_id)
                 continue
 
-            await manager.broadcast(data, room_id)
+            # 許可リストにあるコマンドだけを中継する（送信者IDは偽装できないよう付け直す）
+            if ws_guard.is_relayable(command, client_key):
+                await manager.broadcast(f"{player_id}:{command}", room_id)
 
     except:
         pass
@@ -672,12 +1215,15 @@ async def websocket_endpoint(
         try:
             if player_id in player_websockets and player_websockets[player_id][0] == websocket:
                 player_websockets.pop(player_id, None)
+                ws_guard.release_player(client_key)
         except:
             pass
 
         try:
             if room_id in room_clients:
                 room_clients[room_id].discard(player_id)
+            if room_id in room_rounds:
+                room_rounds[room_id].remove_player(player_id)
 
             if room_id in active_rooms:
                 target_room = active_rooms[room_id]
@@ -686,29 +1232,43 @@ async def websocket_endpoint(
                 except:
                     pass
 
-                if target_room.playerCount == 1:
-                    target_room.status = "waiting"
-
-                if target_room.playerCount <= 0:
+                # 再起動による切断ではルームの状態を変えない（次のプロセスで再開する）
+                if drain_state.draining:
+                    pass
+                elif target_room.playerCount <= 0:
                     try:
                         task = asyncio.create_task(delayed_room_cleanup(room_id))
                         manager.cleanup_tasks[room_id] = task
                     except:
                         pass
                 else:
+                    # 試合中なら残ったプレイヤーで続ける（"waiting" に戻すと再開する手段が無く止まる）
                     try:
                         await manager.broadcast("SERVER:OPPONENT_LEFT", room_id)
                     except:
                         pass
+                    # 抜けた人だけが未回答だった場合は、ここでラウンドが決着する
+                    resolve_if_all_wrong(room_id)
         except:
             pass
 
 
-# 静的ファイルの配信設定
+# 静的ファイルの配信設定（起動時に圧縮版を生成し、index.html はメモリにキャッシュ）
 frontend_path = os.path.join(os.getcwd(), "../frontend/dist")
 if os.path.exists(frontend_path):
-    app.mount("/", StaticFiles(directory=frontend_path, html=True), name="frontend")
+    frontend_files = PrecompressedStaticFiles(directory=frontend_path, html=True)
+    app.mount("/", frontend_files, name="frontend")
 
     @app.exception_handler(404)
     async def not_found_exception_handler(request, exc):
-        return FileResponse(os.path.join(frontend_path, "index.html"))
+        # SPA のフォールバックはブラウザの画面遷移だけ。API の 404 は JSON のまま返す
+        # （クライアントは 404 でセッション切れなどを判定している）
+        path = request.url.path
+        if (
+            request.method in ("GET", "HEAD")
+            and not path.startswith(("/api/", "/ws/"))
+            and path not in ("/api", "/ws", "/token")
+            and "text/html" in request.headers.get("accept", "")
+        ):
+            return frontend_files.spa_index_response()
+        return await http_exception_handler(request, exc)
@@ -1,14 +1,153 @@
 # backend/app/manager.py
 import asyncio
+import json
+import os
+from collections import deque
+from itertools import islice
 from fastapi import WebSocket
 from starlette.websockets import WebSocketState
-from typing import List, Dict
+from typing import List, Dict, Optional, Set, Tuple
+
+# 観戦者1人あたりの送信待ちキューの上限（溢れたら古いものから捨てる）
+SPECTATOR_QUEUE_SIZE = int(os.getenv("SPECTATOR_QUEUE_SIZE", "64"))
+# 1ルームあたりの観戦者数の上限
+SPECTATOR_MAX_PER_ROOM = int(os.getenv("SPECTATOR_MAX_PER_ROOM", "500"))
+# 再接続時の差分再送に使う、ルームごとの直近ブロードキャストの保持件数
+ROOM_EVENT_LOG_SIZE = int(os.getenv("ROOM_EVENT_LOG_SIZE", "256"))
+# まとめ送りを希望したルームで、ブロードキャストを溜める時間窓（ミリ秒）
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "5"))
+
+
+class RoomEventLog:
+    """ルームのブロードキャストに連番を振り、直近の分だけをリングバッファに残す"""
+
+    def __init__(self, maxlen: int = ROOM_EVENT_LOG_SIZE):
+        self.seq = 0
+        self.events: deque = deque(maxlen=maxlen)
+
+    def append(self, message: str) -> int:
+        self.seq += 1
+        self.events.append((self.seq, message))
+        return self.seq
+
+    def since(self, last_seq: int) -> Optional[List[Tuple[int, str]]]:
+        """
+        last_seq より後のイベントを返す。
+        バッファから溢れている、またはルームが作り直されて連番が合わない場合は None
+        （呼び出し側は全体スナップショットで同期し直す）。
+        """
+        if last_seq > self.seq or last_seq < 0:
+            return None
+        if last_seq == self.seq:
+            return []
+        oldest = self.events[0][0] if self.events else self.seq + 1
+        if last_seq + 1 < oldest:
+            return None
+        return list(islice(self.events, last_seq + 1 - oldest, None))
+
+
+class SpectatorChannel:
+    """
+    観戦者1人分の送信キュー。
+    プレイヤーへの送信を待たせないよう、broadcast からは put するだけで
+    実際の送信は観戦者ごとのタスクが行う。
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SPECTATOR_QUEUE_SIZE)
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def offer(self, message: dict):
+        """送信キューに積む。満杯なら最も古いメッセージを捨てる"""
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(message)
+
+    async def run(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send(message)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # 送信失敗した観戦者は受信ループ側の切断処理で取り除かれる
+            pass
+
+
+class FrameBatcher:
+    """
+    まとめ送りを希望した接続1本分の送信待ち。
+    最初のメッセージから window 秒だけ待ち、その間に溜まった分を1フレームで送る。
+    1件だけならそのまま、複数なら BATCH:<JSON の文字列配列> にまとめる。
+    送信タスクは接続ごとに1つだけなので、届く順番は broadcast の順のまま。
+    """
+
+    def __init__(self, websocket: WebSocket, window: float, on_error):
+        self.websocket = websocket
+        self.window = window
+        self.on_error = on_error
+        self.pending: List[str] = []
+        self.task: Optional[asyncio.Task] = None
+        self.messages = 0
+        self.frames = 0
+
+    def add(self, message: str):
+        self.pending.append(message)
+        if self.task is None:
+            self.task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        try:
+            await asyncio.sleep(self.window)
+            # 送信中に増えた分は待たずに続けて送る
+            while self.pending:
+                messages, self.pending = self.pending, []
+                if len(messages) == 1:
+                    frame = messages[0]
+                else:
+                    frame = "BATCH:" + json.dumps(messages, ensure_ascii=False, separators=(",", ":"))
+                await self.websocket.send_text(frame)
+                self.messages += len(messages)
+                self.frames += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.pending = []
+            self.task = None
+            self.on_error(e)
+        finally:
+            self.task = None
+
+    def cancel(self):
+        self.pending = []
+        if self.task is not None:
+            self.task.cancel()
 
 
 class ConnectionManager:
     def __init__(self):
         # ルームごとのWebSocket接続リスト
         self.active_connections: Dict[str, List[WebSocket]] = {}
+        # ルームごとのブロードキャスト履歴（連番付き）
+        self.event_logs: Dict[str, RoomEventLog] = {}
+        # 連番付きフレーム (SEQ:<n>:<message>) を受け取る接続
+        self.sequenced: Set[WebSocket] = set()
+        # 差分再送中の接続（追いつくまで broadcast の直接送信対象から外す）
+        self.catching_up: Set[WebSocket] = set()
+        # 短い時間窓で送信をまとめる接続（ルームとクライアントの両方が希望したときだけ）
+        self.batchers: Dict[WebSocket, FrameBatcher] = {}
+        # 切断済みの接続のまとめ送り実績（現在の接続分は batchers から集計する）
+        self.batched_messages = 0
+        self.batched_frames = 0
+        # ルームごとの観戦者（プレイヤーとは別管理。playerCount に含めない）
+        self.spectators: Dict[str, Dict[WebSocket, SpectatorChannel]] = {}
         # ルーム削除の遅延クリーンアップタスク管理
         self.cleanup_tasks: Dict[str, asyncio.Task] = {}
 
@@ -26,8 +165,12 @@ class ConnectionManager:
         except Exception:
             return False
 
-    async def connect(self, websocket: WebSocket, room_id: str):
-        """WebSocket接続を管理リストに追加し、必要に応じてクリーンアップタスクを中断する"""
+    async def connect(self, websocket: WebSocket, room_id: str, sequenced: bool = False, batch_window: float = 0):
+        """
+        WebSocket接続を管理リストに追加し、必要に応じてクリーンアップタスクを中断する。
+        sequenced の接続は catch_up() が終わるまでブロードキャストを保留する。
+        batch_window > 0 の接続には、その秒数の間に重なったブロードキャストをまとめて送る。
+        """
         if room_id in self.cleanup_tasks:
             task = self.cleanup_tasks[room_id]
             task.cancel()
@@ -49,13 +192,74 @@ class ConnectionManager:
         if websocket not in self.active_connections[room_id]:
             self.active_connections[room_id].append(websocket)
 
+        if sequenced:
+            self.sequenced.add(websocket)
+            self.catching_up.add(websocket)
+
+        if batch_window > 0 and websocket not in self.batchers:
+            self.batchers[websocket] = FrameBatcher(
+                websocket, batch_window, lambda e: self._batch_failed(websocket, room_id, e)
+            )
+
         return True
 
+    def _batch_failed(self, websocket: WebSocket, room_id: str, error: Exception):
+        if "close message has been sent" not in str(error):
+            print(f"Batched delivery failed for a client in room:{room_id}. Error: {error}")
+        self.disconnect(websocket, room_id)
+
+    def batch_stats(self) -> dict:
+        messages = self.batched_messages + sum(b.messages for b in self.batchers.values())
+        frames = self.batched_frames + sum(b.frames for b in self.batchers.values())
+        return {
+            "connections": len(self.batchers),
+            "messages": messages,
+            "frames": frames,
+            "messagesPerFrame": round(messages / frames, 2) if frames else None,
+        }
+
+    def event_log(self, room_id: str) -> RoomEventLog:
+        log = self.event_logs.get(room_id)
+        if log is None:
+            log = self.event_logs[room_id] = RoomEventLog()
+        return log
+
+    async def catch_up(self, websocket: WebSocket, room_id: str, last_seq: int, release: bool = False) -> bool:
+        """
+        last_seq 以降のイベントを順番に再送し、追いついたらライブ配信に切り替える。
+        再送中に増えた分もリングバッファに入っているので、空になるまで繰り返す。
+        差分がバッファに残っていなければ False（release=True なら保留だけ解除する）。
+        """
+        log = self.event_log(room_id)
+        while True:
+            missing = log.since(last_seq)
+            if missing is None:
+                if release:
+                    self.catching_up.discard(websocket)
+                return False
+            if not missing:
+                # ここから先は await しないので、次の broadcast からは直接届く
+                self.catching_up.discard(websocket)
+                return True
+            for seq, message in missing:
+                await websocket.send_text(f"SEQ:{seq}:{message}")
+                last_seq = seq
+
     def disconnect(self, websocket: WebSocket, room_id: str):
         """WebSocket接続を管理リストから除外する（同一 ws が複数回入っていても全て消す）"""
+        # ルームが先に片付けられていても、まとめ送りのタスクは必ず止める
+        batcher = self.batchers.pop(websocket, None)
+        if batcher is not None:
+            batcher.cancel()
+            self.batched_messages += batcher.messages
+            self.batched_frames += batcher.frames
+
         if room_id not in self.active_connections:
             return
 
+        self.sequenced.discard(websocket)
+        self.catching_up.discard(websocket)
+
         conns = self.active_connections[room_id]
         while websocket in conns:
             try:
@@ -63,12 +267,63 @@ class ConnectionManager:
             except ValueError:
                 break
 
+    def connect_spectator(self, websocket: WebSocket, room_id: str) -> Optional[SpectatorChannel]:
+        """観戦者を登録して送信タスクを開始する。上限に達していれば None"""
+        room_spectators = self.spectators.setdefault(room_id, {})
+        if len(room_spectators) >= SPECTATOR_MAX_PER_ROOM:
+            return None
+        channel = SpectatorChannel(websocket)
+        channel.task = asyncio.create_task(channel.run())
+        room_spectators[websocket] = channel
+        return channel
+
+    def disconnect_spectator(self, websocket: WebSocket, room_id: str):
+        room_spectators = self.spectators.get(room_id)
+        if not room_spectators:
+            return
+        channel = room_spectators.pop(websocket, None)
+        if channel and channel.task:
+            channel.task.cancel()
+        if not room_spectators:
+            self.spectators.pop(room_id, None)
+
+    def spectator_count(self, room_id: str) -> int:
+        return len(self.spectators.get(room_id, {}))
+
+    async def close_spectators(self, room_id: str, code: int = 4000):
+        """ルーム削除時に観戦者をまとめて切断する"""
+        for ws in list(self.spectators.get(room_id, {})):
+            self.disconnect_spectator(ws, room_id)
+            try:
+                await ws.close(code=code)
+            except Exception:
+                pass
+
+    def _fanout_spectators(self, message: str, room_id: str):
+        """
+        観戦者への配信。ASGI メッセージは1回だけ組み立てて全員で共有し、
+        キューに積むだけなので await しない（プレイヤーの進行を遅らせない）。
+        """
+        room_spectators = self.spectators.get(room_id)
+        if not room_spectators:
+            return
+        frame = {"type": "websocket.send", "text": message}
+        for channel in room_spectators.values():
+            channel.offer(frame)
+
     async def broadcast(self, message: str, room_id: str):
         """
         指定したルームの全クライアントにメッセージを送信する。
         送信に失敗した/死んでいる接続は即座にリストから削除する。
+        観戦者にはプレイヤーへの送信後、低優先度のキュー経由で配信する。
+        まとめ送りの接続には FrameBatcher に積むだけで、送信は時間窓の後に行う。
+        すべてのメッセージに連番を振って履歴に残し、再接続時の差分再送に使う。
         """
+        seq = self.event_log(room_id).append(message)
+        sequenced_message = f"SEQ:{seq}:{message}"
+
         if room_id not in self.active_connections:
+            self._fanout_spectators(message, room_id)
             return
 
         targets = self.active_connections[room_id][:]
@@ -79,8 +334,17 @@ class ConnectionManager:
                 self.disconnect(ws, room_id)
                 continue
 
+            # 差分再送中の接続には catch_up() 側で履歴から届ける
+            if ws in self.catching_up:
+                continue
+
+            batcher = self.batchers.get(ws)
+            if batcher is not None:
+                batcher.add(sequenced_message if ws in self.sequenced else message)
+                continue
+
             try:
-                await ws.send_text(message)
+                await ws.send_text(sequenced_message if ws in self.sequenced else message)
             except Exception as e:
                 # close 済み送信は想定内なので、確実に除去
                 msg = str(e)
@@ -88,5 +352,7 @@ class ConnectionManager:
                     print(f"Broadcast delivery failed for a client in room:{room_id}. Error: {e}")
                 self.disconnect(ws, room_id)
 
+        self._fanout_spectators(message, room_id)
+
 
 manager = ConnectionManager()
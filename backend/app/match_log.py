@@ -0,0 +1,296 @@
+# backend/app/match_log.py
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MATCH_LOG_ENABLED = os.getenv("MATCH_LOG_ENABLED", "1") == "1"
+MATCH_LOG_DIR = os.getenv("MATCH_LOG_DIR", "./match_logs")
+# セグメントファイルの最大サイズ（超えたら次のファイルへ）
+MATCH_LOG_SEGMENT_BYTES = int(os.getenv("MATCH_LOG_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+# fsync の間隔（秒）。この間に溜まったレコードはまとめて書き込まれる
+MATCH_LOG_FSYNC_INTERVAL = float(os.getenv("MATCH_LOG_FSYNC_INTERVAL", "1.0"))
+# 書き込み待ちの上限（溢れた分は捨てて数える。ディスクが詰まってもメモリを食い潰さない）
+MATCH_LOG_QUEUE_SIZE = int(os.getenv("MATCH_LOG_QUEUE_SIZE", "100000"))
+# 書き込みに失敗したとき、ファイルを開き直すまでの待ち時間（秒）
+MATCH_LOG_RETRY_SECONDS = float(os.getenv("MATCH_LOG_RETRY_SECONDS", "1.0"))
+
+# レコード種別
+MATCH_START = 1
+ROUND_START = 2
+SCORE_UP = 3
+MISS = 4
+RESULT = 5
+ABORT = 6
+# 試合に参加したログインユーザーの ID（リプレイの閲覧権限に使う）
+USERS = 7
+RECORD_NAMES = {
+    MATCH_START: "MATCH_START",
+    ROUND_START: "ROUND_START",
+    SCORE_UP: "SCORE_UP",
+    MISS: "MISS",
+    RESULT: "RESULT",
+    ABORT: "ABORT",
+    USERS: "USERS",
+}
+
+# レコード: [本体長 u32][種別 u8][試合ID 16byte][時刻ms u64][ラウンド u16][文字列...]
+# 文字列はそれぞれ [長さ u8][UTF-8] で並べる
+HEADER = struct.Struct("<IB16sQH")
+# 試合インデックス: [試合ID 16byte][セグメント番号 u32][オフセット u64]
+INDEX_ENTRY = struct.Struct("<16sIQ")
+INDEX_FILE = "matches.idx"
+
+
+def _pack_strings(fields: List[str]) -> bytes:
+    out = bytearray()
+    for field in fields:
+        data = field.encode("utf-8")[:255]
+        out.append(len(data))
+        out += data
+    return bytes(out)
+
+
+def _unpack_strings(data: bytes) -> List[str]:
+    fields = []
+    i = 0
+    while i < len(data):
+        size = data[i]
+        fields.append(data[i + 1:i + 1 + size].decode("utf-8", errors="replace"))
+        i += 1 + size
+    return fields
+
+
+def _segment_name(number: int) -> str:
+    return f"segment-{number:06d}.bin"
+
+
+class MatchRecorder:
+    """
+    対戦の経過を追記専用のバイナリログに記録する。
+    ゲーム進行側は record() でキューに積むだけで、書き込みと fsync は
+    バックグラウンドスレッドがまとめて行う。
+    書き込みに失敗してもスレッドは止まらず、失敗したバッチを捨てて数え、ファイルを開き直して続ける。
+    """
+
+    def __init__(self, directory: str = MATCH_LOG_DIR, enabled: bool = MATCH_LOG_ENABLED):
+        self.directory = directory
+        self.enabled = enabled
+        self.open_matches: Set[str] = set()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=MATCH_LOG_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.errors = 0
+
+    # --- 記録（イベントループ側から呼ばれる） ---
+
+    def record(self, kind: int, match_id: str, round_no: int = 0, *fields: str):
+        if not self.enabled:
+            return
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((kind, match_id, int(time.time() * 1000), round_no, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def start_match(self, match_id: str, room_id: str, memory_set_id: str, players: List[str],
+                    user_ids: Iterable[int] = ()):
+        self.open_matches.add(match_id)
+        self.record(MATCH_START, match_id, 0, room_id, memory_set_id, *players)
+        self.record(USERS, match_id, 0, *(str(u) for u in sorted(set(user_ids))))
+
+    def finish_match(self, match_id: str, standings: List[List], aborted: bool = False) -> bool:
+        """結果を記録する。既に終わっている試合なら何もせず False を返す"""
+        if match_id not in self.open_matches:
+            return False
+        self.open_matches.discard(match_id)
+        fields = [f"{pid}={score}" for pid, score in standings]
+        self.record(ABORT if aborted else RESULT, match_id, 0, *fields)
+        return True
+
+    # --- 書き込みスレッド ---
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or not self.enabled:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="match-recorder", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """残りを書き出してスレッドを止める（シャットダウン時）"""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=5)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "openMatches": len(self.open_matches),
+        }
+
+    def _latest_segment(self) -> int:
+        numbers = [
+            int(name[8:14]) for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".bin")
+        ]
+        return max(numbers) if numbers else 1
+
+    def _run(self):
+        while True:
+            try:
+                if self._write_until_stopped():
+                    return
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Match recorder write failed, reopening the log in {MATCH_LOG_RETRY_SECONDS}s: {e}")
+                time.sleep(MATCH_LOG_RETRY_SECONDS)
+
+    def _write_until_stopped(self) -> bool:
+        """stop() されるまで書き続けて True を返す。書き込みに失敗したら、そのバッチを捨てて例外を投げる"""
+        segment = self._latest_segment()
+        out = open(os.path.join(self.directory, _segment_name(segment)), "ab")
+        index = open(os.path.join(self.directory, INDEX_FILE), "ab")
+        last_sync = time.monotonic()
+        stopping = False
+
+        try:
+            while not stopping:
+                try:
+                    item = self._queue.get(timeout=MATCH_LOG_FSYNC_INTERVAL)
+                except queue.Empty:
+                    item = False
+
+                # 溜まっている分をまとめて処理する
+                batch = []
+                while item is not False:
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        item = False
+
+                try:
+                    for kind, match_id, ts, round_no, fields in batch:
+                        if out.tell() >= MATCH_LOG_SEGMENT_BYTES:
+                            out.flush()
+                            os.fsync(out.fileno())
+                            out.close()
+                            segment += 1
+                            out = open(os.path.join(self.directory, _segment_name(segment)), "ab")
+
+                        try:
+                            mid = uuid.UUID(match_id).bytes
+                        except ValueError:
+                            # 壊れたレコードだけを捨てる（ファイルは問題ないので開き直さない）
+                            self.dropped += 1
+                            continue
+                        body = _pack_strings(list(fields))
+                        if kind == MATCH_START:
+                            index.write(INDEX_ENTRY.pack(mid, segment, out.tell()))
+                        out.write(HEADER.pack(HEADER.size - 4 + len(body), kind, mid, ts, round_no))
+                        out.write(body)
+
+                    if stopping or time.monotonic() - last_sync >= MATCH_LOG_FSYNC_INTERVAL:
+                        for f in (out, index):
+                            f.flush()
+                            os.fsync(f.fileno())
+                        last_sync = time.monotonic()
+                except Exception:
+                    self.dropped += len(batch)
+                    if stopping:
+                        # 止める途中なら開き直さずに終える
+                        print(f"⚠️ Match recorder dropped {len(batch)} records while stopping")
+                        return True
+                    raise
+            return True
+        finally:
+            out.close()
+            index.close()
+
+    # --- 再生 ---
+
+    def _find_start(self, mid: bytes) -> Optional[tuple]:
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            # 新しい試合ほど後ろにあるので末尾から探す
+            usable = len(m) - len(m) % INDEX_ENTRY.size
+            for offset in range(usable - INDEX_ENTRY.size, -1, -INDEX_ENTRY.size):
+                entry_id, segment, position = INDEX_ENTRY.unpack_from(m, offset)
+                if entry_id == mid:
+                    return segment, position
+        return None
+
+    def exists(self, match_id: str) -> bool:
+        return self._find_start(uuid.UUID(match_id).bytes) is not None
+
+    def participants(self, match_id: str) -> Set[int]:
+        """試合に参加したログインユーザーの ID（USERS レコードが無い古い試合は空）"""
+        for event in self.replay(match_id):
+            if event["type"] == "USERS":
+                return {int(u) for u in event["fields"] if u.isdigit()}
+            if event["type"] != "MATCH_START":
+                break
+        return set()
+
+    def replay(self, match_id: str) -> Iterator[Dict]:
+        """
+        1試合分のレコードを順に返す。セグメントは mmap してヘッダを辿るだけなので
+        ファイル全体を読み込まない。試合が途中でセグメントを跨いでいても続きを読む。
+        """
+        mid = uuid.UUID(match_id).bytes
+        start = self._find_start(mid)
+        if start is None:
+            return
+        segment, position = start
+
+        while True:
+            path = os.path.join(self.directory, _segment_name(segment))
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                return
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                while position + HEADER.size <= len(m):
+                    length, kind, record_id, ts, round_no = HEADER.unpack_from(m, position)
+                    end = position + 4 + length
+                    if end > len(m):
+                        return  # 書き込み途中のレコード
+                    if record_id == mid:
+                        yield {
+                            "type": RECORD_NAMES.get(kind, str(kind)),
+                            "ts": ts,
+                            "round": round_no,
+                            "fields": _unpack_strings(m[position + HEADER.size:end]),
+                        }
+                        if kind in (RESULT, ABORT):
+                            return
+                    position = end
+            segment += 1
+            position = 0
+
+
+match_recorder = MatchRecorder()
@@ -0,0 +1,221 @@
+# backend/app/migrations.py
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from . import models
+
+# 複数のプロセスが同時にマイグレーションしないための Postgres のアドバイザリロック番号
+MIGRATION_LOCK_ID = 804231
+BACKFILL_BATCH_SIZE = 1000
+
+
+class MigrationContext:
+    """
+    マイグレーションの各ステップから使う操作。
+    どれも「もう適用済みなら何もしない」ように書いてあるので、
+    途中で失敗しても同じバージョンを最初からやり直せる。
+    """
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.is_postgres = engine.dialect.name == "postgresql"
+
+    def _columns(self, table: str) -> set:
+        return {c["name"] for c in inspect(self.engine).get_columns(table)}
+
+    def _tables(self) -> set:
+        return set(inspect(self.engine).get_table_names())
+
+    def execute(self, sql: str, **params):
+        with self.engine.begin() as conn:
+            conn.execute(text(sql), params)
+
+    def create_missing_tables(self):
+        """モデルにあって DB に無いテーブルを作る（既存テーブルには触れない）"""
+        existing = self._tables()
+        missing = [t for t in models.Base.metadata.sorted_tables if t.name not in existing]
+        if missing:
+            print(f"  create tables: {', '.join(t.name for t in missing)}")
+            models.Base.metadata.create_all(bind=self.engine, tables=missing)
+
+    def add_column(self, table: str, column: str, ddl: str):
+        """ADD COLUMN。SQLite には IF NOT EXISTS が無いので、先に有無を調べる"""
+        if table not in self._tables() or column in self._columns(table):
+            return
+        print(f"  add column: {table}.{column}")
+        if not self.is_postgres and "DEFAULT CURRENT_TIMESTAMP" in ddl:
+            # SQLite は関数の既定値を持つ列を後から足せないので、既定値なしで足して埋める
+            self.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl.replace('DEFAULT CURRENT_TIMESTAMP', '')}")
+            self.backfill(table, f"{column} = CURRENT_TIMESTAMP", f"{column} IS NULL")
+            return
+        self.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+    def create_index(self, name: str, table: str, columns: List[str], unique: bool = False):
+        """
+        Postgres では CREATE INDEX CONCURRENTLY で作る（書き込みを止めない）。
+        CONCURRENTLY はトランザクション内で実行できないので autocommit の接続を使う。
+        途中で失敗すると無効なインデックスが残るため、それは作り直す。
+        SQLite はもともと書き込みが1本なので普通に作る。
+        """
+        cols = ", ".join(columns)
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        if not self.is_postgres:
+            self.execute(f"CREATE {kind} IF NOT EXISTS {name} ON {table} ({cols})")
+            return
+
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            valid = conn.execute(text(
+                "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid WHERE c.relname = :name"
+            ), {"name": name}).scalar()
+            if valid is True:
+                return
+            if valid is False:
+                print(f"  drop invalid index: {name}")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            print(f"  create index concurrently: {name}")
+            conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {name} ON {table} ({cols})"))
+
+    def backfill(self, table: str, assignments: str, where: str, batch_size: int = BACKFILL_BATCH_SIZE, **params) -> int:
+        """
+        UPDATE を batch_size 行ずつに分けて実行し、1回ごとに commit する。
+        where は更新後に成り立たなくなる条件にすること（終わった行を二度更新しない）。
+        """
+        total = 0
+        while True:
+            with self.engine.begin() as conn:
+                result = conn.execute(text(
+                    f"UPDATE {table} SET {assignments} WHERE id IN "
+                    f"(SELECT id FROM {table} WHERE {where} LIMIT :batch_size)"
+                ), {**params, "batch_size": batch_size})
+            if result.rowcount <= 0:
+                break
+            total += result.rowcount
+        if total:
+            print(f"  backfilled {total} rows in {table}")
+        return total
+
+
+class Migration:
+    def __init__(self, version: int, description: str, apply: Callable[[MigrationContext], None]):
+        self.version = version
+        self.description = description
+        self.apply = apply
+
+
+# --- マイグレーション本体（version は追加するたびに 1 ずつ増やし、既存のものは書き換えない） ---
+
+def _baseline(ctx: MigrationContext):
+    """旧 fix_db.py の内容。以前の DB に後から増えた列を足す"""
+    ctx.create_missing_tables()
+    for column, ddl in [
+        ("is_official", "BOOLEAN DEFAULT FALSE"),
+        ("is_public", "BOOLEAN DEFAULT FALSE"),
+        ("memorize_time", "INTEGER DEFAULT 3"),
+        ("answer_time", "INTEGER DEFAULT 10"),
+        ("questions_per_round", "INTEGER DEFAULT 1"),
+        ("win_score", "INTEGER DEFAULT 10"),
+        ("condition_type", "VARCHAR DEFAULT 'score'"),
+        ("order_type", "VARCHAR DEFAULT 'random'"),
+    ]:
+        ctx.add_column("memory_sets", column, ddl)
+    for column, ddl in [
+        ("name", "VARCHAR"),
+        ("time", "FLOAT"),
+        ("set_id", "VARCHAR"),
+        ("win_score", "INTEGER"),
+        ("condition_type", "VARCHAR"),
+        ("accuracy", "FLOAT DEFAULT 0.0"),
+        ("avg_speed", "FLOAT DEFAULT 0.0"),
+        ("created_at", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+        ("user_id", "INTEGER REFERENCES users(id)"),
+    ]:
+        ctx.add_column("rankings", column, ddl)
+    ctx.create_index("ix_rankings_user_id", "rankings", ["user_id"])
+    ctx.create_index("ix_user_word_stats_user_id", "user_word_stats", ["user_id"])
+    ctx.create_index("ix_user_word_stats_word_text", "user_word_stats", ["word_text"])
+    # 列を足す前からある行の NULL を既定値にそろえる（出題順の判定で NULL を扱わずに済むように）
+    ctx.backfill("memory_sets", "order_type = 'random'", "order_type IS NULL")
+
+
+def _ranking_and_word_stat_indexes(ctx: MigrationContext):
+    ctx.create_index("ix_rankings_board", "rankings", ["set_id", "win_score", "condition_type"])
+    ctx.create_index("ix_rankings_created_at", "rankings", ["created_at"])
+    ctx.create_index("ix_user_word_stats_user_word", "user_word_stats", ["user_id", "word_text"])
+
+
+def _replica_heartbeats(ctx: MigrationContext):
+    ctx.create_missing_tables()
+
+
+def _compacted_ranking_tallies(ctx: MigrationContext):
+    ctx.create_missing_tables()
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline (fix_db.py)", _baseline),
+    Migration(2, "indexes for ranking boards, compaction and word stats", _ranking_and_word_stat_indexes),
+    Migration(3, "replica heartbeat table", _replica_heartbeats),
+    Migration(4, "tallies of compacted rankings for stats rebuilds", _compacted_ranking_tallies),
+]
+
+
+# --- 実行 ---
+
+def _ensure_version_table(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, description VARCHAR, applied_at TIMESTAMP)"
+        ))
+
+
+def applied_versions(engine: Engine) -> set:
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    done = applied_versions(engine)
+    return [m for m in MIGRATIONS if m.version not in done]
+
+
+def stamp_all(engine: Engine):
+    """全テーブルを作ったばかりの DB を「全マイグレーション適用済み」として記録する"""
+    done = applied_versions(engine)
+    with engine.begin() as conn:
+        for migration in MIGRATIONS:
+            if migration.version not in done:
+                conn.execute(text(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"
+                ), {"v": migration.version, "d": migration.description, "t": datetime.utcnow()})
+
+
+def run_migrations(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """未適用のマイグレーションを順に適用し、適用したバージョンを返す"""
+    lock_conn: Optional[Connection] = None
+    if engine.dialect.name == "postgresql":
+        lock_conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+    try:
+        ctx = MigrationContext(engine)
+        applied = []
+        # ロックを取ってから読み直す（待っている間に別プロセスが適用しているかもしれない）
+        for migration in pending_migrations(engine):
+            if target is not None and migration.version > target:
+                break
+            print(f"Applying migration {migration.version}: {migration.description}")
+            migration.apply(ctx)
+            ctx.execute(
+                "INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)",
+                v=migration.version, d=migration.description, t=datetime.utcnow()
+            )
+            applied.append(migration.version)
+        return applied
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+            lock_conn.close()
@@ -1,5 +1,5 @@
 # backend/app/models.py
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, Float, Boolean, DateTime, func
+from sqlalchemy import Column, Integer, String, ForeignKey, Text, Float, Boolean, Date, DateTime, Index, UniqueConstraint, func
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -44,6 +44,10 @@ class MemorySet(Base):
 # 単語ごとの正誤回数を記録するテーブル
 class UserWordStat(Base):
     __tablename__ = "user_word_stats"
+    __table_args__ = (
+        # 単語の正誤を記録するたびの (ユーザー, 単語) 検索用
+        Index("ix_user_word_stats_user_word", "user_id", "word_text"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
@@ -57,6 +61,11 @@ class UserWordStat(Base):
 # ランキングテーブル
 class Ranking(Base):
     __tablename__ = "rankings"
+    __table_args__ = (
+        # ボード単位の読み出し（自己ベストの作成など）とコンパクションの期限判定用
+        Index("ix_rankings_board", "set_id", "win_score", "condition_type"),
+        Index("ix_rankings_created_at", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
@@ -68,6 +77,123 @@ class Ranking(Base):
     time = Column(Float)            # 総クリアタイム
     accuracy = Column(Float)        # 暗記正答率 (%)
     avg_speed = Column(Float)       # 1問あたりの平均回答速度 (秒)
+
+    # ログイン中に登録された記録のみ (戦績の集計用)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     
     # 同点判定用 (新しい記録を優先)
-    created_at = Column(DateTime, default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime, default=func.now())
+
+# 間隔反復 (SM-2) の出題スケジュール。ユーザー×セット×単語ごとに次回出題日時を持つ
+class WordSchedule(Base):
+    __tablename__ = "word_schedules"
+    __table_args__ = (
+        UniqueConstraint("user_id", "set_id", "word_text", name="uq_word_schedules_word"),
+        # 「期限が来た単語を古い順に N 件」を1回の範囲スキャンで取るためのインデックス
+        Index("ix_word_schedules_due", "user_id", "set_id", "due_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    set_id = Column(String, nullable=False)
+    word_text = Column(String, nullable=False)
+    ease = Column(Float, default=2.5)          # 易しさ係数
+    interval_days = Column(Float, default=0.0) # 現在の出題間隔 (日)
+    repetitions = Column(Integer, default=0)   # 連続正解回数
+    due_at = Column(DateTime, nullable=False)  # 次回出題日時 (UTC)
+
+# ランキングの自己ベスト (ボード = セット×目標値×終了条件 ごとに1人1行)
+class RankingBest(Base):
+    __tablename__ = "ranking_bests"
+    __table_args__ = (
+        UniqueConstraint("set_id", "win_score", "condition_type", "name", name="uq_ranking_bests_player"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    ranking_id = Column(Integer, ForeignKey("rankings.id"), index=True)  # ベスト記録の元になった行
+    name = Column(String, nullable=False)
+    set_id = Column(String, nullable=False)
+    win_score = Column(Integer, nullable=False)
+    condition_type = Column(String, nullable=False)
+    time = Column(Float)
+    accuracy = Column(Float)
+    avg_speed = Column(Float)
+    created_at = Column(DateTime)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+
+# ランキング表示順そのままのインデックス (ボード内の上位取得が索引順の読み出しだけで済む)
+Index(
+    "ix_ranking_bests_board_order",
+    RankingBest.set_id, RankingBest.win_score, RankingBest.condition_type,
+    RankingBest.accuracy.desc(), RankingBest.avg_speed, RankingBest.created_at.desc()
+)
+
+# 戦績画面用の集計 (ユーザーごとに1行)。ランキング登録・単語の正誤・対戦結果のたびに差分更新する
+class UserStatsRollup(Base):
+    __tablename__ = "user_stats_rollups"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    # ソロプレイ (ランキング登録)
+    games_played = Column(Integer, default=0)
+    best_accuracy = Column(Float, nullable=True)
+    best_avg_speed = Column(Float, nullable=True)
+    best_time = Column(Float, nullable=True)
+    # 単語の正誤
+    total_correct = Column(Integer, default=0)
+    total_miss = Column(Integer, default=0)
+    weak_words_json = Column(Text, default="[]")  # [[単語, ミス回数], ...] ミスの多い順
+    # 対戦
+    battles_played = Column(Integer, default=0)
+    battles_won = Column(Integer, default=0)
+    current_win_streak = Column(Integer, default=0)
+    best_win_streak = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+# 戦績の日別集計 (成長グラフ用)
+class UserDailyStat(Base):
+    __tablename__ = "user_daily_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    correct = Column(Integer, default=0)
+    miss = Column(Integer, default=0)
+    games = Column(Integer, default=0)
+    best_accuracy = Column(Float, nullable=True)
+    battles = Column(Integer, default=0)
+    wins = Column(Integer, default=0)
+
+# コンパクションで削除したランキング行の、ユーザー・日ごとの集計。
+# 削除後も戦績の再集計 (player_stats.rebuild_all) で生データの代わりに使う
+class CompactedRankingTally(Base):
+    __tablename__ = "compacted_ranking_tallies"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    games = Column(Integer, default=0)
+    best_accuracy = Column(Float, nullable=True)
+    best_avg_speed = Column(Float, nullable=True)
+    best_time = Column(Float, nullable=True)
+
+# 公開セット検索用の正規化済みテキスト（公開・公式セットのみ登録する）
+class SetSearchDoc(Base):
+    __tablename__ = "set_search_docs"
+
+    set_id = Column(Integer, ForeignKey("memory_sets.id"), primary_key=True)
+    title = Column(Text)
+    body = Column(Text)
+
+# セットごとの「紛らわしい選択肢」の索引（単語ごとの近傍 K 件）
+class SetDistractorIndex(Base):
+    __tablename__ = "set_distractor_indexes"
+
+    set_id = Column(Integer, ForeignKey("memory_sets.id"), primary_key=True)
+    words_hash = Column(String)        # 作成元の words_json のハッシュ（更新検知用）
+    neighbours_json = Column(Text)     # [[近傍の単語の位置, ...], ...]（words_json と同じ並び）
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+# レプリカの遅延測定用（プライマリが定期的に時刻を書き、レプリカ側で読む。1行だけ）
+class ReplicaHeartbeat(Base):
+    __tablename__ = "replica_heartbeats"
+
+    id = Column(Integer, primary_key=True)
+    at = Column(Float, nullable=False)  # プライマリで書いた時刻 (UNIX 秒)
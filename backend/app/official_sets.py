@@ -0,0 +1,91 @@
+# backend/app/official_sets.py
+import json
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .set_search import index_set
+from .write_queue import write_queue
+
+# --- 公式データの定義 ---
+DEFAULT_MEMORY_SETS = {
+    "default": [
+        {"text": "apple", "kana": "アップル"},
+        {"text": "banana", "kana": "バナナ"},
+        {"text": "cherry", "kana": "チェリー"},
+        {"text": "grape", "kana": "ブドウ"},
+        {"text": "orange", "kana": "オレンジ"},
+        {"text": "peach", "kana": "モモ"},
+        {"text": "watermelon", "kana": "スイカ"},
+        {"text": "kiwifruit", "kana": "キウイ"},
+        {"text": "lemon", "kana": "レモン"},
+        {"text": "strawberry", "kana": "イチゴ"},
+        {"text": "mango", "kana": "マンゴー"},
+    ],
+    "programming": [
+        {"text": "Python", "kana": "パイソン"},
+        {"text": "React", "kana": "リアクト"},
+        {"text": "Docker", "kana": "ドッカー"},
+        {"text": "Algorithm", "kana": "アルゴリズム"},
+        {"text": "Database", "kana": "データベース"},
+        {"text": "Frontend", "kana": "フロントエンド"},
+    ],
+    "animals": [
+        {"text": "Lion", "kana": "ライオン"},
+        {"text": "Elephant", "kana": "ゾウ"},
+        {"text": "Giraffe", "kana": "キリン"},
+        {"text": "Penguin", "kana": "ペンギン"},
+        {"text": "Dolphin", "kana": "イルカ"},
+    ],
+    "english_hard": [
+        {"text": "procrastinate", "kana": "先延ばしにする"},
+        {"text": "ambiguous", "kana": "曖昧な"},
+        {"text": "resilient", "kana": "回復力のある"},
+    ],
+}
+
+OFFICIAL_TITLE_MAP = {
+    "default": "基本セット (フルーツ)",
+    "programming": "プログラミング用語",
+    "animals": "動物の名前",
+    "english_hard": "超難問英単語"
+}
+
+
+def seed_official_sets(db: Session) -> int:
+    """足りない公式セットを作って数を返す（何度実行しても同じ結果になる）"""
+    titles = {set_key: OFFICIAL_TITLE_MAP.get(set_key, set_key) for set_key in DEFAULT_MEMORY_SETS}
+
+    def existing_titles(db: Session) -> set:
+        # 既にある公式セットを1クエリでまとめて確認する
+        return {
+            row[0] for row in db.query(models.MemorySet.title).filter(
+                models.MemorySet.is_official == True,
+                models.MemorySet.title.in_(list(titles.values()))
+            ).all()
+        }
+
+    # 通常は全部揃っているので、書き込みキューに並ばずに終わる
+    if len(existing_titles(db)) == len(set(titles.values())):
+        return 0
+
+    def write(db: Session) -> int:
+        existing = existing_titles(db)
+        created = 0
+        for set_key, words in DEFAULT_MEMORY_SETS.items():
+            title = titles[set_key]
+            if title not in existing:
+                new_set = models.MemorySet(
+                    title=title,
+                    words_json=json.dumps(words, ensure_ascii=False),
+                    is_official=True,
+                    owner_id=None
+                )
+                db.add(new_set)
+                db.flush()
+                index_set(db, new_set)
+                existing.add(title)
+                created += 1
+        return created
+
+    return write_queue.run(db, write)
@@ -0,0 +1,268 @@
+# backend/app/player_stats.py
+import json
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+from .write_queue import write_queue
+
+# 戦績画面に出す苦手単語の件数
+WEAK_WORDS_LIMIT = 10
+# 再集計で一度に読み込む行数
+REBUILD_BATCH_SIZE = 500
+
+
+def _insert_if_missing(db: Session, model, values: dict):
+    """
+    主キーが重なる行が無ければ挿入する（INSERT ... ON CONFLICT DO NOTHING）。
+    同じユーザー・同じ日の最初の書き込みが同時に来ても、片方が一意制約で落ちて更新を失うことが無い。
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite_insert if dialect == "sqlite" else postgresql_insert
+        db.execute(insert(model).values(**values).on_conflict_do_nothing())
+        return
+    try:
+        with db.begin_nested():
+            db.execute(model.__table__.insert().values(**values))
+    except IntegrityError:
+        pass
+
+
+def _rollup(db: Session, user_id: int) -> models.UserStatsRollup:
+    rollup = db.get(models.UserStatsRollup, user_id)
+    if rollup is None:
+        _insert_if_missing(db, models.UserStatsRollup, dict(
+            user_id=user_id, games_played=0, total_correct=0, total_miss=0,
+            weak_words_json="[]", battles_played=0, battles_won=0,
+            current_win_streak=0, best_win_streak=0
+        ))
+        rollup = db.get(models.UserStatsRollup, user_id)
+    return rollup
+
+
+def _daily(db: Session, user_id: int, day: Optional[date] = None) -> models.UserDailyStat:
+    day = day or datetime.utcnow().date()
+    daily = db.get(models.UserDailyStat, (user_id, day))
+    if daily is None:
+        _insert_if_missing(db, models.UserDailyStat, dict(
+            user_id=user_id, day=day, correct=0, miss=0, games=0, battles=0, wins=0
+        ))
+        daily = db.get(models.UserDailyStat, (user_id, day))
+    return daily
+
+
+def _merge_weak_word(weak_words: list, word_text: str, miss_count: int) -> list:
+    """
+    苦手単語の上位リストに反映する。ミス回数は増える一方なので、
+    対象の単語だけ差し替えて並べ直せば上位 N 件は常に正確に保たれる。
+    """
+    weak_words = [w for w in weak_words if w[0] != word_text]
+    weak_words.append([word_text, miss_count])
+    weak_words.sort(key=lambda w: -w[1])
+    return weak_words[:WEAK_WORDS_LIMIT]
+
+
+# --- 差分更新（commit は呼び出し側で行う） ---
+
+def on_word_stat(db: Session, user_id: int, word_text: str, is_correct: bool, miss_count: int):
+    rollup = _rollup(db, user_id)
+    daily = _daily(db, user_id)
+    if is_correct:
+        rollup.total_correct += 1
+        daily.correct += 1
+    else:
+        rollup.total_miss += 1
+        daily.miss += 1
+        weak_words = json.loads(rollup.weak_words_json or "[]")
+        rollup.weak_words_json = json.dumps(_merge_weak_word(weak_words, word_text, miss_count), ensure_ascii=False)
+
+
+def on_ranking(db: Session, user_id: int, entry: models.Ranking):
+    rollup = _rollup(db, user_id)
+    daily = _daily(db, user_id)
+    rollup.games_played += 1
+    daily.games += 1
+    _apply_best(rollup, entry)
+    if entry.accuracy is not None and (daily.best_accuracy is None or entry.accuracy > daily.best_accuracy):
+        daily.best_accuracy = entry.accuracy
+
+
+def _apply_best(rollup: models.UserStatsRollup, entry: models.Ranking):
+    merge_best(rollup, entry.accuracy, entry.avg_speed, entry.time)
+
+
+def merge_best(target, accuracy: Optional[float], avg_speed: Optional[float], time: Optional[float]):
+    """best_accuracy / best_avg_speed / best_time を持つ行（集計・コンパクションの集計）に記録を反映する"""
+    if accuracy is not None and (target.best_accuracy is None or accuracy > target.best_accuracy):
+        target.best_accuracy = accuracy
+    if avg_speed and (target.best_avg_speed is None or avg_speed < target.best_avg_speed):
+        target.best_avg_speed = avg_speed
+    if time and (target.best_time is None or time < target.best_time):
+        target.best_time = time
+
+
+def record_battle_result(results: Dict[int, bool]):
+    """
+    対戦終了時に呼ぶ。results はログイン中のプレイヤーの {user_id: 勝ったか}。
+    イベントループの外（スレッド）から呼ばれる前提で、書き込みキューを待つ。
+    """
+    if not results:
+        return
+
+    def write(db: Session):
+        for user_id, won in results.items():
+            rollup = _rollup(db, user_id)
+            daily = _daily(db, user_id)
+            rollup.battles_played += 1
+            daily.battles += 1
+            if won:
+                rollup.battles_won += 1
+                rollup.current_win_streak += 1
+                rollup.best_win_streak = max(rollup.best_win_streak, rollup.current_win_streak)
+                daily.wins += 1
+            else:
+                rollup.current_win_streak = 0
+
+    try:
+        write_queue.run(None, write)
+    except Exception as e:
+        print(f"Battle stats update failed: {e}")
+
+
+# --- 読み出し ---
+
+def read_stats(db: Session, user_id: int, days: int = 30) -> dict:
+    """集計行を主キーで1件、日別集計を (user_id, day) の範囲で取るだけ"""
+    rollup = db.get(models.UserStatsRollup, user_id)
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    daily_rows = db.query(models.UserDailyStat).filter(
+        models.UserDailyStat.user_id == user_id,
+        models.UserDailyStat.day >= since
+    ).order_by(models.UserDailyStat.day).all()
+
+    summary = {
+        "games_played": 0, "best_accuracy": None, "best_avg_speed": None, "best_time": None,
+        "total_correct": 0, "total_miss": 0, "weak_words": [],
+        "battles_played": 0, "battles_won": 0, "current_win_streak": 0, "best_win_streak": 0,
+    }
+    if rollup is not None:
+        for key in summary:
+            if key != "weak_words":
+                summary[key] = getattr(rollup, key)
+        summary["weak_words"] = json.loads(rollup.weak_words_json or "[]")
+
+    summary["daily"] = [
+        {
+            "day": d.day.isoformat(), "correct": d.correct, "miss": d.miss, "games": d.games,
+            "best_accuracy": d.best_accuracy, "battles": d.battles, "wins": d.wins,
+        }
+        for d in daily_rows
+    ]
+    return summary
+
+
+# --- 再集計 ---
+
+def rebuild_user(db: Session, user_id: int) -> int:
+    """
+    1人分の集計を生データから作り直す（commit は呼び出し側で行う）。処理した生データの行数を返す。
+    作り直す項目はいったん空に戻してから足し込むので、生データが消えた分も残らない。
+    """
+    correct = miss = games = 0
+    weak: list = []
+    best = models.UserStatsRollup()
+    daily_games: Dict[date, int] = {}
+    daily_best: Dict[date, float] = {}
+    rows = 0
+
+    word_stats = db.query(models.UserWordStat).filter(models.UserWordStat.user_id == user_id)
+    for stat in word_stats:
+        rows += 1
+        correct += stat.correct_count or 0
+        miss += stat.miss_count or 0
+        if stat.miss_count:
+            weak = _merge_weak_word(weak, stat.word_text, stat.miss_count)
+
+    rankings = db.query(
+        models.Ranking.created_at, models.Ranking.accuracy, models.Ranking.avg_speed, models.Ranking.time
+    ).filter(models.Ranking.user_id == user_id)
+    for created_at, accuracy, avg_speed, time in rankings:
+        rows += 1
+        games += 1
+        merge_best(best, accuracy, avg_speed, time)
+        if created_at is not None:
+            day = created_at.date()
+            daily_games[day] = daily_games.get(day, 0) + 1
+            if accuracy is not None and accuracy > daily_best.get(day, -1):
+                daily_best[day] = accuracy
+
+    # コンパクションで削除済みのランキングは、削除前に残した日別の集計から足し込む
+    tallies = db.query(models.CompactedRankingTally).filter(models.CompactedRankingTally.user_id == user_id)
+    for tally in tallies:
+        rows += 1
+        games += tally.games or 0
+        merge_best(best, tally.best_accuracy, tally.best_avg_speed, tally.best_time)
+        daily_games[tally.day] = daily_games.get(tally.day, 0) + (tally.games or 0)
+        if tally.best_accuracy is not None and tally.best_accuracy > daily_best.get(tally.day, -1):
+            daily_best[tally.day] = tally.best_accuracy
+
+    if rows == 0 and db.get(models.UserStatsRollup, user_id) is None:
+        return 0
+
+    rollup = _rollup(db, user_id)
+    rollup.total_correct = correct
+    rollup.total_miss = miss
+    rollup.weak_words_json = json.dumps(weak, ensure_ascii=False)
+    rollup.games_played = games
+    rollup.best_accuracy = best.best_accuracy
+    rollup.best_avg_speed = best.best_avg_speed
+    rollup.best_time = best.best_time
+
+    # ランキングから作る日別の項目は空に戻す（対戦成績と日別の正誤数は生データが無いのでそのまま）
+    db.query(models.UserDailyStat).filter(models.UserDailyStat.user_id == user_id).update(
+        {models.UserDailyStat.games: 0, models.UserDailyStat.best_accuracy: None},
+        synchronize_session="fetch"
+    )
+    for day, count in daily_games.items():
+        daily = _daily(db, user_id, day)
+        daily.games = count
+        daily.best_accuracy = daily_best.get(day)
+    return rows
+
+
+def rebuild_all(db: Session, batch_size: int = REBUILD_BATCH_SIZE,
+                on_progress: Optional[Callable[[int], None]] = None):
+    """
+    生データから集計をやり直す。ユーザー ID 順に1人ずつ作り直すので、
+    メモリに載るのは1人分の生データだけで済む。1人ごとに書き込みキューで commit するので、
+    作り直し中もサーバーの書き込みを長く止めない。
+    単語の正誤とランキングから作れる項目だけを作り直し、生データの残らない
+    対戦成績と日別の正誤数はそのまま残す。
+    on_progress には batch_size 行ごとに、それまでに処理した行数が渡る（ジョブのリース延長用）。
+    """
+    processed = 0
+    reported = 0
+    users = 0
+    last_id = 0
+    while True:
+        user_ids = [row[0] for row in db.query(models.User.id).filter(
+            models.User.id > last_id
+        ).order_by(models.User.id).limit(batch_size)]
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            rows = write_queue.run(db, lambda writer: rebuild_user(writer, user_id))
+            processed += rows + 1
+            if rows:
+                users += 1
+            if on_progress is not None and processed - reported >= batch_size:
+                reported = processed
+                on_progress(processed)
+        last_id = user_ids[-1]
+    return users
@@ -0,0 +1,158 @@
+# backend/app/rate_limit.py
+import os
+from typing import Dict, Optional, Set
+
+from dotenv import load_dotenv
+
+from .clock import now as clock_now
+
+load_dotenv()
+
+# 1フレームの最大長（文字数）。正規のコマンドは NAME でも数十文字程度
+WS_MAX_FRAME_CHARS = int(os.getenv("WS_MAX_FRAME_CHARS", "256"))
+# プレイヤーごとのトークンバケット（毎秒の補充量 / 最大バースト）
+WS_PLAYER_RATE = float(os.getenv("WS_PLAYER_RATE", "10"))
+WS_PLAYER_BURST = float(os.getenv("WS_PLAYER_BURST", "20"))
+# ルーム全体のトークンバケット
+WS_ROOM_RATE = float(os.getenv("WS_ROOM_RATE", "40"))
+WS_ROOM_BURST = float(os.getenv("WS_ROOM_BURST", "80"))
+# 1クライアントでこの回数を超えて破棄されたら切断する (0 で無効)
+WS_MAX_STRIKES = int(os.getenv("WS_MAX_STRIKES", "200"))
+# 最後に破棄されてからこの秒数が経つまでは、切断・再接続しても違反回数を引き継ぐ
+WS_STRIKE_FORGET_SECONDS = float(os.getenv("WS_STRIKE_FORGET_SECONDS", "300"))
+# 審判ロジックで処理しないコマンドのうち、そのまま中継してよいもの（カンマ区切り）
+WS_RELAY_COMMANDS = frozenset(
+    c.strip() for c in os.getenv("WS_RELAY_COMMANDS", "").split(",") if c.strip()
+)
+
+
+class TokenBucket:
+    """一定レートで補充されるトークンバケット。consume は O(1)"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = clock_now()
+
+    def consume(self, now: float, cost: float = 1.0) -> bool:
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def full(self, now: float) -> bool:
+        """今の時点で満タンまで補充されているか（満タンのバケツは作り直しても同じ）"""
+        return self.tokens + max(0.0, now - self.updated) * self.rate >= self.capacity
+
+
+class WebSocketGuard:
+    """
+    バトル用 WebSocket の受信フレームを検査する。
+    サイズ → クライアント単位 → ルーム単位の順に安いチェックから行い、
+    破棄したフレームは理由ごとに数える。
+    クライアントの鍵は接続ではなくユーザー（ゲストは player_id）なので、
+    制限中のクライアントは切断して繋ぎ直してもバケツと違反回数がそのまま残る。
+    """
+
+    def __init__(self):
+        self.player_buckets: Dict[str, TokenBucket] = {}
+        self.room_buckets: Dict[str, TokenBucket] = {}
+        self.strikes: Dict[str, int] = {}
+        self.last_strike: Dict[str, float] = {}
+        # 切断済みだが、制限が解けるまで覚えておくクライアント
+        self.retained: Set[str] = set()
+        self.dropped: Dict[str, int] = {
+            "oversize": 0,
+            "player_rate": 0,
+            "room_rate": 0,
+            "not_relayable": 0,
+        }
+        self.accepted = 0
+
+    @staticmethod
+    def client_key(player_id: str, user_id: Optional[int] = None) -> str:
+        """制限をかける単位。ログイン中ならユーザー、ゲストは player_id（種類ごとに名前空間を分ける）"""
+        return f"user:{user_id}" if user_id is not None else f"player:{player_id}"
+
+    def check(self, room_id: str, client: str, data: str) -> Optional[str]:
+        """フレームを受け付けるなら None、破棄するなら理由を返す"""
+        if len(data) > WS_MAX_FRAME_CHARS:
+            return self._drop("oversize", client)
+
+        now = clock_now()
+        bucket = self.player_buckets.get(client)
+        if bucket is None:
+            bucket = self.player_buckets[client] = TokenBucket(WS_PLAYER_RATE, WS_PLAYER_BURST)
+        if not bucket.consume(now):
+            return self._drop("player_rate", client)
+
+        bucket = self.room_buckets.get(room_id)
+        if bucket is None:
+            bucket = self.room_buckets[room_id] = TokenBucket(WS_ROOM_RATE, WS_ROOM_BURST)
+        if not bucket.consume(now):
+            return self._drop("room_rate", client)
+
+        self.accepted += 1
+        return None
+
+    def is_relayable(self, command: str, client: str) -> bool:
+        """審判ロジックが扱わないコマンドを中継してよいか"""
+        if command.split(":", 1)[0] in WS_RELAY_COMMANDS:
+            return True
+        self._drop("not_relayable", client)
+        return False
+
+    def should_disconnect(self, client: str) -> bool:
+        return WS_MAX_STRIKES > 0 and self.strikes.get(client, 0) > WS_MAX_STRIKES
+
+    def _drop(self, reason: str, client: str) -> str:
+        self.dropped[reason] += 1
+        self.strikes[client] = self.strikes.get(client, 0) + 1
+        self.last_strike[client] = clock_now()
+        return reason
+
+    def _forgettable(self, client: str, now: float) -> bool:
+        """忘れても作り直したときと同じ状態になる（バケツが満タンで、最近の違反も無い）か"""
+        bucket = self.player_buckets.get(client)
+        if bucket is not None and not bucket.full(now):
+            return False
+        return now - self.last_strike.get(client, float("-inf")) >= WS_STRIKE_FORGET_SECONDS
+
+    def _forget(self, client: str):
+        self.player_buckets.pop(client, None)
+        self.strikes.pop(client, None)
+        self.last_strike.pop(client, None)
+        self.retained.discard(client)
+
+    def release_player(self, client: str):
+        """切断時に呼ぶ。制限中のクライアントは、繋ぎ直しで元に戻らないよう解けるまで残す"""
+        self.retained.add(client)
+        self.sweep()
+
+    def release_room(self, room_id: str):
+        self.room_buckets.pop(room_id, None)
+        self.sweep()
+
+    def sweep(self):
+        """切断済みのクライアントのうち、制限が解けたものを忘れる"""
+        now = clock_now()
+        for client in [c for c in self.retained if self._forgettable(c, now)]:
+            self._forget(client)
+
+    def stats(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "dropped": dict(self.dropped),
+            "tracked_players": len(self.player_buckets),
+            "retained_players": len(self.retained),
+            "tracked_rooms": len(self.room_buckets),
+        }
+
+
+ws_guard = WebSocketGuard()
@@ -0,0 +1,87 @@
+# backend/app/room_snapshot.py
+import asyncio
+import gzip
+import json
+import os
+import signal
+import threading
+import time
+from typing import Callable, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ROOM_SNAPSHOT_PATH = os.getenv("ROOM_SNAPSHOT_PATH", "./room_snapshot.json.gz")
+# これより古いスナップショットは復元しない（長く止まっていたら対戦はもう終わっている）
+ROOM_SNAPSHOT_MAX_AGE = int(os.getenv("ROOM_SNAPSHOT_MAX_AGE", "300"))
+# 復元したルームに誰も戻ってこなかった場合に片付けるまでの秒数
+ROOM_RESTORE_GRACE = int(os.getenv("ROOM_RESTORE_GRACE", "60"))
+SNAPSHOT_VERSION = 1
+
+
+class DrainState:
+    """
+    再起動前の「受付停止」状態。
+    停止シグナルを受けたらルームの新規作成を止め、その時点のルーム状態を書き出す。
+    """
+
+    def __init__(self):
+        self.draining = False
+        self.saved = False
+
+    def install(self, on_drain: Callable[[], None]):
+        """
+        SIGTERM / SIGINT を横取りしてからサーバー本来のハンドラへ渡す。
+        uvicorn はシャットダウン時に WebSocket を先に閉じてしまうので、
+        shutdown イベントを待たず、シグナルを受けた時点で状態を書き出す。
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+
+            def handler(signum, frame, previous=previous):
+                # シグナルハンドラはどこで割り込むか分からないので、書き出しはイベントループに任せる
+                loop.call_soon_threadsafe(on_drain)
+                if callable(previous):
+                    previous(signum, frame)
+
+            signal.signal(sig, handler)
+
+
+drain_state = DrainState()
+
+
+def save_snapshot(rooms: List[dict], path: str = ROOM_SNAPSHOT_PATH):
+    """一時ファイルに書いてから置き換える（書き込み途中で落ちても壊れたファイルを残さない）"""
+    payload = {"version": SNAPSHOT_VERSION, "savedAt": time.time(), "rooms": rooms}
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str = ROOM_SNAPSHOT_PATH, max_age: int = ROOM_SNAPSHOT_MAX_AGE) -> Optional[List[dict]]:
+    """スナップショットを読み込んで消す（同じ状態を2回復元しないように）"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+    except Exception as e:
+        print(f"Room snapshot unreadable: {e}")
+        payload = None
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    if not payload or payload.get("version") != SNAPSHOT_VERSION:
+        return None
+    if time.time() - payload.get("savedAt", 0) > max_age:
+        print("Room snapshot is too old, skipping restore.")
+        return None
+    return payload.get("rooms", [])
@@ -0,0 +1,167 @@
+# backend/app/rounds.py
+from typing import Dict, List, Set, Tuple
+
+PENDING = "pending"
+CORRECT = "correct"
+WRONG = "wrong"
+
+
+class RoundTracker:
+    """
+    ラウンドごとの回答状況をカウンタで管理する。
+    状態は (世代番号, 状態) で保持し、世代が古ければ pending とみなすので、
+    ラウンド切り替え・回答記録・全員不正解の判定がすべて O(1) になる。
+    """
+
+    def __init__(self):
+        # ラウンドが切り替わるたびに進む世代番号（再戦でラウンド番号が戻っても重複しない）
+        self.epoch = 0
+        self.states: Dict[str, Tuple[int, str]] = {}
+        self.active: Set[str] = set()
+        self.correct = 0
+        self.wrong = 0
+
+    def state_of(self, player_id: str) -> str:
+        stamp = self.states.get(player_id)
+        if stamp is None or stamp[0] != self.epoch:
+            return PENDING
+        return stamp[1]
+
+    @property
+    def pending(self) -> int:
+        return len(self.active) - self.correct - self.wrong
+
+    def _count(self, state: str, delta: int):
+        if state == CORRECT:
+            self.correct += delta
+        elif state == WRONG:
+            self.wrong += delta
+
+    def add_player(self, player_id: str):
+        """接続中のプレイヤーとして数える（再接続時は今ラウンドの状態を引き継ぐ）"""
+        if player_id in self.active:
+            return
+        self.active.add(player_id)
+        self._count(self.state_of(player_id), 1)
+
+    def remove_player(self, player_id: str):
+        """切断したプレイヤーを集計から外す（状態自体は再接続に備えて残す）"""
+        if player_id not in self.active:
+            return
+        self.active.discard(player_id)
+        self._count(self.state_of(player_id), -1)
+
+    def mark(self, player_id: str, state: str):
+        previous = self.state_of(player_id)
+        if previous == state:
+            return
+        if player_id in self.active:
+            self._count(previous, -1)
+            self._count(state, 1)
+        self.states[player_id] = (self.epoch, state)
+
+    def next_round(self):
+        """全員を pending に戻す。個別の状態は書き換えない"""
+        self.epoch += 1
+        self.correct = 0
+        self.wrong = 0
+
+    def all_wrong(self) -> bool:
+        return len(self.active) > 0 and self.wrong == len(self.active)
+
+    def snapshot(self) -> Dict[str, str]:
+        return {pid: self.state_of(pid) for pid in self.states}
+
+    def to_dict(self) -> dict:
+        return {"epoch": self.epoch, "states": {pid: list(stamp) for pid, stamp in self.states.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RoundTracker":
+        """再起動後の復元用。接続中のプレイヤーは再接続時の add_player で数え直す"""
+        tracker = cls()
+        tracker.epoch = data.get("epoch", 0)
+        tracker.states = {pid: (stamp[0], stamp[1]) for pid, stamp in data.get("states", {}).items()}
+        return tracker
+
+
+class Standings:
+    """
+    スコア降順に並んだプレイヤー列。
+    スコアは +1 ずつしか増えないので、同点ブロックの先頭と入れ替えるだけで
+    並びを保ったまま O(1) で更新できる。
+    """
+
+    def __init__(self):
+        self.scores: Dict[str, int] = {}
+        self.order: List[str] = []
+        self.pos: Dict[str, int] = {}
+        # スコア -> (同点ブロックの先頭位置, 人数)
+        self.blocks: Dict[int, List[int]] = {}
+
+    def __contains__(self, player_id: str) -> bool:
+        return player_id in self.scores
+
+    def add_player(self, player_id: str):
+        if player_id in self.scores:
+            return
+        self.scores[player_id] = 0
+        self.pos[player_id] = len(self.order)
+        self.order.append(player_id)
+        block = self.blocks.get(0)
+        if block is None:
+            self.blocks[0] = [len(self.order) - 1, 1]
+        else:
+            block[1] += 1
+
+    def increment(self, player_id: str) -> int:
+        score = self.scores[player_id]
+        block = self.blocks[score]
+        i, j = self.pos[player_id], block[0]
+
+        # 同点ブロックの先頭と入れ替える → 1つ上のブロックの末尾に繋がる
+        other = self.order[j]
+        self.order[i], self.order[j] = other, player_id
+        self.pos[other], self.pos[player_id] = i, j
+
+        block[0] += 1
+        block[1] -= 1
+        if block[1] == 0:
+            del self.blocks[score]
+
+        upper = self.blocks.get(score + 1)
+        if upper is None:
+            self.blocks[score + 1] = [j, 1]
+        else:
+            upper[1] += 1
+
+        self.scores[player_id] = score + 1
+        return score + 1
+
+    def reset(self):
+        for pid in self.scores:
+            self.scores[pid] = 0
+        self.blocks = {0: [0, len(self.order)]} if self.order else {}
+
+    def top(self, limit: int = 0) -> List[List]:
+        ids = self.order[:limit] if limit else self.order
+        return [[pid, self.scores[pid]] for pid in ids]
+
+    def to_dict(self) -> dict:
+        return {"order": list(self.order), "scores": dict(self.scores)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Standings":
+        """保存時の並び（スコア降順）をそのまま使い、同点ブロックを作り直す"""
+        standings = cls()
+        scores = data.get("scores", {})
+        for i, pid in enumerate(data.get("order", [])):
+            score = scores.get(pid, 0)
+            standings.scores[pid] = score
+            standings.pos[pid] = i
+            standings.order.append(pid)
+            block = standings.blocks.get(score)
+            if block is None:
+                standings.blocks[score] = [i, 1]
+            else:
+                block[1] += 1
+        return standings
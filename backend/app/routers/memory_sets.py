@@ -1,11 +1,16 @@
 # backend/app/routers/memory_sets.py
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from sqlalchemy import or_
 from typing import List
 import json
 from .. import models, schemas
-from ..dependencies import get_db, get_current_user
+from ..dependencies import get_db, get_read_db, get_current_user
+from ..serializers import FastJSONResponse, memory_set_json, memory_sets_json
+from ..set_search import index_set, remove_set, search, MAX_PER_PAGE
+from ..distractors import distractor_indexer, remove_index
+from ..bundles import bundle_store
+from ..write_queue import write_queue
 
 router = APIRouter(
     prefix="/api",
@@ -14,7 +19,7 @@ router = APIRouter(
 
 # ルーム作成時の選択用リスト取得
 @router.get("/sets")
-def get_memory_sets(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_memory_sets(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_read_db)):
     # 公式セット、公開セット、または自分が作成したセットを取得
     db_sets = db.query(models.MemorySet).filter(
         or_(
@@ -36,9 +41,33 @@ def get_memory_sets(current_user: models.User = Depends(get_current_user), db: S
         for s in db_sets
     ]
 
+# 公開セットの検索（タイトルと単語の text / kana が対象）
+@router.get("/sets/search")
+def search_memory_sets(
+    q: str = Query(..., min_length=1, max_length=100),
+    page: int = Query(1, ge=1),
+    per_page: int = Query(20, ge=1, le=MAX_PER_PAGE),
+    db: Session = Depends(get_read_db)
+):
+    total, hits = search(db, q, page, per_page)
+    ids = [set_id for set_id, _ in hits]
+    sets = {s.id: s for s in db.query(models.MemorySet).filter(models.MemorySet.id.in_(ids)).all()} if ids else {}
+    results = [
+        {
+            "id": str(set_id),
+            "name": sets[set_id].title,
+            "owner_id": sets[set_id].owner_id,
+            "is_official": sets[set_id].is_official,
+            "is_public": sets[set_id].is_public,
+            "score": score
+        }
+        for set_id, score in hits if set_id in sets
+    ]
+    return {"total": total, "page": page, "per_page": per_page, "results": results}
+
 # 自分のメモリーセット一覧取得
 @router.get("/my-sets", response_model=List[schemas.MemorySetResponse])
-def read_my_memory_sets(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+def read_my_memory_sets(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_read_db)):
     # 自分のセット または 公開されているセット を取得
     sets = db.query(models.MemorySet).filter(
         or_(
@@ -47,47 +76,39 @@ def read_my_memory_sets(current_user: models.User = Depends(get_current_user), d
         )
     ).all()
     
-    results = []
-    for s in sets:
-        results.append({
-            "id": s.id, 
-            "title": s.title, 
-            "owner_id": s.owner_id,
-            "memorize_time": s.memorize_time, 
-            "answer_time": s.answer_time,
-            "questions_per_round": s.questions_per_round, 
-            "win_score": s.win_score,
-            "condition_type": s.condition_type, 
-            "order_type": s.order_type,
-            "is_official": s.is_official,
-            "is_public": s.is_public,  # ★ここを追加
-            "words": json.loads(s.words_json) if s.words_json else []
-        })
-    return results
+    # words_json をパースせずにそのままレスポンスへ埋め込む
+    return FastJSONResponse(memory_sets_json(sets))
 
 # 新規作成 (POST)
 @router.post("/my-sets", response_model=schemas.MemorySetResponse)
 def create_memory_set(item: schemas.MemorySetCreate, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
     # 単語リストをJSON文字列に変換
     words_json_str = json.dumps([w.dict() for w in item.words], ensure_ascii=False)
-    
-    new_set = models.MemorySet(
-        title=item.title, 
-        words_json=words_json_str, 
-        owner_id=current_user.id,
-        memorize_time=item.memorize_time, 
-        answer_time=item.answer_time,
-        questions_per_round=item.questions_per_round, 
-        is_public=item.is_public,
-        win_score=item.win_score,
-        condition_type=item.condition_type, 
-        order_type=item.order_type,
-        is_official=False
-    )
-    db.add(new_set)
-    db.commit()
-    db.refresh(new_set)
-    return {**new_set.__dict__, "words": json.loads(new_set.words_json)}
+    owner_id = current_user.id
+
+    def write(db: Session):
+        new_set = models.MemorySet(
+            title=item.title, 
+            words_json=words_json_str, 
+            owner_id=owner_id,
+            memorize_time=item.memorize_time, 
+            answer_time=item.answer_time,
+            questions_per_round=item.questions_per_round, 
+            is_public=item.is_public,
+            win_score=item.win_score,
+            condition_type=item.condition_type, 
+            order_type=item.order_type,
+            is_official=False
+        )
+        db.add(new_set)
+        db.flush()
+        index_set(db, new_set)
+        db.refresh(new_set)
+        return new_set
+
+    new_set = write_queue.run(db, write)
+    distractor_indexer.schedule(new_set.id)
+    return FastJSONResponse(memory_set_json(new_set))
 
 # 単一取得 (GET)
 @router.get("/my-sets/{set_id}", response_model=schemas.MemorySetResponse)
@@ -101,7 +122,7 @@ def read_single_memory_set(set_id: int, current_user: models.User = Depends(get_
     if not memory_set:
         raise HTTPException(status_code=404, detail="Set not found or access denied")
     
-    return {**memory_set.__dict__, "words": json.loads(memory_set.words_json)}
+    return FastJSONResponse(memory_set_json(memory_set))
 
 # ★追加: 更新処理 (PUT)
 @router.put("/my-sets/{set_id}", response_model=schemas.MemorySetResponse)
@@ -111,43 +132,58 @@ def update_memory_set(
     current_user: models.User = Depends(get_current_user), 
     db: Session = Depends(get_db)
 ):
-    # 更新対象を検索（自分の所有物であることを確認）
-    db_set = db.query(models.MemorySet).filter(
-        models.MemorySet.id == set_id, 
-        models.MemorySet.owner_id == current_user.id
-    ).first()
+    owner_id = current_user.id
 
-    if not db_set:
-        raise HTTPException(status_code=404, detail="Set not found or access denied")
+    def write(db: Session):
+        # 更新対象を検索（自分の所有物であることを確認）
+        db_set = db.query(models.MemorySet).filter(
+            models.MemorySet.id == set_id, 
+            models.MemorySet.owner_id == owner_id
+        ).first()
+
+        if not db_set:
+            raise HTTPException(status_code=404, detail="Set not found or access denied")
 
-    # フィールドの更新
-    db_set.title = item.title
-    db_set.words_json = json.dumps([w.dict() for w in item.words], ensure_ascii=False)
-    db_set.memorize_time = item.memorize_time
-    db_set.answer_time = item.answer_time
-    db_set.questions_per_round = item.questions_per_round
-    db_set.is_public = item.is_public
-    db_set.win_score = item.win_score
-    db_set.condition_type = item.condition_type
-    db_set.order_type = item.order_type
+        # フィールドの更新
+        db_set.title = item.title
+        db_set.words_json = json.dumps([w.dict() for w in item.words], ensure_ascii=False)
+        db_set.memorize_time = item.memorize_time
+        db_set.answer_time = item.answer_time
+        db_set.questions_per_round = item.questions_per_round
+        db_set.is_public = item.is_public
+        db_set.win_score = item.win_score
+        db_set.condition_type = item.condition_type
+        db_set.order_type = item.order_type
+        index_set(db, db_set)
+        db.flush()
+        db.refresh(db_set)
+        return db_set
 
-    db.commit()
-    db.refresh(db_set)
+    db_set = write_queue.run(db, write)
+    distractor_indexer.schedule(db_set.id)
+    bundle_store.invalidate(db_set.id)
 
-    # 辞書形式で展開し、words_jsonをパースして返却
-    return {**db_set.__dict__, "words": json.loads(db_set.words_json)}
+    # 保存済みの words_json をそのまま埋め込んで返却
+    return FastJSONResponse(memory_set_json(db_set))
 
 # 削除 (DELETE)
 @router.delete("/my-sets/{set_id}")
 def delete_memory_set(set_id: int, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    memory_set = db.query(models.MemorySet).filter(
-        models.MemorySet.id == set_id, 
-        models.MemorySet.owner_id == current_user.id
-    ).first()
-    
-    if not memory_set:
-        raise HTTPException(status_code=404, detail="Set not found")
-    
-    db.delete(memory_set)
-    db.commit()
+    owner_id = current_user.id
+
+    def write(db: Session):
+        memory_set = db.query(models.MemorySet).filter(
+            models.MemorySet.id == set_id, 
+            models.MemorySet.owner_id == owner_id
+        ).first()
+        
+        if not memory_set:
+            raise HTTPException(status_code=404, detail="Set not found")
+        
+        remove_set(db, memory_set.id)
+        remove_index(db, memory_set.id)
+        db.delete(memory_set)
+
+    write_queue.run(db, write)
+    bundle_store.invalidate(set_id)
     return {"message": "Set deleted successfully"}
\ No newline at end of file
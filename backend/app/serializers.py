@@ -0,0 +1,148 @@
+# backend/app/serializers.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi.responses import Response
+from pydantic import ValidationError
+
+from . import models, schemas
+
+load_dotenv()
+
+# 検証済みの単語リストを覚えておくセット数（同じ内容なら2回目からはパースも検証もしない）
+WORDS_CACHE_SIZE = int(os.getenv("WORDS_CACHE_SIZE", "256"))
+
+try:
+    import orjson
+except ImportError:  # orjson が無い環境では標準ライブラリにフォールバック
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """JSON バイト列に変換する（orjson があればそちらを使う）"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """
+    response_model による再バリデーションを経由せずに返す JSON レスポンス。
+    bytes を渡した場合は組み立て済みの JSON としてそのまま送信する。
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray)):
+            return bytes(content)
+        return dumps(content)
+
+
+class InvalidWords(ValueError):
+    """保存済みの words_json が単語リストとして読めない"""
+
+
+class WordsCache:
+    """
+    保存済みの words_json を WordItem で検証し、kana の補完まで済ませた結果を覚えておく。
+    キーは (セットID, words_json のハッシュ) なので、更新されたセットは別のエントリになる
+    （元の文字列はキーに持たず、メモリに残るのは整形済みの結果だけ）。
+    壊れた内容も覚えておき、エラーのログは内容ごとに1回だけ出す。
+    """
+
+    def __init__(self, maxsize: int = WORDS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[Tuple[Optional[int], bytes], Optional[Tuple[List[dict], bytes]]]" = OrderedDict()
+        self.invalid = 0
+        self._lock = threading.Lock()
+
+    def get(self, set_id: Optional[int], words_json: Optional[str]) -> Tuple[List[dict], bytes]:
+        """(単語リスト, その JSON バイト列) を返す。壊れていれば InvalidWords"""
+        words_json = words_json or "[]"
+        key = (set_id, hashlib.sha1(words_json.encode("utf-8")).digest())
+        with self._lock:
+            found = key in self.entries
+            if found:
+                self.entries.move_to_end(key)
+                entry = self.entries[key]
+        if not found:
+            entry = self._load(set_id, words_json)
+            with self._lock:
+                self.entries[key] = entry
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        if entry is None:
+            raise InvalidWords(f"Memory set {set_id} has invalid words_json")
+        return entry
+
+    def _load(self, set_id: Optional[int], words_json: str) -> Optional[Tuple[List[dict], bytes]]:
+        try:
+            items = json.loads(words_json)
+            if not isinstance(items, list):
+                raise ValueError("words_json is not a list")
+            # 旧データの kana: null は空文字として扱う（スキーマの既定値と同じ）
+            filled = 0
+            for item in items:
+                if isinstance(item, dict) and item.get("kana") is None:
+                    item["kana"] = ""
+                    filled += 1
+            words = [schemas.WordItem.model_validate(item).model_dump() for item in items]
+        except (ValueError, ValidationError) as e:
+            self.invalid += 1
+            print(f"❌ Memory set {set_id} has invalid words_json: {e}")
+            return None
+        if filled:
+            print(f"⚠️ Memory set {set_id}: {filled} words had no kana, sent as empty strings")
+        return words, dumps(words)
+
+
+words_cache = WordsCache()
+
+
+def load_words(memory_set: models.MemorySet) -> List[dict]:
+    """検証済みの単語リスト。壊れていれば InvalidWords（ログは出力済み）"""
+    return words_cache.get(memory_set.id, memory_set.words_json)[0]
+
+
+def memory_set_meta(s: models.MemorySet) -> dict:
+    """MemorySetResponse のうち words 以外のフィールド"""
+    return {
+        "id": s.id,
+        "title": s.title,
+        "owner_id": s.owner_id,
+        "memorize_time": s.memorize_time,
+        "answer_time": s.answer_time,
+        "questions_per_round": s.questions_per_round,
+        "is_public": bool(s.is_public),
+        "win_score": s.win_score,
+        "condition_type": s.condition_type,
+        "order_type": s.order_type,
+        "is_official": bool(s.is_official),
+    }
+
+
+def memory_set_json(s: models.MemorySet) -> bytes:
+    """
+    単語リストは WordsCache で検証・整形済みのバイト列をそのまま埋め込む。
+    同じ内容のセットを返すたびにパース→再シリアライズするコストがかからない。
+    壊れた words_json はクライアントに流さず、空の単語リストとして返す（エラーはログに残る）。
+    """
+    try:
+        words = words_cache.get(s.id, s.words_json)[1]
+    except InvalidWords:
+        words = b"[]"
+    return dumps(memory_set_meta(s))[:-1] + b',"words":' + words + b"}"
+
+
+def memory_sets_json(sets: Iterable[models.MemorySet]) -> bytes:
+    return b"[" + b",".join(memory_set_json(s) for s in sets) + b"]"
+
+
+def user_json(user: models.User) -> bytes:
+    head = dumps({"id": user.id, "username": user.username})[:-1]
+    return head + b',"memory_sets":' + memory_sets_json(user.memory_sets) + b"}"
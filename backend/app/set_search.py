@@ -0,0 +1,226 @@
+# backend/app/set_search.py
+import json
+import unicodedata
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import models
+from .write_queue import write_queue
+
+# 1ページあたりの最大件数
+MAX_PER_PAGE = 50
+# trigram 索引が効く最短の検索語（これより短いと前方一致の走査になる）
+MIN_TRIGRAM_LENGTH = 3
+
+# 接続先ごとの trigram 検索（SQLite は FTS5、Postgres は pg_trgm）が使えるかどうか。
+# 使えないときは LIKE だけで検索する（索引は効かないが、検索が丸ごと失敗するよりよい）
+_trigram: Dict[str, bool] = {}
+
+
+def normalize(value: str) -> str:
+    """
+    全角半角・大文字小文字・カタカナひらがなの違いを吸収する。
+    「リンゴ」「りんご」「ﾘﾝｺﾞ」がどれでも同じ文字列になる。
+    """
+    value = unicodedata.normalize("NFKC", value or "").casefold()
+    chars = []
+    for ch in value:
+        code = ord(ch)
+        # カタカナ (ァ〜ヶ) をひらがなに寄せる
+        if 0x30A1 <= code <= 0x30F6:
+            ch = chr(code - 0x60)
+        chars.append(ch)
+    return " ".join("".join(chars).split())
+
+
+def _document(memory_set: models.MemorySet) -> Tuple[str, str]:
+    try:
+        words = json.loads(memory_set.words_json or "[]")
+    except ValueError:
+        words = []
+    parts = []
+    for w in words:
+        parts.append(w.get("text", ""))
+        parts.append(w.get("kana", "") or "")
+    return normalize(memory_set.title), normalize(" ".join(parts))
+
+
+# --- 索引の更新（commit は呼び出し側で行う） ---
+
+def index_set(db: Session, memory_set: models.MemorySet):
+    """作成・更新時に呼ぶ。非公開になったセットは索引から外す"""
+    doc = db.get(models.SetSearchDoc, memory_set.id)
+    if not (memory_set.is_public or memory_set.is_official):
+        if doc is not None:
+            db.delete(doc)
+        return
+    title, body = _document(memory_set)
+    if doc is None:
+        db.add(models.SetSearchDoc(set_id=memory_set.id, title=title, body=body))
+    else:
+        doc.title = title
+        doc.body = body
+
+
+def remove_set(db: Session, set_id: int):
+    db.query(models.SetSearchDoc).filter(models.SetSearchDoc.set_id == set_id).delete(synchronize_session=False)
+
+
+def rebuild_index(db: Session, batch_size: int = 500,
+                  on_progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    全セットの索引を作り直す。batch_size 件ずつ index_set で差し替えて書き込みキューで commit するので、
+    作り直し中も検索は空にならず、書き込みロックも長く握らない。
+    on_progress にはそれまでに見たセット数が渡る。
+    """
+    def write(writer: Session, sets: List[models.MemorySet]):
+        # 既存の索引をまとめて読んでおく（index_set の get が問い合わせずに済む）
+        writer.query(models.SetSearchDoc).filter(
+            models.SetSearchDoc.set_id.in_([memory_set.id for memory_set in sets])
+        ).all()
+        for memory_set in sets:
+            index_set(writer, memory_set)
+
+    def remove_orphans(writer: Session):
+        # 削除済みのセットの索引を外す
+        writer.query(models.SetSearchDoc).filter(
+            ~models.SetSearchDoc.set_id.in_(writer.query(models.MemorySet.id))
+        ).delete(synchronize_session=False)
+
+    count = 0
+    seen = 0
+    last_id = 0
+    while True:
+        sets = db.query(models.MemorySet).filter(
+            models.MemorySet.id > last_id
+        ).order_by(models.MemorySet.id).limit(batch_size).all()
+        if not sets:
+            break
+        write_queue.run(None, lambda writer: write(writer, sets))
+        count += sum(1 for memory_set in sets if memory_set.is_public or memory_set.is_official)
+        last_id = sets[-1].id
+        seen += len(sets)
+        db.expunge_all()
+        if on_progress is not None:
+            on_progress(seen)
+    write_queue.run(None, remove_orphans)
+    return count
+
+
+# --- 索引の作成 ---
+
+_SQLITE_SETUP = [
+    # set_search_docs を外部コンテンツにした FTS5。trigram なので日本語も部分一致できる
+    """CREATE VIRTUAL TABLE IF NOT EXISTS set_search_fts USING fts5(
+        title, body, content='set_search_docs', content_rowid='set_id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS set_search_docs_ai AFTER INSERT ON set_search_docs BEGIN
+        INSERT INTO set_search_fts(rowid, title, body) VALUES (new.set_id, new.title, new.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS set_search_docs_ad AFTER DELETE ON set_search_docs BEGIN
+        INSERT INTO set_search_fts(set_search_fts, rowid, title, body) VALUES ('delete', old.set_id, old.title, old.body);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS set_search_docs_au AFTER UPDATE ON set_search_docs BEGIN
+        INSERT INTO set_search_fts(set_search_fts, rowid, title, body) VALUES ('delete', old.set_id, old.title, old.body);
+        INSERT INTO set_search_fts(rowid, title, body) VALUES (new.set_id, new.title, new.body);
+    END""",
+]
+
+_POSTGRES_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_set_search_docs_title_trgm ON set_search_docs USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_set_search_docs_body_trgm ON set_search_docs USING gin (body gin_trgm_ops)",
+]
+
+
+def _detect_trigram(db: Session) -> bool:
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        sql = "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+    elif dialect == "sqlite":
+        sql = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'set_search_fts'"
+    else:
+        return False
+    try:
+        return db.execute(text(sql)).first() is not None
+    except Exception:
+        db.rollback()
+        return False
+
+
+def trigram_available(db: Session) -> bool:
+    """trigram 検索が使えるか（接続先ごとに最初の1回だけ確かめる）"""
+    key = str(db.get_bind().url)
+    if key not in _trigram:
+        _trigram[key] = _detect_trigram(db)
+    return _trigram[key]
+
+
+def ensure_index(engine: Engine, db: Session):
+    """起動時に呼ぶ。索引を作り、空なら既存の公開セットから作り直す"""
+    statements = _POSTGRES_SETUP if engine.dialect.name == "postgresql" else _SQLITE_SETUP
+    try:
+        with engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+    except Exception as e:
+        # 権限不足などで索引が作れなくても検索自体は（遅いが）動く
+        print(f"Search index setup failed: {e}")
+    # 拡張を入れられなかった（FTS5 が無い・pg_trgm を作る権限が無い）なら LIKE 検索に切り替える
+    _trigram.pop(str(db.get_bind().url), None)
+    if not trigram_available(db):
+        print("⚠️ Trigram search is unavailable; set search falls back to LIKE scans.")
+    if db.query(models.SetSearchDoc).first() is None:
+        count = rebuild_index(db)
+        if count:
+            print(f"Indexed {count} public sets for search.")
+
+
+# --- 検索 ---
+
+def _like_pattern(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search(db: Session, query: str, page: int = 1, per_page: int = 20) -> Tuple[int, List[Tuple[int, float]]]:
+    """(ヒット総数, [(set_id, score), ...]) を関連度順で返す"""
+    q = normalize(query)
+    if not q:
+        return 0, []
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    params = {"limit": per_page, "offset": (max(page, 1) - 1) * per_page}
+    dialect = db.get_bind().dialect.name
+    trigram = trigram_available(db)
+
+    if dialect == "sqlite" and trigram and len(q) >= MIN_TRIGRAM_LENGTH:
+        params["q"] = '"' + q.replace('"', '""') + '"'
+        total = db.execute(text(
+            "SELECT count(*) FROM set_search_fts WHERE set_search_fts MATCH :q"
+        ), params).scalar()
+        # タイトルのヒットを本文より重く見る（bm25 は小さいほど関連度が高い）
+        rows = db.execute(text(
+            "SELECT rowid, -bm25(set_search_fts, 10.0, 1.0) AS score FROM set_search_fts "
+            "WHERE set_search_fts MATCH :q ORDER BY bm25(set_search_fts, 10.0, 1.0) LIMIT :limit OFFSET :offset"
+        ), params).all()
+        return total, [(r[0], float(r[1])) for r in rows]
+
+    params.update({"q": q, "pattern": f"%{_like_pattern(q)}%", "prefix": f"{_like_pattern(q)}%"})
+    where = "WHERE title LIKE :pattern ESCAPE '\\' OR body LIKE :pattern ESCAPE '\\'"
+    if dialect == "postgresql" and trigram:
+        # pg_trgm の GIN 索引で LIKE を引き、タイトルの類似度で並べる
+        score = ("(CASE WHEN title LIKE :prefix ESCAPE '\\' THEN 2 ELSE 0 END)"
+                 " + similarity(title, :q) + word_similarity(:q, body)")
+    else:
+        # 検索語が短いか trigram が使えないときは前方一致を優先して並べる
+        # （索引の文字列は normalize 済みで小文字にそろっているので、LIKE でも大文字小文字は区別しない）
+        score = ("(CASE WHEN title LIKE :prefix ESCAPE '\\' THEN 2 ELSE 0 END)"
+                 " + (CASE WHEN title LIKE :pattern ESCAPE '\\' THEN 1 ELSE 0 END)")
+    total = db.execute(text(f"SELECT count(*) FROM set_search_docs {where}"), params).scalar()
+    rows = db.execute(text(
+        f"SELECT set_id, {score} AS score FROM set_search_docs {where} "
+        "ORDER BY score DESC, set_id LIMIT :limit OFFSET :offset"
+    ), params).all()
+    return total, [(r[0], float(r[1])) for r in rows]
@@ -0,0 +1,162 @@
+# backend/app/solo_sessions.py
+import os
+import random
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from .clock import now as clock_now
+
+load_dotenv()
+
+# 最後のアクセスからこの秒数で破棄する
+SOLO_SESSION_TTL = float(os.getenv("SOLO_SESSION_TTL", "1800"))
+# 同時に保持するセッション数の上限（超えたら最も古いものから破棄）
+SOLO_MAX_SESSIONS = int(os.getenv("SOLO_MAX_SESSIONS", "20000"))
+# セッション間で共有するセット（単語リスト）の数
+SOLO_SET_CACHE = int(os.getenv("SOLO_SET_CACHE", "256"))
+# 苦手優先モードで、間違えた単語が出る重み（その他は 1）
+REVIEW_MISS_WEIGHT = 5
+
+
+class SoloSet:
+    """セッション間で共有する、パース済みの単語リスト"""
+    __slots__ = ("key", "set_id", "words_json", "problems", "positions", "order_type")
+
+    def __init__(self, key: str, set_id: Optional[int], words_json: Optional[str], problems: List[dict], order_type: str):
+        self.key = key
+        self.set_id = set_id
+        self.words_json = words_json
+        self.problems = problems
+        self.order_type = order_type
+        # 単語 → 最初の位置（ミスの記録用）
+        self.positions: Dict[str, int] = {}
+        for i, p in enumerate(problems):
+            self.positions.setdefault(p["text"], i)
+
+
+class SoloSession:
+    """
+    1回のソロプレイの出題状態。乱数・出題番号・ミスした単語をサーバー側に持ち、
+    1問ごとの処理はセットの大きさやプレイの長さによらず O(1) にする。
+    """
+    __slots__ = ("set", "rng", "index", "misses", "missed", "touched")
+
+    def __init__(self, solo_set: SoloSet, seed: Optional[str]):
+        self.set = solo_set
+        self.rng = random.Random(seed if seed is not None else secrets.randbits(64))
+        self.index = 0
+        # 単語の位置 → ミス回数と、重み付きで引くための位置の並び
+        self.misses: Dict[int, int] = {}
+        self.missed: List[int] = []
+        self.touched = clock_now()
+
+    def next_index(self) -> int:
+        """次に出題する単語の位置"""
+        n = len(self.set.problems)
+        index, self.index = self.index, self.index + 1
+        if self.set.order_type == "sequential":
+            return index % n
+        if self.set.order_type == "review" and self.missed:
+            # 間違えた単語は REVIEW_MISS_WEIGHT、その他は 1 の重みで引く
+            extra = REVIEW_MISS_WEIGHT - 1
+            r = self.rng.randrange(n + extra * len(self.missed))
+            return r if r < n else self.missed[(r - n) // extra]
+        return self.rng.randrange(n)
+
+    def record_miss(self, word_text: str) -> bool:
+        position = self.set.positions.get(word_text)
+        if position is None:
+            return False
+        count = self.misses.get(position, 0)
+        if count == 0:
+            self.missed.append(position)
+        self.misses[position] = count + 1
+        return True
+
+
+class SoloSessionStore:
+    """
+    ソロプレイのセッションを ID で引く。アクセスのたびに末尾へ移すので、
+    先頭から「期限切れ」と「上限超え」を捨てるだけで済む。
+    """
+
+    def __init__(self):
+        self.sessions: "OrderedDict[str, SoloSession]" = OrderedDict()
+        self.sets: "OrderedDict[str, SoloSet]" = OrderedDict()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def set_for(self, key: str, set_id: Optional[int], words_json: Optional[str], problems: List[dict], order_type: str) -> SoloSet:
+        """同じ内容のセットはセッション間で1つを共有する（内容が変わっていれば作り直す）"""
+        with self._lock:
+            cached = self.sets.get(key)
+            if cached is not None and cached.words_json == words_json and cached.order_type == order_type:
+                self.sets.move_to_end(key)
+                return cached
+        solo_set = SoloSet(key, set_id, words_json, problems, order_type)
+        with self._lock:
+            self.sets[key] = solo_set
+            self.sets.move_to_end(key)
+            while len(self.sets) > SOLO_SET_CACHE:
+                self.sets.popitem(last=False)
+        return solo_set
+
+    def create(self, solo_set: SoloSet, seed: Optional[str] = None) -> str:
+        session_id = secrets.token_urlsafe(12)
+        session = SoloSession(solo_set, seed)
+        with self._lock:
+            self.sessions[session_id] = session
+            self.created += 1
+            self._evict(session.touched)
+        return session_id
+
+    def get(self, session_id: str) -> Optional[SoloSession]:
+        now = clock_now()
+        with self._lock:
+            self._evict(now)
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            session.touched = now
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def next_index(self, session: SoloSession) -> int:
+        with self._lock:
+            return session.next_index()
+
+    def record_miss(self, session: SoloSession, word_text: str) -> bool:
+        with self._lock:
+            return session.record_miss(word_text)
+
+    def _evict(self, now: float):
+        while self.sessions:
+            session_id, oldest = next(iter(self.sessions.items()))
+            if now - oldest.touched > SOLO_SESSION_TTL:
+                self.expired += 1
+            elif len(self.sessions) > SOLO_MAX_SESSIONS:
+                self.evicted += 1
+            else:
+                break
+            del self.sessions[session_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": len(self.sessions),
+                "sets": len(self.sets),
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "ttlSeconds": SOLO_SESSION_TTL,
+                "maxSessions": SOLO_MAX_SESSIONS,
+            }
+
+
+solo_sessions = SoloSessionStore()
@@ -0,0 +1,81 @@
+# backend/app/spaced_repetition.py
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+# SM-2 のパラメータ
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+# 正解 / 不正解をそれぞれ SM-2 の評価 (0〜5) に読み替える
+QUALITY_CORRECT = 4
+QUALITY_MISS = 1
+# 間違えた単語は少し時間を置いてから再出題する
+RELEARN_DELAY = timedelta(minutes=1)
+# 出題候補に毎回混ぜる、まだ答えたことのない単語の数（復習が溜まっていても新しい単語が出るように）
+NEW_WORDS_PER_BATCH = 3
+
+
+def update_schedule(db: Session, user_id: int, set_id: str, word_text: str, is_correct: bool,
+                    now: Optional[datetime] = None) -> models.WordSchedule:
+    """回答結果から次回の出題日時を更新する（commit は呼び出し側で行う）"""
+    now = now or datetime.utcnow()
+    schedule = db.query(models.WordSchedule).filter(
+        models.WordSchedule.user_id == user_id,
+        models.WordSchedule.set_id == set_id,
+        models.WordSchedule.word_text == word_text
+    ).first()
+
+    if not schedule:
+        schedule = models.WordSchedule(
+            user_id=user_id, set_id=set_id, word_text=word_text,
+            ease=INITIAL_EASE, interval_days=0.0, repetitions=0, due_at=now
+        )
+        db.add(schedule)
+
+    quality = QUALITY_CORRECT if is_correct else QUALITY_MISS
+    ease = schedule.ease + (0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    schedule.ease = max(MIN_EASE, ease)
+
+    if is_correct:
+        if schedule.repetitions == 0:
+            schedule.interval_days = 1.0
+        elif schedule.repetitions == 1:
+            schedule.interval_days = 6.0
+        else:
+            schedule.interval_days = schedule.interval_days * schedule.ease
+        schedule.repetitions += 1
+        schedule.due_at = now + timedelta(days=schedule.interval_days)
+    else:
+        schedule.repetitions = 0
+        schedule.interval_days = 0.0
+        schedule.due_at = now + RELEARN_DELAY
+
+    return schedule
+
+
+def due_words(db: Session, user_id: int, set_id: str, words: List[str], limit: int = 10,
+              new_limit: int = NEW_WORDS_PER_BATCH, now: Optional[datetime] = None) -> List[str]:
+    """
+    期限が来ている単語を期限の古い順に返し（ix_word_schedules_due の範囲スキャン）、
+    まだスケジュールの無い単語（一度も答えていない単語）を words の順に混ぜる。
+    復習が溜まっていても新しい単語を new_limit 語までは必ず入れ、復習が少なければその分も新しい単語で埋める。
+    """
+    now = now or datetime.utcnow()
+    scheduled = {
+        r[0] for r in db.query(models.WordSchedule.word_text).filter(
+            models.WordSchedule.user_id == user_id,
+            models.WordSchedule.set_id == set_id
+        )
+    }
+    new = [w for w in words if w not in scheduled]
+    rows = db.query(models.WordSchedule.word_text).filter(
+        models.WordSchedule.user_id == user_id,
+        models.WordSchedule.set_id == set_id,
+        models.WordSchedule.due_at <= now
+    ).order_by(models.WordSchedule.due_at).limit(limit).all()
+    due = [r[0] for r in rows]
+    new_count = min(len(new), max(new_limit, limit - len(due)))
+    return due[:limit - new_count] + new[:new_count]
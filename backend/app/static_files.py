@@ -0,0 +1,192 @@
+# backend/app/static_files.py
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from .compression import negotiate
+
+try:
+    import brotli
+except ImportError:  # brotli が無い環境では gzip のみ生成する
+    brotli = None
+
+# 既に圧縮済みの形式（再圧縮しても小さくならない）
+SKIP_COMPRESS_EXTENSIONS = {
+    ".mp3", ".ogg", ".mp4", ".png", ".jpg", ".jpeg", ".gif", ".webp",
+    ".woff", ".woff2", ".gz", ".br", ".zip",
+}
+MIN_COMPRESS_SIZE = 1024
+# 元サイズの 90% 以上にしかならない圧縮版は捨てる
+MIN_COMPRESS_RATIO = 0.9
+
+# Vite のビルド成果物 (assets/index-AbCd1234.js など) はファイル名にハッシュを含む
+HASHED_NAME_RE = re.compile(r"-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$")
+
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "public, max-age=86400, must-revalidate"
+CACHE_NO_CACHE = "no-cache"
+
+
+class StaticEntry:
+    """1ファイル分の配信情報（内容ハッシュと圧縮版のパス）"""
+
+    def __init__(self, rel_path: str, digest: str, variants: Dict[str, str]):
+        self.rel_path = rel_path
+        self.digest = digest
+        self.variants = variants  # {"br": path, "gzip": path}
+        # 圧縮対象かどうか（圧縮版の生成前から Vary を付けるため）
+        self.compressible = False
+        self.media_type = mimetypes.guess_type(rel_path)[0] or "application/octet-stream"
+
+        if rel_path.replace(os.sep, "/").startswith("assets/") and HASHED_NAME_RE.search(rel_path):
+            self.cache_control = CACHE_IMMUTABLE
+        elif rel_path.endswith(".html"):
+            self.cache_control = CACHE_NO_CACHE
+        else:
+            self.cache_control = CACHE_REVALIDATE
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    起動時に gzip / brotli 版を事前生成し、内容ハッシュの ETag と
+    Cache-Control を付けて配信する StaticFiles。
+    圧縮は起動を待たせないよう別スレッドで行い、出来上がるまでは無圧縮で返す。
+    Range リクエストは FileResponse がそのまま処理する（BGM のシーク用）。
+    """
+
+    def __init__(self, *, directory: str, html: bool = False, **kwargs):
+        super().__init__(directory=directory, html=html, **kwargs)
+        self.entries: Dict[str, StaticEntry] = {}
+        self.index_html: Optional[bytes] = None
+        self.index_entry: Optional[StaticEntry] = None
+        self.precompressed = threading.Event()
+        pending = self._scan(directory)
+        threading.Thread(target=self._precompress_all, args=(pending,), name="precompress", daemon=True).start()
+
+    def _scan(self, directory: str) -> List[str]:
+        """ハッシュだけ先に計算し、圧縮が必要なファイルの一覧を返す"""
+        pending = []
+        root = os.path.realpath(directory)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith((".gz", ".br")):
+                    continue
+                full_path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(full_path, root)
+                try:
+                    with open(full_path, "rb") as f:
+                        data = f.read()
+                except OSError:
+                    continue
+
+                digest = hashlib.sha256(data).hexdigest()[:16]
+                entry = StaticEntry(rel_path, digest, {})
+                entry.compressible = self._compressible(full_path, data)
+                self.entries[full_path] = entry
+                if entry.compressible:
+                    pending.append(full_path)
+
+                if rel_path == "index.html":
+                    # SPA のフォールバック用にメモリ上へ保持
+                    self.index_html = data
+                    self.index_entry = entry
+        return pending
+
+    def _precompress_all(self, pending: List[str]):
+        for full_path in pending:
+            try:
+                with open(full_path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            # 辞書ごと差し替えるので、配信中のリクエストが途中の状態を見ることはない
+            self.entries[full_path].variants = self._precompress(full_path, data)
+        self.precompressed.set()
+
+    @staticmethod
+    def _compressible(full_path: str, data: bytes) -> bool:
+        ext = os.path.splitext(full_path)[1].lower()
+        return ext not in SKIP_COMPRESS_EXTENSIONS and len(data) >= MIN_COMPRESS_SIZE
+
+    def _precompress(self, full_path: str, data: bytes) -> Dict[str, str]:
+        if not self._compressible(full_path, data):
+            return {}
+
+        encoders = [("gzip", ".gz", lambda b: gzip.compress(b, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            encoders.insert(0, ("br", ".br", lambda b: brotli.compress(b, quality=11)))
+
+        mtime = os.stat(full_path).st_mtime
+        variants = {}
+        for encoding, suffix, compress in encoders:
+            out_path = full_path + suffix
+            try:
+                # 既に最新の圧縮版があれば再生成しない
+                if os.path.exists(out_path) and os.stat(out_path).st_mtime >= mtime:
+                    if os.path.getsize(out_path) < len(data) * MIN_COMPRESS_RATIO:
+                        variants[encoding] = out_path
+                    continue
+                compressed = compress(data)
+                if len(compressed) >= len(data) * MIN_COMPRESS_RATIO:
+                    continue
+                with open(out_path, "wb") as f:
+                    f.write(compressed)
+                variants[encoding] = out_path
+            except OSError as e:
+                print(f"Precompression failed for {full_path}: {e}")
+        return variants
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        entry = self.entries.get(os.path.realpath(full_path))
+        if entry is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        encoding = None
+        serve_path = full_path
+        serve_stat = stat_result
+        variants = entry.variants
+        if variants:
+            # q=0 で拒否されたエンコーディングは、事前圧縮版があっても使わない
+            encoding = negotiate(
+                request_headers.get("accept-encoding", ""),
+                [candidate for candidate in ("br", "gzip") if candidate in variants]
+            )
+            if encoding:
+                serve_path = variants[encoding]
+                serve_stat = os.stat(serve_path)
+
+        headers = {"cache-control": entry.cache_control, "etag": entry.etag(encoding)}
+        if entry.compressible:
+            headers["vary"] = "Accept-Encoding"
+        if encoding:
+            headers["content-encoding"] = encoding
+
+        response = FileResponse(
+            serve_path,
+            status_code=status_code,
+            stat_result=serve_stat,
+            headers=headers,
+            media_type=entry.media_type,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def spa_index_response(self) -> Response:
+        """SPA フォールバック用の index.html（毎回ファイルを開かずメモリから返す）"""
+        headers = {"cache-control": CACHE_NO_CACHE}
+        if self.index_entry is not None:
+            headers["etag"] = self.index_entry.etag()
+        return Response(self.index_html or b"", media_type="text/html", headers=headers)
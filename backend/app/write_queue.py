@@ -0,0 +1,199 @@
+# backend/app/write_queue.py
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal, WriterSessionLocal
+from .db_routing import replica_router
+
+load_dotenv()
+
+# 1回の commit にまとめる書き込みの最大数
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "64"))
+
+
+class _Job:
+    __slots__ = ("fn", "writer", "future")
+
+    def __init__(self, fn: Callable[[Session], Any], writer: Optional[str]):
+        self.fn = fn
+        self.writer = writer
+        self.future: Future = Future()
+
+
+class DirectWriteError(RuntimeError):
+    pass
+
+
+class WriteQueue:
+    """
+    SQLite の書き込みを1本のスレッドに集め、溜まった分をまとめて1回で commit する（グループコミット）。
+    書き手が1つなので "database is locked" にならず、読み取りは WAL で並行して走る。
+
+    各書き込みは SAVEPOINT の中で実行するので、1件が例外を出しても同じバッチの他の書き込みは残る。
+    例外は run() の呼び出し元でそのまま投げ直す（HTTPException もそのまま返る）。
+    SQLITE_MODE=production でないとき（PostgreSQL など）は、呼び出し元のセッションでその場で実行する。
+
+    プライマリへの書き込みはすべてここを通す。書き込みスレッドが動いている間に SessionLocal の
+    セッションで直接書こうとすると DirectWriteError になる。例外は次のとおり:
+    - ジョブ DB（JobSessionLocal）は別のファイルなので対象外
+    - スキーマ作成・マイグレーション（migrate ジョブを含む）・検索索引の DDL はセッションを通らない。
+      トランザクションの外で走らせる必要があるものもあるので、キューには並べない
+    - 書き込みスレッドを持たないプロセス（run_jobs.py、rebuild_stats.py などの CLI）は、
+      run() がその場で短いトランザクションとして書く（サーバーの書き込みとは busy_timeout で待ち合う）
+    """
+
+    def __init__(self):
+        self.enabled = WriterSessionLocal is not None
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.batches = 0
+        self.failed_jobs = 0
+        self.failed_batches = 0
+        self.max_batch = 0
+        self.max_depth = 0
+        self.commit_seconds = 0.0
+
+    def run(self, db: Optional[Session], fn: Callable[[Session], Any]) -> Any:
+        """
+        fn(session) を書き込みとして実行し、commit 後にその戻り値を返す（ブロッキング）。
+        fn は DB の操作だけを行い、commit は呼ばないこと。戻り値の ORM オブジェクトは
+        commit 後も属性を読めるが、別セッションのものなので db には混ぜないこと。
+        リクエストの外（スレッドやジョブ）からは db=None で呼べる。
+        """
+        if not self.enabled or self._thread is None:
+            return self._run_inline(db, fn)
+        job = _Job(fn, db.info.get("writer") if db is not None else None)
+        self._queue.put(job)
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return job.future.result()
+
+    def _run_inline(self, db: Optional[Session], fn: Callable[[Session], Any]) -> Any:
+        own = db is None
+        if own:
+            db = SessionLocal(expire_on_commit=False)
+        try:
+            result = fn(db)
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            if own:
+                db.close()
+
+    def check_direct_write(self):
+        if self._thread is not None:
+            raise DirectWriteError("Writes to the primary database must go through write_queue.run()")
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """受け付け済みの書き込みを書き終えてから止める"""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            batch = [job]
+            stopping = False
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch: List[_Job]):
+        started = time.perf_counter()
+        done = []
+        db = WriterSessionLocal()
+        try:
+            for job in batch:
+                try:
+                    with db.begin_nested():
+                        result = job.fn(db)
+                except Exception as e:
+                    job.future.set_exception(e)
+                    continue
+                done.append((job, result))
+            db.commit()
+        except Exception as e:
+            # commit 自体の失敗（ディスクなど）はバッチ全体の失敗
+            print(f"⚠️ Write batch of {len(batch)} failed: {e}")
+            db.rollback()
+            with self._lock:
+                self.failed_batches += 1
+            for job, _ in done:
+                job.future.set_exception(e)
+            done = []
+        finally:
+            db.close()
+
+        for job, result in done:
+            replica_router.note_write(job.writer)
+            job.future.set_result(result)
+        with self._lock:
+            self.jobs += len(batch)
+            self.batches += 1
+            self.failed_jobs += len(batch) - len(done)
+            self.max_batch = max(self.max_batch, len(batch))
+            self.commit_seconds += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "running": self._thread is not None,
+                "queued": self._queue.qsize(),
+                "jobs": self.jobs,
+                "batches": self.batches,
+                "avgBatch": round(self.jobs / self.batches, 2) if self.batches else None,
+                "maxBatch": self.max_batch,
+                "maxDepth": self.max_depth,
+                "failedJobs": self.failed_jobs,
+                "failedBatches": self.failed_batches,
+                "avgBatchMs": round(self.commit_seconds * 1000 / self.batches, 3) if self.batches else None,
+            }
+
+
+write_queue = WriteQueue()
+
+
+# 書き込みスレッドが動いている間は、プライマリのセッションで直接書かせない
+@event.listens_for(SessionLocal, "before_flush")
+def _reject_direct_flush(session, flush_context, instances):
+    write_queue.check_direct_write()
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _reject_direct_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        write_queue.check_direct_write()
@@ -0,0 +1,19 @@
+# backend/app/ws_protocol.py
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+
+from .compression import frame_compression
+
+
+class RoomDeflateWebSocketProtocol(WebSocketProtocol):
+    """
+    uvicorn の websockets 実装に、ルーム単位の permessage-deflate を足したもの。
+    既定の実装は全接続に標準設定の deflate を提案するが、こちらは
+    圧縮を希望したルームにだけ、短いフレーム向けに調整した設定で提案する。
+
+    起動は backend/serve.py（この実装を指定し、uvicorn 既定の deflate を切って起動する）。
+    """
+
+    async def process_request(self, path, request_headers):
+        # handshake() はこのリストを参照して交渉するので、中身を差し替える
+        self.available_extensions[:] = frame_compression.extensions_for(path)
+        return await super().process_request(path, request_headers)
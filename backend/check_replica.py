@@ -0,0 +1,87 @@
+# backend/check_replica.py
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# プライマリとレプリカを一時ディレクトリの SQLite ファイル2つで用意する。
+# 「レプリケーション」は SQLite のバックアップ API でファイルを写すことで代用する
+WORK_DIR = tempfile.mkdtemp(prefix="replica-check-")
+PRIMARY_PATH = os.path.join(WORK_DIR, "primary.db")
+REPLICA_PATH = os.path.join(WORK_DIR, "replica.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{PRIMARY_PATH}"
+os.environ["REPLICA_DATABASE_URL"] = f"sqlite:///{REPLICA_PATH}"
+os.environ.setdefault("JOBS_DATABASE_URL", f"sqlite:///{os.path.join(WORK_DIR, 'jobs.db')}")
+os.environ.setdefault("REPLICA_CHECK_INTERVAL", "0.1")
+os.environ.setdefault("REPLICA_MAX_LAG_SECONDS", "1")
+os.environ.setdefault("MATCH_LOG_ENABLED", "0")
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.db_routing import replica_router, REPLICA_CHECK_INTERVAL, REPLICA_MAX_LAG_SECONDS
+
+def replicate():
+    # 直前の書き込みより新しいハートビートが入ってから写す（本物のレプリカは流し続けるので同じこと）
+    time.sleep(REPLICA_CHECK_INTERVAL * 2)
+    src = sqlite3.connect(PRIMARY_PATH)
+    dst = sqlite3.connect(REPLICA_PATH)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+    # 写した時点のハートビートが読まれるまで待つ
+    time.sleep(REPLICA_CHECK_INTERVAL * 3)
+
+def reads(reason: str) -> int:
+    return replica_router.reads[reason]
+
+def expect(label: str, ok: bool) -> bool:
+    print(f"{'✅' if ok else '❌'} {label}")
+    return ok
+
+def run() -> bool:
+    results = []
+    with TestClient(app) as client:
+        client.post("/api/register", json={"username": "replica-check", "password": "password"})
+        token = client.post("/token", data={"username": "replica-check", "password": "password"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        replicate()
+        results.append(expect("replica is healthy after the first copy", replica_router.healthy))
+
+        before = reads("replica")
+        client.get("/api/sets", headers=headers)
+        results.append(expect("reads go to the replica when it is caught up", reads("replica") == before + 1))
+
+        created = client.post("/api/my-sets", headers=headers, json={"title": "replica check", "words": [{"text": "a"}]}).json()
+        before = reads("sticky")
+        mine = client.get("/api/my-sets", headers=headers).json()
+        results.append(expect(
+            "the writer reads from the primary and sees the new set",
+            reads("sticky") == before + 1 and any(s["id"] == created["id"] for s in mine)
+        ))
+
+        replicate()
+        before = reads("replica")
+        mine = client.get("/api/my-sets", headers=headers).json()
+        results.append(expect(
+            "once the write is replicated the writer is back on the replica",
+            reads("replica") == before + 1 and any(s["id"] == created["id"] for s in mine)
+        ))
+
+        # 写すのをやめると遅れが増え、許容値を超えたらプライマリに戻る
+        time.sleep(REPLICA_MAX_LAG_SECONDS + REPLICA_CHECK_INTERVAL * 3)
+        before = reads("lagging")
+        client.get("/api/sets", headers=headers)
+        results.append(expect(f"reads fall back to the primary when lag exceeds {REPLICA_MAX_LAG_SECONDS}s", reads("lagging") == before + 1))
+
+        print(f"Router stats: {replica_router.stats()}")
+    return all(results)
+
+if __name__ == "__main__":
+    ok = run()
+    print("🎉 Read/write routing works." if ok else "❌ Read/write routing check failed.")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,66 @@
+# backend/check_startup.py
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 起動してから最初のリクエストに応答するまでの許容時間（秒）
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "5"))
+IMPORT_REPORT_TOP = 15
+
+def import_report():
+    """python -X importtime の結果から、累積時間の大きいモジュールを表示する"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if m:
+            rows.append((int(m.group(2)), int(m.group(1)), len(m.group(3)) // 2, m.group(4)))
+    total = max((r[0] for r in rows), default=0)
+    print(f"Import time of app.main: {total / 1000:.0f}ms")
+    # 直接 import しているもの（深さ 1 まで）を累積時間順に
+    for cumulative, self_time, depth, name in sorted((r for r in rows if r[2] <= 1), reverse=True)[:IMPORT_REPORT_TOP]:
+        print(f"  {cumulative / 1000:8.1f}ms  (self {self_time / 1000:6.1f}ms)  {name}")
+
+def time_to_first_request() -> float:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    started = time.monotonic()
+    # 本番と同じ起動スクリプト（serve.py）で測る
+    server = subprocess.Popen(
+        [sys.executable, "serve.py"],
+        env={**os.environ, "HOST": "127.0.0.1", "PORT": str(port), "WEB_CONCURRENCY": "1"},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        deadline = started + max(STARTUP_BUDGET_SECONDS * 4, 30)
+        while time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/rooms", timeout=1) as res:
+                    if res.status == 200:
+                        return time.monotonic() - started
+            except OSError:
+                time.sleep(0.05)
+        return float("inf")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+if __name__ == "__main__":
+    import_report()
+    elapsed = time_to_first_request()
+    print(f"Time to first request: {elapsed:.2f}s (budget {STARTUP_BUDGET_SECONDS:.2f}s)")
+    if elapsed > STARTUP_BUDGET_SECONDS:
+        print("❌ Startup is over budget.")
+        sys.exit(1)
+    print("🎉 Startup is within budget.")
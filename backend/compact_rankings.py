@@ -0,0 +1,27 @@
+# backend/compact_rankings.py
+import sys
+from dotenv import load_dotenv
+from app import models
+from app.database import engine, SessionLocal
+from app.leaderboard import rebuild_bests, compact_rankings, RANKING_RETENTION_DAYS
+
+load_dotenv()
+
+def compact(retention_days: int = RANKING_RETENTION_DAYS):
+    print("Compacting rankings...")
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        # 先に自己ベストを作り直し、ベストとして参照されている行は必ず残す
+        players = rebuild_bests(db)
+        print(f"Rebuilt personal bests for {players} players.")
+        deleted = compact_rankings(db, retention_days)
+        print(f"🎉 Deleted {deleted} non-best rows older than {retention_days} days.")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Compaction failed: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    compact(int(sys.argv[1]) if len(sys.argv) > 1 else RANKING_RETENTION_DAYS)
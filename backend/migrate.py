@@ -0,0 +1,31 @@
+# backend/migrate.py
+import sys
+from dotenv import load_dotenv
+from app.database import engine
+from app.migrations import MIGRATIONS, applied_versions, run_migrations
+
+load_dotenv()
+
+def status():
+    done = applied_versions(engine)
+    for migration in MIGRATIONS:
+        mark = "✅" if migration.version in done else "⏳"
+        print(f"{mark} {migration.version:4d}  {migration.description}")
+
+def migrate(target=None):
+    print("Connecting to database to migrate...")
+    try:
+        applied = run_migrations(engine, target)
+        if applied:
+            print(f"🎉 Applied migrations: {', '.join(map(str, applied))}")
+        else:
+            print("🎉 Database is up to date.")
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        status()
+    else:
+        migrate(int(sys.argv[1]) if len(sys.argv) > 1 else None)
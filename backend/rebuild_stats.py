@@ -0,0 +1,23 @@
+# backend/rebuild_stats.py
+from dotenv import load_dotenv
+from app import models
+from app.database import engine, SessionLocal
+from app.player_stats import rebuild_all
+
+load_dotenv()
+
+def rebuild():
+    print("Rebuilding player stats rollups...")
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        count = rebuild_all(db)
+        print(f"🎉 Rebuilt stats for {count} users.")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Rebuild failed: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild()
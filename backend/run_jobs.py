@@ -0,0 +1,47 @@
+# backend/run_jobs.py
+import json
+import signal
+import sys
+import threading
+from dotenv import load_dotenv
+from app import job_tasks  # ジョブの種類を登録する
+from app.jobs import job_runner, JOB_WORKERS
+
+load_dotenv()
+
+def work(workers: int = JOB_WORKERS):
+    """アプリとは別のプロセスでジョブを実行する（アプリ側は JOBS_IN_PROCESS=0 にする）"""
+    print(f"Starting {workers} job worker(s) for: {', '.join(sorted(job_runner.tasks))}")
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    job_runner.start(workers)
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    print("Stopping job workers (waiting for running jobs)...")
+    job_runner.stop(timeout=60)
+    print("🎉 Job workers stopped.")
+
+def enqueue(kind: str, payload: str = "{}", key: str = None):
+    try:
+        job_id = job_runner.enqueue(kind, json.loads(payload), key)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"🎉 Enqueued job {job_id} ({kind}).")
+
+def status():
+    for job in reversed(job_runner.list(limit=20)):
+        mark = {"done": "✅", "failed": "❌", "running": "🏃"}.get(job["status"], "⏳")
+        detail = job["error"] if job["status"] == "failed" else (job["message"] or "")
+        print(f"{mark} {job['id']:5d}  {job['kind']:20s} {job['progress'] * 100:5.1f}%  "
+              f"attempt {job['attempts']}/{job['maxAttempts']}  {detail}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "enqueue":
+        enqueue(*sys.argv[2:5])
+    elif len(sys.argv) > 1 and sys.argv[1] == "status":
+        status()
+    else:
+        work(int(sys.argv[1]) if len(sys.argv) > 1 else JOB_WORKERS)
@@ -0,0 +1,28 @@
+# backend/serve.py
+import os
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+def serve():
+    """
+    アプリの起動（uvicorn app.main:app の代わりにこれを使う）。
+    WebSocket はルーム単位の permessage-deflate を交渉する RoomDeflateWebSocketProtocol で受け、
+    uvicorn 既定の「全接続に deflate を提案する」設定は切っておく。
+    """
+    uvicorn.run(
+        "app.main:app",
+        host=HOST,
+        port=PORT,
+        workers=WEB_CONCURRENCY,
+        ws="app.ws_protocol:RoomDeflateWebSocketProtocol",
+        ws_per_message_deflate=False,
+    )
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,398 @@
+# backend/simulate_battles.py
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# 対戦ログのファイル書き込みはシミュレーションの計測対象外（有効にしたい場合は環境変数で上書き）
+os.environ.setdefault("MATCH_LOG_ENABLED", "0")
+
+from fastapi import WebSocketDisconnect
+from starlette.websockets import WebSocketState
+
+from app import main
+from app.clock import VirtualTimeLoop
+from app.manager import manager
+from app.match_log import match_recorder
+from app.rate_limit import ws_guard
+
+SIM_SEED = os.getenv("SIM_SEED", "0")
+# 1試合がこの仮想時間（秒）で終わらなければ進行が止まったとみなす
+GAME_TIMEOUT = 3600
+# スクリプトの振る舞い
+ACCURACY = 0.7          # 1回の回答が正解になる確率
+THINK_TIME = (0.3, 4.0)  # 回答までの時間（仮想秒）
+REMATCH_RATE = 0.2      # 試合後に再戦する確率
+ABANDON_RATE = 0.05     # 試合の途中で1人が抜ける確率（残りも OPPONENT_LEFT で抜ける）
+RECONNECT_RATE = 0.05   # 3人以上のルームで、ラウンド開始時に切断→再接続する確率
+MAX_PLAYERS = 4
+BATCH_RATE = 0.5        # ブロードキャストのまとめ送りを有効にしたルームの割合
+
+
+class SimSocket:
+    """websocket_endpoint にそのまま渡せる、メモリ上だけの WebSocket"""
+
+    def __init__(self, player: "SimPlayer"):
+        self.player = player
+        self.client_state = WebSocketState.CONNECTED
+        self.application_state = WebSocketState.CONNECTED
+        self.inbox: asyncio.Queue = asyncio.Queue()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        if self.application_state != WebSocketState.CONNECTED:
+            raise RuntimeError('Cannot call "send" once a close message has been sent.')
+        self.player.on_message(self, message)
+
+    async def send(self, message: dict):
+        pass
+
+    async def receive_text(self) -> str:
+        message = await self.inbox.get()
+        if message is None:
+            raise WebSocketDisconnect(1000)
+        return message
+
+    async def close(self, code: int = 1000):
+        self.client_state = WebSocketState.DISCONNECTED
+        self.application_state = WebSocketState.DISCONNECTED
+        self.inbox.put_nowait(None)
+        self.player.on_close(self, code)
+
+
+class SimPlayer:
+    """BattleMode.tsx と同じ手順で振る舞う、スクリプトで動くプレイヤー"""
+
+    def __init__(self, game: "SimGame", player_id: str):
+        self.game = game
+        self.player_id = player_id
+        self.rng = game.rng
+        self.ws: Optional[SimSocket] = None
+        self.endpoint: Optional[asyncio.Task] = None
+        self.last_seq = 0
+        self.round = 0
+        self.answered_round = 0
+        self.over = False
+        self.left = False
+
+    # --- 接続 ---
+
+    def connect(self, resume: int = 0):
+        self.ws = SimSocket(self)
+        self.endpoint = asyncio.create_task(main.websocket_endpoint(
+            self.ws, self.game.room_id, self.player_id, resume=resume, batch=1
+        ))
+        self.send(f"NAME:{self.player_id}")
+        # 再接続の場合は、まだ答えていないラウンドに答え直す
+        self.later(self.rng.uniform(*THINK_TIME), self.answer)
+
+    def drop(self):
+        if self.ws is not None:
+            self.ws.inbox.put_nowait(None)
+            self.ws.client_state = WebSocketState.DISCONNECTED
+            self.ws = None
+
+    def leave(self):
+        if self.left:
+            return
+        self.left = True
+        self.drop()
+        self.game.player_left()
+
+    def send(self, command: str):
+        if self.ws is not None:
+            self.ws.inbox.put_nowait(f"{self.player_id}:{command}")
+
+    def later(self, delay: float, callback, *args):
+        asyncio.get_running_loop().call_later(delay, callback, *args)
+
+    # --- 受信 ---
+
+    def on_message(self, ws: SimSocket, raw: str):
+        if ws is not self.ws:
+            return
+        if raw.startswith("BATCH:"):
+            for item in json.loads(raw[len("BATCH:"):]):
+                self.on_message(ws, item)
+            return
+        seq = None
+        message = raw
+        if raw.startswith("SEQ:"):
+            _, number, message = raw.split(":", 2)
+            seq = int(number)
+            self.last_seq = seq
+            self.game.observe(seq, message)
+
+        if message.startswith("SERVER:SYNC:"):
+            payload = json.loads(message[len("SERVER:SYNC:"):])
+            self.last_seq = payload["seq"]
+            if payload["currentRound"] > 0:
+                self.start_round(payload["currentRound"], payload["standings"])
+        elif message == "SERVER:MATCHED":
+            self.over = False
+            self.round = 0
+            self.answered_round = 0
+        elif message.startswith("SERVER:NEXT_ROUND:"):
+            payload = json.loads(message[len("SERVER:NEXT_ROUND:"):])
+            self.start_round(payload["round"], payload.get("standings", []))
+        elif message == "SERVER:OPPONENT_LEFT" and self.game.abandoned:
+            self.later(self.rng.uniform(*THINK_TIME), self.leave)
+
+    def on_close(self, ws: SimSocket, code: int):
+        # サーバーから切られたら（ルームが消えた・満員）クライアントと同じく戻らない
+        if ws is self.ws:
+            self.ws = None
+            self.leave()
+
+    def start_round(self, round_no: int, standings: List[List]):
+        if round_no <= self.round or self.over or self.left:
+            return
+        self.round = round_no
+        room = self.game.room
+        if room.conditionType == "score":
+            finished = any(score >= room.winScore for _, score in standings)
+        else:
+            finished = round_no > room.winScore
+        if finished:
+            self.over = True
+            self.later(self.rng.uniform(*THINK_TIME), self.after_match)
+            return
+
+        if self.game.should_abandon():
+            self.later(self.rng.uniform(*THINK_TIME), self.leave)
+            return
+        if self.game.can_drop() and self.rng.random() < RECONNECT_RATE:
+            self.game.dropped += 1
+            self.drop()
+            self.later(self.rng.uniform(*THINK_TIME), self.reconnect)
+            return
+        self.later(self.rng.uniform(*THINK_TIME), self.answer)
+
+    def reconnect(self):
+        if self.left:
+            return
+        # 抜けている間に誰かが試合を放棄していたら、そのまま抜ける
+        if self.game.abandoned:
+            self.game.dropped -= 1
+            self.leave()
+            return
+        self.game.dropped -= 1
+        self.game.reconnects += 1
+        self.connect(resume=self.last_seq)
+
+    def answer(self):
+        round_no = self.round
+        if self.ws is None or self.over or round_no == 0 or self.answered_round >= round_no:
+            return
+        self.answered_round = round_no
+        command = "SCORE_UP" if self.rng.random() < ACCURACY else "MISS"
+        self.send(f"{command}:round{round_no}")
+
+    def after_match(self):
+        if self.left:
+            return
+        if self.game.rematch():
+            self.send("RETRY")
+        else:
+            self.leave()
+
+
+class SimGame:
+    """1ルーム分の試合。全員の受信を連番でまとめ、終了後に整合性を確かめる"""
+
+    def __init__(self, number: int):
+        self.rng = random.Random(f"{SIM_SEED}-{number}")
+        self.room_id = f"sim-{number}"
+        players = self.rng.randint(2, MAX_PLAYERS)
+        result = main.create_room(main.CreateRoomRequest(
+            name=self.room_id, hostName="sim", winScore=self.rng.choice([3, 5, 10]),
+            memorySetId="sim", conditionType=self.rng.choice(["score", "total"]),
+            capacity=players, batchFrames=self.rng.random() < BATCH_RATE
+        ), None, None)
+        self.room = result["room"]
+        self.players = [SimPlayer(self, f"{self.room_id}-p{i}") for i in range(players)]
+        self.events: Dict[int, str] = {}
+        self.remaining = players
+        self.done = asyncio.get_running_loop().create_future()
+        self.rematches = 1 if self.rng.random() < REMATCH_RATE else 0
+        self.rematch_decisions: Dict[int, bool] = {}
+        self.matched = 0
+        self.abandoned = False
+        self.reconnects = 0
+        self.dropped = 0
+        self.errors: List[str] = []
+        self.rounds = 0
+
+    def start(self):
+        for player in self.players:
+            player.later(self.rng.uniform(0, 1), player.connect)
+
+    def observe(self, seq: int, message: str):
+        if seq not in self.events:
+            self.events[seq] = message
+            if message == "SERVER:MATCHED":
+                self.matched += 1
+
+    def should_abandon(self) -> bool:
+        if self.abandoned or self.rng.random() >= ABANDON_RATE / len(self.players):
+            return False
+        self.abandoned = True
+        return True
+
+    def can_drop(self) -> bool:
+        """
+        接続中が1人になるとルームは waiting に戻り、再接続しても試合は再開しない
+        （2人対戦で相手が落ちたときと同じ扱い）。同時に切断するのは1人までにして、2人以上を残す
+        """
+        return not self.abandoned and self.dropped == 0 and self.remaining >= 3
+
+    def rematch(self) -> bool:
+        # 全員が同じ判断をするよう、試合ごとに最初に聞かれた時点で決める
+        if self.matched not in self.rematch_decisions:
+            self.rematch_decisions[self.matched] = self.rematches > 0
+            self.rematches = max(0, self.rematches - 1)
+        return self.rematch_decisions[self.matched]
+
+    def player_left(self):
+        self.remaining -= 1
+        if self.remaining == 0 and not self.done.done():
+            self.done.set_result(None)
+
+    def verify(self):
+        """連番の抜け・同じラウンドの二重得点・順位表とスコアの食い違いを調べる"""
+        if not self.events:
+            self.errors.append("no events observed")
+            return
+        last = max(self.events)
+        missing = [s for s in range(1, last + 1) if s not in self.events]
+        if missing:
+            self.errors.append(f"missing seq {missing[:5]}")
+
+        tallies: Counter = Counter()
+        scored = set()
+        current_round = 0
+        for seq in sorted(self.events):
+            message = self.events[seq]
+            if message == "SERVER:MATCHED":
+                tallies.clear()
+                scored.clear()
+                current_round = 0
+            elif message.startswith("SERVER:NEXT_ROUND:"):
+                payload = json.loads(message[len("SERVER:NEXT_ROUND:"):])
+                if payload["round"] != current_round + 1:
+                    self.errors.append(f"seq {seq}: round {payload['round']} after {current_round}")
+                current_round = payload["round"]
+                self.rounds += 1
+                standings = {pid: score for pid, score in payload.get("standings", [])}
+                if any(standings.get(pid, 0) != n for pid, n in tallies.items()) or \
+                        any(score != tallies.get(pid, 0) for pid, score in standings.items()):
+                    self.errors.append(f"seq {seq}: standings {standings} != scored {dict(tallies)}")
+            else:
+                parts = message.split(":")
+                if len(parts) == 3 and parts[1] == "SCORE_UP":
+                    round_no = int(parts[2].replace("round", ""))
+                    if round_no in scored:
+                        self.errors.append(f"seq {seq}: round {round_no} scored twice")
+                    scored.add(round_no)
+                    tallies[parts[0]] += 1
+
+
+def leaked_state() -> Dict[str, int]:
+    """全試合の後片付けが終わった時点で残っていてはいけないもの"""
+    containers = {
+        "active_rooms": main.active_rooms,
+        "room_passwords": main.room_passwords,
+        "room_owner_tokens": main.room_owner_tokens,
+        "room_clients": main.room_clients,
+        "room_rounds": main.room_rounds,
+        "room_retry_players": main.room_retry_players,
+        "room_player_names": main.room_player_names,
+        "room_player_users": main.room_player_users,
+        "room_standings": main.room_standings,
+        "player_websockets": main.player_websockets,
+        "manager.active_connections": manager.active_connections,
+        "manager.event_logs": manager.event_logs,
+        "manager.sequenced": manager.sequenced,
+        "manager.catching_up": manager.catching_up,
+        "manager.batchers": manager.batchers,
+        "manager.spectators": manager.spectators,
+        "manager.cleanup_tasks": manager.cleanup_tasks,
+        "ws_guard.player_buckets": ws_guard.player_buckets,
+        "ws_guard.room_buckets": ws_guard.room_buckets,
+        "match_recorder.open_matches": match_recorder.open_matches,
+    }
+    return {name: len(c) for name, c in containers.items() if len(c)}
+
+
+async def play(number: int, slots: asyncio.Semaphore, games: List[SimGame]):
+    async with slots:
+        game = SimGame(number)
+        games.append(game)
+        game.start()
+        try:
+            await asyncio.wait_for(asyncio.shield(game.done), GAME_TIMEOUT)
+        except asyncio.TimeoutError:
+            game.errors.append(f"stalled at round {game.room.currentRound} (status {game.room.status})")
+            for player in game.players:
+                player.leave()
+        await asyncio.gather(*(p.endpoint for p in game.players if p.endpoint), return_exceptions=True)
+        game.verify()
+
+
+async def simulate(count: int, concurrency: int) -> List[SimGame]:
+    slots = asyncio.Semaphore(concurrency)
+    games: List[SimGame] = []
+    await asyncio.gather(*(play(i, slots, games) for i in range(count)))
+    # 最後の試合の遅延クリーンアップが終わるまで仮想時間を進める
+    await asyncio.sleep(5)
+    return games
+
+
+def run(count: int, concurrency: int) -> bool:
+    print(f"Simulating {count} battles ({concurrency} rooms at a time, virtual clock)...")
+    loop = VirtualTimeLoop()
+    started_wall = time.perf_counter()
+    started_cpu = time.process_time()
+    try:
+        games = loop.run_until_complete(simulate(count, concurrency))
+        virtual_seconds = loop.time()
+    finally:
+        loop.close()
+    wall = time.perf_counter() - started_wall
+    cpu = time.process_time() - started_cpu
+
+    matches = sum(g.matched for g in games)
+    rounds = sum(g.rounds for g in games)
+    messages = sum(len(g.events) for g in games)
+    print(f"  matches {matches}, rounds {rounds}, broadcasts {messages}, reconnects {sum(g.reconnects for g in games)}")
+    batching = manager.batch_stats()
+    print(f"  batched messages {batching['messages']} in {batching['frames']} frames ({batching['messagesPerFrame']} per frame)")
+    print(f"  virtual time {virtual_seconds:.0f}s, wall {wall:.2f}s ({count / wall:.0f} games/s)")
+    print(f"  CPU {cpu * 1000 / count:.3f}ms per game, {cpu * 1e6 / max(1, messages):.1f}µs per broadcast")
+
+    failed = [g for g in games if g.errors]
+    for game in failed[:10]:
+        print(f"❌ {game.room_id}: {'; '.join(game.errors[:3])}")
+    leaks = leaked_state()
+    if leaks:
+        print(f"❌ Leaked state after cleanup: {leaks}")
+    if failed or leaks:
+        print(f"❌ {len(failed)} of {count} games broke an invariant.")
+        return False
+    print("🎉 All invariants held.")
+    return True
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    sys.exit(0 if run(count, concurrency) else 1)
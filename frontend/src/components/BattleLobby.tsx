@@ -215,7 +215,11 @@ export default function BattleLobby() {
       password: newRoomPass,
       winScore: winCondition,
       memorySetId: selectedSetId,
-      conditionType: conditionType
+      conditionType: conditionType,
+      // 画面の小さい端末（モバイル回線が多い）ではフレーム圧縮を希望する
+      compressFrames: window.innerWidth < 768,
+      // 試合開始時などに続けて届くメッセージを、短い時間窓で1フレームにまとめて受け取る
+      batchFrames: true
     };
     
     try {
@@ -104,6 +104,8 @@ function BattleMode() {
   const socketRef = useRef<WebSocket | null>(null);
   const roundNumberRef = useRef(0); 
   const retryRequestedRef = useRef(false);
+  // サーバーから最後に受け取ったブロードキャストの連番（再接続時に差分だけ受け取るため）
+  const lastSeqRef = useRef(0);
 
   // ★ 追加: Battleの状態に応じてBGMシーン/停止を更新
   useEffect(() => {
@@ -154,14 +156,18 @@ function BattleMode() {
     let ws: WebSocket | null = null;
     let isMounted = true;
     let reconnectTimeout: any = null;
+    lastSeqRef.current = 0;
 
     const joinRoom = () => {
       if (!isMounted) return;
       const API_BASE = import.meta.env.VITE_API_URL || "http://127.0.0.1:8000";
       const WS_BASE = API_BASE.replace(/^http/, 'ws');
-      const setParam = memorySetId ? `?setName=${memorySetId}` : "";
+      const setParam = memorySetId ? `setName=${memorySetId}&` : "";
+      // ログイン中なら戦績に反映するためトークンも渡す
+      const token = getToken();
+      const tokenParam = token ? `&token=${encodeURIComponent(token)}` : "";
       
-      ws = new WebSocket(`${WS_BASE}/ws/battle/${roomId}/${playerId}${setParam}`);
+      ws = new WebSocket(`${WS_BASE}/ws/battle/${roomId}/${playerId}?${setParam}resume=${lastSeqRef.current}&batch=1${tokenParam}`);
       socketRef.current = ws;
       
       ws.onopen = () => { 
@@ -171,15 +177,24 @@ function BattleMode() {
         if (retryRequestedRef.current) wsSend("RETRY");
       };
 
-      ws.onmessage = (event) => {
-        if (!isMounted) return;
-        const msg = event.data as string;
+      const handleMessage = (raw: string) => {
+        let msg = raw;
+
+        // 連番付きフレーム (SEQ:<n>:<message>)。受信済みの連番は読み飛ばす
+        if (msg.startsWith("SEQ:")) {
+          const sep = msg.indexOf(":", 4);
+          const seq = Number(msg.substring(4, sep));
+          if (seq <= lastSeqRef.current) return;
+          lastSeqRef.current = seq;
+          msg = msg.substring(sep + 1);
+        }
         
         if (msg.startsWith("SERVER:")) {
           const command = msg.substring(7);
           if (command.startsWith("SYNC:")) {
             try {
               const syncData = JSON.parse(command.substring(5));
+              if (typeof syncData.seq === 'number') lastSeqRef.current = syncData.seq;
               if (syncData.names) {
                 const rivalId = Object.keys(syncData.names).find(id => id !== playerId);
                 if (rivalId) {
@@ -259,6 +274,19 @@ function BattleMode() {
         }
       };
 
+      ws.onmessage = (event) => {
+        if (!isMounted) return;
+        const data = event.data as string;
+        // まとめ送りのフレーム (BATCH:<メッセージの配列>) は1件ずつ順番に処理する
+        if (data.startsWith("BATCH:")) {
+          try {
+            (JSON.parse(data.substring(6)) as string[]).forEach(handleMessage);
+          } catch (e) {}
+          return;
+        }
+        handleMessage(data);
+      };
+
       ws.onclose = (event) => { 
         if (!isMounted) return;
         setIsConnected(false);
@@ -270,6 +298,13 @@ function BattleMode() {
           return;
         }
 
+        // 満員のルームには入れない
+        if (event.code === 4001) {
+          alert("ルームが満員です。");
+          navigate('/lobby');
+          return;
+        }
+
         // それ以外の切断（ネットワークエラー等）は再接続
         reconnectTimeout = setTimeout(joinRoom, 1500);
       };
@@ -290,7 +325,7 @@ function BattleMode() {
 
   const recordStat = async (wordText: string, isCorrect: boolean) => {
     if (!getToken()) return;
-    try { await authFetch(`/api/word_stats?word_text=${encodeURIComponent(wordText)}&is_correct=${isCorrect}`, { method: 'POST' }); } catch (e) {}
+    try { await authFetch(`/api/word_stats?word_text=${encodeURIComponent(wordText)}&is_correct=${isCorrect}&set_id=${encodeURIComponent(memorySetId || 'default')}`, { method: 'POST' }); } catch (e) {}
   };
 
   useEffect(() => {
@@ -2,6 +2,8 @@
 import { useState, useEffect, useRef, useCallback } from 'react';
 import type { GameSettings, Problem } from '../types';
 import { useSound } from '../hooks/useSound';
+import { getToken } from '../utils/auth';
+import { loadBundle, canPlayLocally, pickProblem, type SetBundle } from '../utils/bundles';
 
 const API_BASE = import.meta.env.VITE_API_URL || "http://127.0.0.1:8000";
 
@@ -22,6 +24,7 @@ type Props = {
   settings?: GameSettings; 
   wrongHistory?: string[];
   totalAttempted?: number;
+  soloSessionId?: string | null;
   isLocked?: boolean; 
 };
 
@@ -31,7 +34,7 @@ type GameState = 'memorize' | 'quiz' | 'waiting' | 'loading';
 
 function GameMobile({ 
   onScore, onWrong, resetKey, roomId, setId, seed, settings, 
-  wrongHistory, totalAttempted, isLocked 
+  wrongHistory, totalAttempted, soloSessionId, isLocked, isSoloMode 
 }: Props) {
 
   const { playSE } = useSound();
@@ -58,11 +61,56 @@ function GameMobile({
 
   useEffect(() => { totalAttemptedRef.current = totalAttempted; }, [totalAttempted]);
   useEffect(() => { wrongHistoryRef.current = wrongHistory; }, [wrongHistory]);
+  const soloSessionRef = useRef(soloSessionId);
+  useEffect(() => { soloSessionRef.current = soloSessionId; }, [soloSessionId]);
 
   useEffect(() => {
     isProcessing.current = true;
   }, [resetKey]);
 
+  // ソロプレイではセットのバンドルを読み込み、出題をサーバーに問い合わせずに行う
+  const bundleRef = useRef<SetBundle | null>(null);
+  const saltRef = useRef(Math.floor(Math.random() * 0xffffffff));
+  useEffect(() => {
+    bundleRef.current = null;
+    if (!isSoloMode || !setId) return;
+    let cancelled = false;
+    loadBundle(setId).then(b => { if (!cancelled) bundleRef.current = b; });
+    return () => { cancelled = true; };
+  }, [isSoloMode, setId]);
+
+  const fetchProblem = useCallback(async (i: number): Promise<ApiResponse> => {
+      const sessionId = soloSessionRef.current;
+      const params = new URLSearchParams();
+      if (sessionId) {
+          // 出題番号と間違えた単語はサーバーのソロセッションが持っている
+          params.append("session_id", sessionId);
+      } else {
+          if (roomId) params.append("room_id", roomId);
+          if (setId) params.append("set_id", setId);
+          if (seed) params.append("seed", `${seed}-${i}`);
+          if (wrongHistoryRef.current && wrongHistoryRef.current.length > 0) {
+              params.append("wrong_history", wrongHistoryRef.current.join(","));
+          }
+          if (totalAttemptedRef.current !== undefined) {
+              params.append("current_index", String(totalAttemptedRef.current + i));
+          }
+      }
+      if (settings?.hardDistractors) params.append("distractors", "hard");
+      const url = `${API_BASE}/api/problem?${params.toString()}&t=${Date.now()}`;
+      const res = await fetch(url, {
+          cache: "no-store",
+          // ログイン中は苦手優先（間隔反復）の出題にユーザー情報を使う
+          headers: getToken() ? { Authorization: `Bearer ${getToken()}` } : {},
+      });
+      if (res.status === 404 && sessionId) {
+          // セッションが期限切れなら、このプレイの残りは従来のクエリで問い合わせる
+          soloSessionRef.current = null;
+          return fetchProblem(i);
+      }
+      return res.json();
+  }, [roomId, setId, seed, settings?.hardDistractors]);
+
   const loadProblem = useCallback(async () => {
       const requestId = latestRequestId.current + 1;
       latestRequestId.current = requestId;
@@ -75,19 +123,14 @@ function GameMobile({
           let accumulatedOptions: Problem[] = [];
 
           for (let i = 0; i < splitCount; i++) {
-              const params = new URLSearchParams();
-              if (roomId) params.append("room_id", roomId);
-              if (setId) params.append("set_id", setId);
-              if (seed) params.append("seed", `${seed}-${i}`);
-              if (wrongHistoryRef.current && wrongHistoryRef.current.length > 0) {
-                  params.append("wrong_history", wrongHistoryRef.current.join(","));
-              }
-              if (totalAttemptedRef.current !== undefined) {
-                  params.append("current_index", String(totalAttemptedRef.current + i));
+              const bundle = bundleRef.current;
+              if (canPlayLocally(bundle, settings?.hardDistractors)) {
+                  const local = pickProblem(bundle, (totalAttemptedRef.current ?? 0) + i, saltRef.current, wrongHistoryRef.current);
+                  newProblems.push(local.correct);
+                  accumulatedOptions = [...accumulatedOptions, ...local.options];
+                  continue;
               }
-              const url = `${API_BASE}/api/problem?${params.toString()}&t=${Date.now()}`;
-              const res = await fetch(url, { cache: "no-store" });
-              const data: ApiResponse = await res.json();
+              const data = await fetchProblem(i);
               newProblems.push(data.correct);
               accumulatedOptions = [...accumulatedOptions, ...data.options];
           }
@@ -119,7 +162,7 @@ function GameMobile({
           console.error(e);
           setIsFetching(false);
       }
-  }, [roomId, setId, seed, MEMORIZE_TIME, ANSWER_TIME, splitCount]);
+  }, [fetchProblem, MEMORIZE_TIME, ANSWER_TIME, splitCount, settings?.hardDistractors]);
 
   useEffect(() => { 
     if (resetKey >= 0) loadProblem(); 
@@ -5,6 +5,8 @@ import GameMobile from './GameMobile';
 import ForestPath from './ForestPath';
 import { DEFAULT_SETTINGS, type Problem } from '../types';
 import { authFetch, getToken } from '../utils/auth';
+import { startSoloSession, reportSoloMiss } from '../utils/soloSession';
+import { loadBundle, canPlayLocally } from '../utils/bundles';
 import { useSound } from '../hooks/useSound';
 import { useBgm } from '../context/BgmContext';
 
@@ -39,6 +41,8 @@ function SoloMode({ onBack }: { onBack: () => void }) {
   const [missedKeyStats, setMissedKeyStats] = useState<{ [key: string]: number }>({});
   const [missedProblems, setMissedProblems] = useState<Problem[]>([]);
   const [wrongHistory, setWrongHistory] = useState<string[]>([]);
+  // サーバー側の出題状態（出題番号・間違えた単語）。作れなければ従来どおり wrongHistory を送る
+  const [soloSessionId, setSoloSessionId] = useState<string | null>(null);
 
   // ★ 追加: 〇✕表示用のステート
   const [roundResult, setRoundResult] = useState<'correct' | 'wrong' | null>(null);
@@ -111,6 +115,13 @@ function SoloMode({ onBack }: { onBack: () => void }) {
     setTotalAttempted(0);
     setCorrectOnFirstTry(0);
     setWrongHistory([]);
+    setSoloSessionId(null);
+    // バンドルで手元で出題できるセットはサーバーに問い合わせないので、セッションも作らない
+    (setId ? loadBundle(CURRENT_SET_ID) : Promise.resolve(null)).then(bundle => {
+      if (!canPlayLocally(bundle, settings?.hardDistractors)) {
+        startSoloSession(CURRENT_SET_ID).then(setSoloSessionId);
+      }
+    });
     setMyTypoCount(0);
     setMissedKeyStats({});
     setMissedProblems([]);
@@ -162,7 +173,7 @@ function SoloMode({ onBack }: { onBack: () => void }) {
   const recordStat = async (wordText: string, isCorrect: boolean) => {
     if (!getToken()) return;
     try {
-      await authFetch(`/api/word_stats?word_text=${encodeURIComponent(wordText)}&is_correct=${isCorrect}`, {
+      await authFetch(`/api/word_stats?word_text=${encodeURIComponent(wordText)}&is_correct=${isCorrect}&set_id=${encodeURIComponent(CURRENT_SET_ID)}`, {
         method: 'POST'
       });
     } catch (e) {
@@ -200,6 +211,7 @@ function SoloMode({ onBack }: { onBack: () => void }) {
     const newTotal = totalAttempted + 1;
     setMissedProblems(prev => [...prev, problem]);
     setWrongHistory(prev => [...prev, problem.text]);
+    if (soloSessionId) reportSoloMiss(soloSessionId, problem.text);
     setTotalAttempted(newTotal);
 
     // ★ ✕を表示
@@ -270,9 +282,14 @@ function SoloMode({ onBack }: { onBack: () => void }) {
             accuracy: accuracy,
             avg_speed: avgSpeed
         };
+        const token = getToken();
         await fetch(`${API_BASE}/api/ranking`, {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
+          headers: {
+            "Content-Type": "application/json",
+            // ログイン中なら戦績にも反映される
+            ...(token ? { Authorization: `Bearer ${token}` } : {}),
+          },
           body: JSON.stringify(bodyData),
         });
         fetchRanking();
@@ -377,10 +394,10 @@ function SoloMode({ onBack }: { onBack: () => void }) {
                             w-[85vw] max-w-[400px] h-[60vh] min-h-[450px] md:w-auto md:max-w-none md:h-[65vh] md:aspect-[16/9]">
               {isMobile ? (
                 <GameMobile onScore={handleScore} onWrong={handleWrong} resetKey={resetKey} 
-                    isSoloMode setId={setId} settings={settings} wrongHistory={wrongHistory} totalAttempted={totalAttempted} />
+                    isSoloMode setId={setId} settings={settings} wrongHistory={wrongHistory} totalAttempted={totalAttempted} soloSessionId={soloSessionId} />
               ) : (
                 <GamePC onScore={handleScore} onWrong={handleWrong} onTypo={handleTypo} resetKey={resetKey}
-                    isSoloMode settings={settings} setId={setId} wrongHistory={wrongHistory} totalAttempted={totalAttempted} />
+                    isSoloMode settings={settings} setId={setId} wrongHistory={wrongHistory} totalAttempted={totalAttempted} soloSessionId={soloSessionId} />
               )}
             </div>
           </div>
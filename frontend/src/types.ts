@@ -29,6 +29,7 @@ export type GameSettings = {
   clearConditionValue?: number;
   conditionType?: 'score' | 'total';
   answerTime?: number;
+  hardDistractors?: boolean; // 選択肢を似た単語から選ぶ
 };
 
 export const DEFAULT_SETTINGS: GameSettings = {
@@ -0,0 +1,120 @@
+// frontend/src/utils/bundles.ts
+import type { Problem } from '../types';
+import { getToken } from './auth';
+
+const API_BASE = (import.meta.env.VITE_API_URL || "http://127.0.0.1:8000").replace(/\/$/, "");
+const STORAGE_PREFIX = "bundle:";
+
+export type SetBundle = {
+  hash: string;
+  setId: string;
+  title: string;
+  words: Problem[];
+  settings: {
+    memorizeTime: number;
+    answerTime: number;
+    questionsPerRound: number;
+    winScore: number;
+    conditionType: string;
+    orderType: string;
+  };
+  seeds: number[];
+};
+
+// ハッシュ -> バンドル（同じ内容は二度パースしない）
+const memo = new Map<string, SetBundle>();
+
+const readStored = (setId: string): SetBundle | null => {
+  try {
+    const raw = localStorage.getItem(STORAGE_PREFIX + setId);
+    return raw ? JSON.parse(raw) : null;
+  } catch {
+    return null;
+  }
+};
+
+/**
+ * セットのバンドルを取得する。
+ * 現在のハッシュだけをサーバーに問い合わせ、中身はハッシュ付き URL から取る（ブラウザが永続キャッシュする）。
+ * オフラインなどで問い合わせに失敗した場合は、最後に使ったバンドルを返す。
+ */
+export const loadBundle = async (setId: string): Promise<SetBundle | null> => {
+  try {
+    const token = getToken();
+    const res = await fetch(`${API_BASE}/api/sets/${encodeURIComponent(setId)}/bundle`, {
+      headers: token ? { Authorization: `Bearer ${token}` } : {},
+    });
+    if (!res.ok) return null;
+    const { hash, url } = await res.json();
+    const cached = memo.get(hash);
+    if (cached) return cached;
+
+    const stored = readStored(setId);
+    let bundle: SetBundle;
+    if (stored && stored.hash === hash) {
+      bundle = stored;
+    } else {
+      const bundleRes = await fetch(`${API_BASE}${url}`);
+      if (!bundleRes.ok) return null;
+      bundle = await bundleRes.json();
+      try {
+        localStorage.setItem(STORAGE_PREFIX + setId, JSON.stringify(bundle));
+      } catch {
+        // 容量オーバーなどは無視（次回もネットワークから取る）
+      }
+    }
+    memo.set(hash, bundle);
+    return bundle;
+  } catch {
+    return readStored(setId);
+  }
+};
+
+// 32bit シードの軽量 PRNG (mulberry32)
+const mulberry32 = (seed: number) => () => {
+  seed = (seed + 0x6D2B79F5) | 0;
+  let t = Math.imul(seed ^ (seed >>> 15), 1 | seed);
+  t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t;
+  return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+};
+
+/** サーバーに聞かずに出題できるか（苦手優先のログイン出題はサーバーの復習キューを使う） */
+export const canPlayLocally = (bundle: SetBundle | null, hardDistractors?: boolean): bundle is SetBundle =>
+  !!bundle && bundle.words.length > 0 && !hardDistractors &&
+  !(bundle.settings.orderType === "review" && getToken());
+
+/**
+ * /api/problem と同じ規則で1問選ぶ。
+ * index 番目の問題にはシード表の index 番目（salt で対局ごとにずらす）を使う。
+ */
+export const pickProblem = (bundle: SetBundle, index: number, salt: number, wrongHistory: string[] = []) => {
+  const words = bundle.words;
+  const rand = mulberry32((bundle.seeds[index % bundle.seeds.length] ^ salt) + Math.floor(index / bundle.seeds.length));
+  const randIndex = (n: number) => Math.floor(rand() * n);
+
+  let correct: Problem;
+  if (bundle.settings.orderType === "sequential") {
+    correct = words[index % words.length];
+  } else if (bundle.settings.orderType === "review") {
+    const pool: Problem[] = [];
+    words.forEach(w => { for (let i = 0; i < (wrongHistory.includes(w.text) ? 5 : 1); i++) pool.push(w); });
+    correct = pool[randIndex(pool.length)];
+  } else {
+    correct = words[randIndex(words.length)];
+  }
+
+  const options: Problem[] = [correct];
+  const seen = new Set([correct.text]);
+  for (let tries = 0; options.length < 4 && tries < words.length * 2; tries++) {
+    const w = words[randIndex(words.length)];
+    if (!seen.has(w.text)) {
+      seen.add(w.text);
+      options.push(w);
+    }
+  }
+  for (let i = options.length - 1; i > 0; i--) {
+    const j = randIndex(i + 1);
+    [options[i], options[j]] = [options[j], options[i]];
+  }
+  return { correct, options };
+};
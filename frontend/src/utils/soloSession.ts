@@ -0,0 +1,31 @@
+// frontend/src/utils/soloSession.ts
+import { getToken } from './auth';
+
+const API_BASE = (import.meta.env.VITE_API_URL || "http://127.0.0.1:8000").replace(/\/$/, "");
+
+/**
+ * ソロプレイ1回分の出題状態をサーバーに作る。
+ * 以後の /api/problem は session_id だけで済む（作れなければ null を返し、従来のクエリで問い合わせる）。
+ */
+export const startSoloSession = async (setId: string): Promise<string | null> => {
+  try {
+    const res = await fetch(`${API_BASE}/api/solo/sessions?set_id=${encodeURIComponent(setId)}`, {
+      method: "POST",
+      headers: getToken() ? { Authorization: `Bearer ${getToken()}` } : {},
+    });
+    if (!res.ok) return null;
+    const data: { sessionId: string } = await res.json();
+    return data.sessionId;
+  } catch {
+    return null;
+  }
+};
+
+/** 間違えた単語をセッションに記録する（苦手優先モードの出題に使われる） */
+export const reportSoloMiss = (sessionId: string, wordText: string) => {
+  fetch(`${API_BASE}/api/solo/sessions/${encodeURIComponent(sessionId)}/misses?word_text=${encodeURIComponent(wordText)}`, {
+    method: "POST",
+  }).catch(() => {
+    // 記録できなくても出題が偏らないだけなので無視する
+  });
+};